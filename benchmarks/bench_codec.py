@@ -0,0 +1,87 @@
+"""Сравнение бинарного формата ERAP и json (send_json/recv_json) на типичных пакетах кольца
+и стоимости пересылки пакета промежуточным узлом в зависимости от размера payload.
+
+Запуск: python -m benchmarks.bench_codec --nodes 200
+"""
+
+import json
+import argparse
+import timeit
+
+import zmq
+
+from src.codec import PacketCodec
+
+
+def typical_packets(ring_size: int) -> dict:
+    return {
+        'heartbeat': {'heartbeat': 17},
+        'event': {'event': 'neighbour_gone', 'neighbour_ip': '10.20.18.1', 'neighbour_node': 18,
+                  'sender_node': 17, 'from': '10.20.17.1', 'to': '10.20.16.1'},
+        'command': {'command': 'update', 'message': {'version': '1.2.3', 'force': True},
+                    'sender_node': 17, 'from': '10.20.17.1', 'to': '10.20.16.1'},
+        f'nodes_{ring_size}': {'nodes_in_network': list(range(1, ring_size + 1)),
+                               'sender_node': 17, 'from': '10.20.17.1', 'to': '10.20.16.1'},
+    }
+
+
+def per_packet_us(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def bench_codec(codec: PacketCodec, ring_size: int, number: int) -> None:
+    print(f'{"packet":<12}{"json B":>8}{"erap B":>8}{"json enc":>10}{"erap enc":>10}'
+          f'{"json dec":>10}{"erap dec":>10}   (us/packet)')
+    for name, packet in typical_packets(ring_size).items():
+        json_data = json.dumps(packet).encode('utf-8')
+        binary_frames = codec.encode(codec.to_message(packet), binary=True)
+
+        json_encode = per_packet_us(lambda: json.dumps(packet).encode('utf-8'), number)
+        binary_encode = per_packet_us(lambda: codec.encode(codec.to_message(packet), binary=True), number)
+        json_decode = per_packet_us(lambda: json.loads(json_data), number)
+        binary_decode = per_packet_us(lambda: codec.to_packet(codec.decode(binary_frames)[0]), number)
+
+        print(f'{name:<12}{len(json_data):>8}{sum(map(len, binary_frames)):>8}{json_encode:>10.2f}'
+              f'{binary_encode:>10.2f}{json_decode:>10.2f}{binary_decode:>10.2f}')
+
+
+def bench_forwarding(codec: PacketCodec, number: int) -> None:
+    """Стоимость пересылки: json - полный разбор, замена from/to и сборка пакета,
+    erap - разбор и перезапись только заголовка, кадр payload передаётся как есть
+    """
+
+    print(f'\n{"payload B":<12}{"json fwd":>10}{"erap fwd":>10}   (us/hop)')
+    for size in (100, 10_000, 1_000_000):
+        packet = {'command': 'telemetry', 'message': 'x' * size, 'sender_node': 17,
+                  'from': '10.20.17.1', 'to': '10.20.16.1'}
+        json_data = json.dumps(packet).encode('utf-8')
+        frames = codec.encode(codec.to_message(packet), binary=True)
+        frames = [frames[0], zmq.Frame(frames[1])]
+
+        def forward_json():
+            received = json.loads(json_data)
+            received.update({'from': '10.20.16.1', 'to': '10.20.15.1'})
+            return json.dumps(received).encode('utf-8')
+
+        def forward_binary():
+            message, _ = codec.decode(frames)
+            message.sender_neighbour, message.addressee = 16, 15
+            return codec.encode(message, binary=True)
+
+        repeat = max(number // (1 + size // 1000), 10)
+        print(f'{size:<12}{per_packet_us(forward_json, repeat):>10.2f}{per_packet_us(forward_binary, repeat):>10.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=200, help='размер кольца для пакета nodes_in_network')
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    codec = PacketCodec()
+    bench_codec(codec, args.nodes, args.number)
+    bench_forwarding(codec, args.number)
+
+
+if __name__ == '__main__':
+    main()
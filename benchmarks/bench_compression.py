@@ -0,0 +1,88 @@
+"""Сжатие payload на линиях кольца: байты в сети против добавленного времени процессора.
+
+Для каждого пакета печатается размер кадров без сжатия, со сжатием zlib без словаря и с общим
+словарём, время сжатия на первом узле и время пересылки промежуточным узлом: сжатый payload
+пересылается как есть, поэтому на промежуточных узлах стоимость почти не меняется, а разжимается
+он только там, где пакет читают.
+
+Запуск: python -m benchmarks.bench_compression --nodes 250
+"""
+
+import json
+import zlib
+import random
+import argparse
+
+from src.codec import PacketCodec, COMPRESSED
+from src.compression import compress, decompress
+from .bench_codec import per_packet_us
+
+
+def large_packets(ring_size: int) -> dict:
+    generator = random.Random(1)
+    nodes = list(range(1, ring_size + 1))
+    return {
+        'event': {'event': 'neighbour_gone', 'neighbour_ip': '10.20.18.1', 'neighbour_node': 18,
+                  'sender_node': 17, 'from': '10.20.17.1', 'to': '10.20.16.1'},
+        f'gossip_{ring_size}': {'gossip': {'d': generator.getrandbits(64), 'full': 1,
+                                           'm': [[node, generator.randrange(1, 5000), 1] for node in nodes]},
+                                'sender_node': 17},
+        f'all_nodes_{ring_size}': {'command': 'nodes', 'message': {
+            str(node): [f'10.20.{node}.1', 1700000000 + generator.randrange(10 ** 6)] for node in nodes},
+                                   'sender_node': 17, 'from': '10.20.17.1', 'to': '10.20.16.1'},
+        'telemetry': {'command': 'telemetry', 'message': {
+            'cpu': 12.5, 'memory': 734003200, 'uptime': 86400,
+            'interfaces': [{'name': f'eth{index}', 'rx_bytes': generator.randrange(10 ** 9),
+                            'tx_bytes': generator.randrange(10 ** 9), 'up': True} for index in range(8)]},
+                      'sender_node': 17, 'from': '10.20.17.1', 'to': '10.20.16.1'},
+    }
+
+
+def measure(packet: dict, threshold: int, number: int) -> dict:
+    plain_codec = PacketCodec()
+    codec = PacketCodec(compression_threshold=threshold)
+
+    plain = plain_codec.encode(plain_codec.to_message(packet), binary=True)
+    compressed = codec.encode(codec.to_message(packet), binary=True, compress_payload=True)
+    payload = plain[1] if len(plain) > 1 else b''
+    received, _ = codec.decode(compressed)
+
+    def forward(frames_codec: PacketCodec, frames: list, compress_payload: bool):
+        message, _ = frames_codec.decode(frames)
+        message.sender_neighbour, message.addressee = 16, 15
+        return frames_codec.encode(message, binary=True, compress_payload=compress_payload)
+
+    return {'plain_bytes': sum(map(len, plain)),
+            'zlib_bytes': len(plain[0]) + len(zlib.compress(payload, 6)[2:-4]) if payload else len(plain[0]),
+            'dictionary_bytes': sum(map(len, compressed)),
+            'compress_us': per_packet_us(lambda: compress(payload), number) if payload else 0.0,
+            'decompress_us': per_packet_us(lambda: decompress(received.payload), number)
+            if received.flags & COMPRESSED else 0.0,
+            'plain_hop_us': per_packet_us(lambda: forward(plain_codec, plain, False), number),
+            'compressed_hop_us': per_packet_us(lambda: forward(codec, compressed, True), number)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=250, help='размер кольца для gossip и списка узлов')
+    parser.add_argument('--threshold', type=int, default=512, help='порог сжатия, байт')
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--json', action='store_true', help='результат в json')
+    args = parser.parse_args()
+
+    results = {name: measure(packet, args.threshold, args.number)
+               for name, packet in large_packets(args.nodes).items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f'{"packet":<16}{"plain B":>9}{"zlib B":>9}{"dict B":>9}{"compress":>10}{"decompress":>12}'
+          f'{"plain hop":>11}{"comp hop":>10}   (us)')
+    for name, result in results.items():
+        print(f'{name:<16}{result["plain_bytes"]:>9}{result["zlib_bytes"]:>9}{result["dictionary_bytes"]:>9}'
+              f'{result["compress_us"]:>10.2f}{result["decompress_us"]:>12.2f}'
+              f'{result["plain_hop_us"]:>11.2f}{result["compressed_hop_us"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Сравнение последовательного и параллельного поиска соседей на наборе локальных слушателей.
+
+Живые узлы - обычные слушающие сокеты на 127.0.X.1, "молчащие" узлы - слушатели
+с переполненной очередью подключений, на которых подключение висит до таймаута,
+как на недоступном хосте в реальной сети.
+
+Запуск: python -m benchmarks.bench_discovery --live 40,200 --silent 0.5
+"""
+
+import time
+import random
+import socket
+import argparse
+
+from src.discovery import NeighbourDiscovery
+
+
+def loopback_address(node: int) -> str:
+    return f'127.0.{node}.1'
+
+
+def start_fake_nodes(live: set, silent: set) -> tuple:
+    sockets = []
+    port = 0
+    for node in sorted(live | silent):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((loopback_address(node), port))
+        port = listener.getsockname()[1]
+        sockets.append(listener)
+
+        if node in live:
+            listener.listen(64)
+            continue
+
+        # очередь на 1 подключение заполняется, дальнейшие SYN ядро молча отбрасывает
+        listener.listen(0)
+        for _ in range(3):
+            filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            filler.setblocking(False)
+            filler.connect_ex((loopback_address(node), port))
+            sockets.append(filler)
+
+    time.sleep(0.1)
+    return port, sockets
+
+
+def sequential_search(node_id: int, port: int, timeout: float) -> tuple:
+    """Поиск соседей по одному узлу за раз, как это делал NodeMonitor до параллельного поиска"""
+
+    def search(order):
+        for node in order:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_client_socket:
+                tcp_client_socket.settimeout(timeout)
+                if tcp_client_socket.connect_ex((loopback_address(node), port)) == 0:
+                    return loopback_address(node)
+        return False
+
+    right = search([(node_id + distance - 1) % 255 + 1 for distance in range(1, 255)])
+    left = search([(node_id - distance - 1) % 255 + 1 for distance in range(1, 255)])
+
+    return left, right
+
+
+def measure(function, repeat: int) -> tuple:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--node', type=int, default=1)
+    parser.add_argument('--live', default='128,200', help='номера живых узлов через запятую')
+    parser.add_argument('--silent', type=float, default=0.3, help='доля молчащих узлов среди остальных')
+    parser.add_argument('--timeout', type=float, default=0.15)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    live = {int(node) for node in args.live.split(',')}
+    others = [node for node in range(1, 256) if node not in live and node != args.node]
+    silent = set(random.Random(args.seed).sample(others, int(len(others) * args.silent)))
+    port, sockets = start_fake_nodes(live, silent)
+
+    try:
+        discovery = NeighbourDiscovery(node_id=args.node, port=port, concurrency=args.concurrency,
+                                       timeout=args.timeout, address_of=loopback_address)
+        parallel, parallel_time = measure(discovery.find_neighbors, args.repeat)
+        sequential, sequential_time = measure(lambda: sequential_search(args.node, port, args.timeout),
+                                              args.repeat)
+    finally:
+        for open_socket in sockets:
+            open_socket.close()
+
+    assert parallel == sequential, (parallel, sequential)
+    print(f'live={sorted(live)} silent={len(silent)} timeout={args.timeout}s concurrency={args.concurrency}')
+    print(f'neighbours:  {parallel}')
+    print(f'sequential:  {sequential_time * 1000:9.1f} ms')
+    print(f'parallel:    {parallel_time * 1000:9.1f} ms  ({sequential_time / parallel_time:.1f}x)')
+    print(f'probes:      {discovery.probes_started // args.repeat} per search')
+
+
+if __name__ == '__main__':
+    main()
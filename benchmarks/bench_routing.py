@@ -0,0 +1,65 @@
+"""Сравнение адресной доставки по соседям кольца и через finger table на смоделированном кольце.
+
+Для случайных пар узлов пакет проходит путь по таблицам маршрутизации всех узлов кольца,
+считается число переходов. Задержка доставки оценивается как число переходов, умноженное
+на задержку канала и измеренную стоимость обработки пакета промежуточным узлом
+(разбор заголовка и пересылка кадров).
+
+Запуск: python -m benchmarks.bench_routing --nodes 200 --link-latency-us 200
+"""
+
+import random
+import argparse
+import statistics
+import timeit
+
+from src.codec import PacketCodec
+from src.routing_table import RingRoutingTable
+
+
+def route_hops(tables: dict, source: int, target: int, shortcuts: bool) -> int:
+    current, hops = source, 0
+    while current != target:
+        current = tables[current].unicast_hop(target, shortcuts=shortcuts)
+        hops += 1
+    return hops
+
+
+def per_hop_processing_us(codec: PacketCodec, number: int = 20000) -> float:
+    packet = {'command': 'reboot', 'message': {'delay': 5}, 'sender_node': 17, 'target': 90,
+              'from': '10.20.17.1', 'to': '10.20.16.1'}
+    frames = codec.encode(codec.to_message(packet), binary=True)
+
+    def forward():
+        message, _ = codec.decode(frames)
+        message.sender_neighbour, message.addressee = 16, 15
+        return codec.encode(message, binary=True)
+
+    return min(timeit.repeat(forward, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--pairs', type=int, default=5000)
+    parser.add_argument('--link-latency-us', type=float, default=200, help='задержка одного канала, мкс')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    nodes = sorted(rng.sample(range(1, 65535), args.nodes))
+    tables = {node: RingRoutingTable(node, nodes) for node in nodes}
+    pairs = [tuple(rng.sample(nodes, 2)) for _ in range(args.pairs)]
+    hop_cost = args.link_latency_us + per_hop_processing_us(PacketCodec())
+
+    print(f'ring of {args.nodes} nodes, {args.pairs} random pairs, {hop_cost:.1f} us per hop')
+    print(f'{"mode":<8}{"avg hops":>10}{"p99 hops":>10}{"max hops":>10}{"avg ms":>10}{"p99 ms":>10}')
+    for mode, shortcuts in (('ring', False), ('finger', True)):
+        hops = sorted(route_hops(tables, source, target, shortcuts) for source, target in pairs)
+        p99 = hops[int(len(hops) * 0.99) - 1]
+        print(f'{mode:<8}{statistics.mean(hops):>10.1f}{p99:>10}{hops[-1]:>10}'
+              f'{statistics.mean(hops) * hop_cost / 1000:>10.2f}{p99 * hop_cost / 1000:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Набор замеров горячих путей узла с машиночитаемым результатом и сравнением с сохранённым базовым.
+
+Замеры:
+    identify_addressee - выбор следующего узла для пакета в кольце (мкс/пакет)
+    set_nodes_dict - добавление списка узлов кольца, в первый раз и повторно (мкс/вызов)
+    json/erap encode, decode - кодирование и разбор типичных пакетов (мкс/пакет)
+    check_back_neighbors - проверка вернувшихся соседей с подсчётом расстояний (мкс/вызов)
+    wire_bytes, compress - размер сжатых пакетов в сети и время их сжатия на первом узле (мкс/пакет)
+    broadcast - задержка доставки команды всем узлам и пропускная способность
+                на кольце симулятора через tcp на loopback
+
+Результат - json вида {"meta": {...}, "results": {имя: {"value", "unit", "better"}}},
+better - "lower" или "higher". С --baseline замеры сравниваются с базовыми, и если хоть один
+ухудшился больше порога, код возврата 1.
+
+Запуск: python -m benchmarks.suite --baseline benchmarks/baseline.json
+        python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+
+import zmq
+
+from src.codec import PacketCodec
+from src.logging_config import configure_logging, DEFAULT_LEVELS
+from src.node_monitor import NodeMonitor
+from src.simulator import RingSimulator, SimulatedNetwork
+from src.zmq_pipeline import ZmqPipelineNode
+from .bench_codec import typical_packets, per_packet_us
+from .bench_compression import large_packets, measure
+
+
+def result(value: float, unit: str, better: str = 'lower') -> dict:
+    return {'value': round(value, 3), 'unit': unit, 'better': better}
+
+
+def bench_identify_addressee(context: zmq.Context, ring_size: int, number: int) -> dict:
+    pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.100.1', neighbors=[], context=context)
+    pipeline.set_nodes_dict(list(range(1, ring_size + 1)))
+    codec = pipeline.codec
+    messages = [codec.to_message({'command': 'update', 'message': {}, 'sender_node': 17,
+                                  'from': f'10.20.{sender}.1', 'to': '10.20.100.1'})
+                for sender in (99, 101)]
+    identify = pipeline._ZmqPipelineNode__identify_addressee
+
+    def route():
+        for message in messages:
+            identify(message)
+
+    return {f'identify_addressee_{ring_size}': result(per_packet_us(route, number) / len(messages), 'us')}
+
+
+def bench_set_nodes_dict(context: zmq.Context, ring_size: int, number: int) -> dict:
+    nodes = list(range(1, ring_size + 1))
+
+    def cold():
+        ZmqPipelineNode(zmq_port=5555, host_ip='10.20.100.1', neighbors=[], context=context).set_nodes_dict(nodes)
+
+    warm_pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.100.1', neighbors=[], context=context)
+    warm_pipeline.set_nodes_dict(nodes)
+    # пустой конвейер без списка узлов - стоимость конструктора вычитается из холодного замера
+    empty = per_packet_us(lambda: ZmqPipelineNode(zmq_port=5555, host_ip='10.20.100.1',
+                                                  neighbors=[], context=context), number)
+
+    return {f'set_nodes_dict_cold_{ring_size}': result(max(per_packet_us(cold, number) - empty, 0.0), 'us'),
+            f'set_nodes_dict_warm_{ring_size}': result(per_packet_us(lambda: warm_pipeline.set_nodes_dict(nodes),
+                                                                     number), 'us')}
+
+
+def bench_codec(ring_size: int, number: int) -> dict:
+    codec = PacketCodec()
+    results = {}
+    for name, packet in typical_packets(ring_size).items():
+        json_data = json.dumps(packet).encode('utf-8')
+        binary_frames = codec.encode(codec.to_message(packet), binary=True)
+
+        results[f'json_encode_{name}'] = result(per_packet_us(lambda: json.dumps(packet).encode('utf-8'), number), 'us')
+        results[f'json_decode_{name}'] = result(per_packet_us(lambda: json.loads(json_data), number), 'us')
+        results[f'erap_encode_{name}'] = result(
+            per_packet_us(lambda: codec.encode(codec.to_message(packet), binary=True), number), 'us')
+        results[f'erap_decode_{name}'] = result(
+            per_packet_us(lambda: codec.to_packet(codec.decode(binary_frames)[0]), number), 'us')
+    return results
+
+
+def bench_check_back_neighbors(ring_size: int, number: int) -> dict:
+    my_node = ring_size // 2
+    monitor = NodeMonitor(node_id=my_node, ping_port=80, host_ip=f'10.20.{my_node}.1')
+    monitor.set_neighbors([f'10.20.{my_node - 2}.1', f'10.20.{my_node + 2}.1'])
+    nodes = {node: None for node in range(1, ring_size + 1)}
+    new_neighbors = [f'10.20.{my_node - 1}.1', f'10.20.{my_node + 1}.1']
+
+    return {f'check_back_neighbors_{ring_size}': result(
+        per_packet_us(lambda: monitor.check_back_neighbors(new_neighbors, nodes), number), 'us')}
+
+
+def bench_compression(ring_size: int, number: int) -> dict:
+    results = {}
+    for name, packet in large_packets(ring_size).items():
+        measured = measure(packet, threshold=512, number=number)
+        results[f'wire_bytes_{name}'] = result(measured['dictionary_bytes'], 'B')
+        results[f'compress_{name}'] = result(measured['compress_us'], 'us')
+    return results
+
+
+def bench_broadcast(ring_size: int, latency_samples: int, commands: int, broadcast_mode: str = 'ring') -> dict:
+    node_ids = sorted(random.Random(1).sample(range(1, 255), ring_size))
+    simulator = RingSimulator(SimulatedNetwork(transport='tcp'), broadcast_mode=broadcast_mode)
+    try:
+        simulator.start(node_ids)
+        if simulator.wait_converged(timeout=60) is None:
+            raise RuntimeError(f'Кольцо из {ring_size} узлов не сошлось')
+
+        latencies = sorted(simulator.broadcast_latency(node_ids[0], latency_samples))
+        throughput = simulator.broadcast_commands(node_ids[0], commands)
+    finally:
+        simulator.stop()
+
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)] if latencies else float('inf')
+    return {f'broadcast_latency_p50_{ring_size}': result(statistics.median(latencies) * 1000 if latencies
+                                                         else float('inf'), 'ms'),
+            f'broadcast_latency_p95_{ring_size}': result(p95 * 1000, 'ms'),
+            f'broadcast_delivered_ratio_{ring_size}': result(
+                (len(latencies) + throughput['delivered']) / (latency_samples + commands), 'ratio', 'higher'),
+            f'broadcast_packets_per_second_{ring_size}': result(throughput['deliveries_per_second'],
+                                                                'packets/s', 'higher')}
+
+
+def run(args) -> dict:
+    context = zmq.Context()
+    results = {}
+    try:
+        results.update(bench_identify_addressee(context, args.ring_size, args.number))
+        results.update(bench_set_nodes_dict(context, args.ring_size, max(args.number // 100, 10)))
+    finally:
+        context.destroy(linger=0)
+    results.update(bench_codec(args.ring_size, args.number))
+    results.update(bench_check_back_neighbors(args.monitor_ring_size, max(args.number // 100, 10)))
+    results.update(bench_compression(args.monitor_ring_size, max(args.number // 100, 10)))
+    if not args.skip_broadcast:
+        results.update(bench_broadcast(args.broadcast_nodes, args.latency_samples, args.commands,
+                                       args.broadcast_mode))
+
+    return {'meta': {'python': platform.python_version(),
+                     'machine': platform.machine(),
+                     'zmq': zmq.zmq_version(),
+                     'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'ring_size': args.ring_size,
+                     'broadcast_nodes': args.broadcast_nodes,
+                     'broadcast_mode': args.broadcast_mode},
+            'results': results}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Возвращает строки отчёта о замерах, ухудшившихся относительно baseline больше чем на threshold"""
+
+    regressions = []
+    for name, measured in current['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None or not reference['value']:
+            continue
+        change = measured['value'] / reference['value'] - 1
+        worse = change > threshold if measured['better'] == 'lower' else -change > threshold
+        if worse:
+            regressions.append(f'{name}: {reference["value"]} -> {measured["value"]} {measured["unit"]} '
+                               f'({change:+.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ring-size', type=int, default=200, help='размер кольца для маршрутизации и кодека')
+    parser.add_argument('--monitor-ring-size', type=int, default=250, help='размер кольца для check_back_neighbors')
+    parser.add_argument('--broadcast-nodes', type=int, default=20, help='размер кольца симулятора')
+    parser.add_argument('--broadcast-mode', choices=('ring', 'fanout'), default='ring',
+                        help='режим рассылки на кольце симулятора')
+    parser.add_argument('--latency-samples', type=int, default=50)
+    parser.add_argument('--commands', type=int, default=200, help='команд для замера пропускной способности')
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--skip-broadcast', action='store_true', help='без замеров на симуляторе')
+    parser.add_argument('--baseline', help='файл базовых результатов для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.5, help='допустимое ухудшение, доля; микрозамеры на общей машине шумят на десятки процентов')
+    parser.add_argument('--save-baseline', help='сохранить результаты как базовые в файл')
+    parser.add_argument('--output', help='записать результаты в файл вместо stdout')
+    args = parser.parse_args()
+
+    configure_logging(default_level='WARNING', levels={category: 'WARNING' for category in DEFAULT_LEVELS},
+                      sink=sys.stderr)
+
+    current = run(args)
+    report = json.dumps(current, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as output:
+            output.write(report + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(current, json.load(baseline_file), args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
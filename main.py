@@ -1,7 +1,21 @@
 from src.node import Node
+from src.logging_config import configure_logging, parse_levels
 import sys
 sys.path.append(f'{sys.path[0]}/src')
 
 if __name__ == '__main__':
-    worker = Node()
-    worker.start_work()
+    # --log-levels=packets=DEBUG,mqtt=WARNING - уровни категорий, --log-enqueue - запись логов отдельным потоком
+    levels = {}
+    for argument in sys.argv:
+        if argument.startswith('--log-levels='):
+            levels = parse_levels(argument.partition('=')[2])
+    configure_logging(levels=levels, enqueue='--log-enqueue' in sys.argv)
+
+    if '--asyncio' in sys.argv:
+        import asyncio
+        from src.async_node import AsyncNode
+
+        asyncio.run(AsyncNode().run())
+    else:
+        worker = Node()
+        worker.start_work()
@@ -0,0 +1,116 @@
+import abc
+import socket
+import ipaddress
+
+from typing import Sequence
+
+
+class AddressPlan(abc.ABC):
+    """Соответствие номеров узлов кольца и их адресов.
+
+    Кольцо, маршрутизация и поиск соседей работают с целыми номерами узлов, а адрес нужен
+    только для подключения. Оба направления преобразования берутся из заранее
+    посчитанных словарей, так что на каждый пакет строки не разбираются
+    """
+
+    @abc.abstractmethod
+    def address_of(self, node: int) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def node_of(self, address: str) -> int:
+        """Номер узла по адресу, ValueError - если адрес не входит в план"""
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def nodes(self) -> Sequence[int]:
+        """Все возможные номера узлов по возрастанию - порядок кольца"""
+
+        raise NotImplementedError
+
+    def contains(self, address: str) -> bool:
+        try:
+            self.node_of(address)
+        except ValueError:
+            return False
+        return True
+
+    @property
+    def max_node(self) -> int:
+        return self.nodes()[-1]
+
+
+class CidrAddressPlan(AddressPlan):
+    """Адреса узлов вычисляются из сети network: узлу node соответствует адрес
+    network + node * stride + offset. По умолчанию это прежняя схема 10.20.<node>.1
+    на 255 узлов, а например CidrAddressPlan('10.0.0.0/16', stride=1) даёт 65534 узла.
+    Номера узлов в заголовке пакета - uint16, поэтому больше 65535 узлов план не выдаёт
+    """
+
+    def __init__(self, network: str = '10.20.0.0/16', stride: int = 256, offset: int = 1):
+        self.network = ipaddress.IPv4Network(network)
+        self.stride = stride
+        self.offset = offset
+        self._base = int(self.network.network_address)
+        last = (self.network.num_addresses - 1 - offset) // stride
+        # последний адрес сети - широковещательный, если узел на него попадает, он исключается
+        if last * stride + offset >= self.network.num_addresses - 1:
+            last -= 1
+        self._nodes = range(1, min(last, 65535) + 1)
+        self._addresses: dict = {}
+        self._node_by_address: dict = {}
+
+    def address_of(self, node: int) -> str:
+        address = self._addresses.get(node)
+        if address is None:
+            if node not in self._nodes:
+                raise ValueError(f'Узел {node} вне плана адресов {self.network}')
+            address = self._addresses[node] = socket.inet_ntoa((self._base + node * self.stride + self.offset)
+                                                               .to_bytes(4, 'big'))
+        return address
+
+    def node_of(self, address: str) -> int:
+        node = self._node_by_address.get(address)
+        if node is None:
+            try:
+                position = int.from_bytes(socket.inet_aton(address), 'big') - self._base - self.offset
+            except OSError:
+                raise ValueError(f'Некорректный адрес {address}') from None
+            node, remainder = divmod(position, self.stride)
+            if remainder or node not in self._nodes:
+                raise ValueError(f'Адрес {address} не входит в план адресов {self.network}')
+            self._node_by_address[address] = node
+        return node
+
+    def nodes(self) -> Sequence[int]:
+        return self._nodes
+
+
+class TableAddressPlan(AddressPlan):
+    """Адреса узлов из таблицы {номер узла: адрес}, например из файла конфигурации"""
+
+    def __init__(self, table: dict):
+        self._addresses = {int(node): address for node, address in table.items()}
+        self._node_by_address = {address: node for node, address in self._addresses.items()}
+        if len(self._node_by_address) != len(self._addresses):
+            raise ValueError('У разных узлов в таблице одинаковые адреса')
+        self._nodes = tuple(sorted(self._addresses))
+
+    def address_of(self, node: int) -> str:
+        try:
+            return self._addresses[node]
+        except KeyError:
+            raise ValueError(f'Узел {node} отсутствует в таблице адресов') from None
+
+    def node_of(self, address: str) -> int:
+        try:
+            return self._node_by_address[address]
+        except KeyError:
+            raise ValueError(f'Адрес {address} отсутствует в таблице адресов') from None
+
+    def nodes(self) -> Sequence[int]:
+        return self._nodes
+
+
+DEFAULT_ADDRESS_PLAN = CidrAddressPlan()
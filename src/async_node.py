@@ -0,0 +1,137 @@
+import time
+import asyncio
+
+from .logging_config import get_logger
+from .node import Node
+from .mqtt_worker import AsyncioMqttLoop
+
+logger = get_logger('node')
+
+
+class AsyncNode(Node):
+    """Узел, работающий в одном event loop asyncio вместо потоков и блокирующих вызовов:
+    приём zmq - задача с zmq.asyncio, сетевой цикл mqtt - AsyncioMqttLoop,
+    поиск и проверка соседей - неблокирующие подключения, ожидания - asyncio.sleep.
+
+    Логика кольца и обработка пакетов общие с Node, поэтому пакеты обрабатываются
+    так же, как в потоковом варианте
+    """
+
+    def __init__(self):
+        # вся инициализация с ожиданием сети выполняется в run()
+        self._started_at = time.monotonic()
+        self._neighbors: list = []
+        self._mqtt_loop = None
+
+    async def run(self) -> None:
+        logger.info('Старт инициализации')
+        loop = asyncio.get_running_loop()
+
+        # get_my_ip может ждать появления интерфейса - в отдельном потоке, чтобы не блокировать loop
+        await asyncio.to_thread(self._configure)
+        # команды из mqtt и публикация тоже обрабатываются в этом event loop, а не в своих потоках
+        self._create_components(mqtt_connect=False, event_loop=True)
+        # приём начинается сразу, а подключение к брокеру идёт одновременно с поиском соседей.
+        # Сокет уже подключённого клиента AsyncioMqttLoop подхватывает при старте
+        receiver = loop.create_task(self.zmq_pipeline.handle_received_packet_async(self.mqtt_worker))
+        neighbors, _ = await asyncio.gather(self.__timed_async('discovery', self.__find_neighbors()),
+                                            self.__timed_async('mqtt_connect',
+                                                               asyncio.to_thread(self.mqtt_worker.connect)))
+        self._set_initial_neighbors(neighbors)
+        self._mqtt_loop = AsyncioMqttLoop(loop, self.mqtt_worker.client)
+        self._mqtt_loop.start()
+
+        logger.info('Node: {}', self._my_node)
+
+        self._neighbors_monitor.mqtt = self.mqtt_worker
+        self._start_metrics_server()
+
+        self.mqtt_worker.start_listening_topic(listen_topic='/leader/network', start_loop=False)
+        self._announce()
+
+        try:
+            if not await self.__wait_membership_synced():
+                return
+            self.mqtt_worker.publish_nodes(self.zmq_pipeline.get_all_node())
+            self._mark_ready()
+
+            await self.monitor_network_async()
+        finally:
+            receiver.cancel()
+            self._mqtt_loop.stop()
+
+    async def __wait_membership_synced(self) -> bool:
+        """Повторяет gossip, пока состояние не совпадёт хотя бы с одним соседом. False - узел остановлен раньше"""
+
+        synced = self.zmq_pipeline.membership_synced
+        while not synced.is_set():
+            # событие выставляет поток приёма, поэтому проверяется часто, а gossip повторяется раз в интервал
+            deadline = time.monotonic() + self._gossip_interval
+            while not synced.is_set() and time.monotonic() < deadline:
+                if self._stopped.is_set():
+                    return False
+                await asyncio.sleep(0.01)
+            if not synced.is_set():
+                self.zmq_pipeline.send_gossip(self._neighbors, full=1)
+        return not self._stopped.is_set()
+
+    async def __wait_stopped(self, timeout: float) -> None:
+        """Ждёт timeout секунд или остановки узла - stop() может быть вызван и из другого потока"""
+
+        deadline = time.monotonic() + timeout
+        while not self._stopped.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, 0.05))
+
+    async def __find_neighbors(self) -> list:
+        neighbors = await self._neighbors_monitor.get_neighbors_async(self._restore_snapshot())
+        self._neighbors_monitor.set_neighbors(neighbors)
+        return self._neighbors_monitor.neighbors
+
+    async def __timed_async(self, phase: str, awaitable):
+        started = time.monotonic()
+        result = await awaitable
+        self._startup_phase(phase, time.monotonic() - started)
+        return result
+
+    async def monitor_network_async(self) -> None:
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            if not self._neighbors:
+                logger.warning('Нет соседей. Поиск...')
+                self._neighbors = await self._neighbors_monitor.get_neighbors_async(self._known_nodes())
+                self._neighbors_monitor.set_neighbors(self._neighbors)
+                self._neighbors = self._neighbors_monitor.neighbors
+                self.failure_detector.watch(map(self._address_plan.node_of, self._neighbors))
+                self.mqtt_worker.publish_neighbours(self._neighbors)
+            elif self._liveness == 'heartbeat':
+                suspected_neighbors, rescan = self._heartbeat_round()
+                if rescan:
+                    new_neighbors = await self._neighbors_monitor.get_neighbors_async(self._known_nodes())
+                    alive = set()
+                    if suspected_neighbors:
+                        alive = await self._neighbors_monitor.discovery.probe_async(
+                            map(self._address_plan.node_of, suspected_neighbors))
+                    self._update_neighbors(new_neighbors,
+                                           self._confirm_gone(suspected_neighbors, new_neighbors, alive))
+            else:
+                await self.__check_neighbors_by_probe()
+
+            self._gossip_round()
+            self._monitor_round_time.observe(time.monotonic() - started)
+            self._log_stats()
+            self._publish_metrics()
+            self._save_snapshot()
+            await self.__wait_stopped(self._monitor_interval())
+
+    async def __check_neighbors_by_probe(self) -> None:
+        gone_neighbors = await self._neighbors_monitor.check_gone_neighbors_async()
+        new_neighbors = await self._neighbors_monitor.get_neighbors_async(self._known_nodes())
+
+        if new_neighbors != self._neighbors and not gone_neighbors:
+            # если соседи изменились, но при прошлой проверке никто не упал проверить ещё раз
+            gone_neighbors = await self._neighbors_monitor.check_gone_neighbors_async()
+
+        self._update_neighbors(new_neighbors, gone_neighbors)
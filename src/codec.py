@@ -0,0 +1,404 @@
+import sys
+import json
+import struct
+
+from array import array
+from typing import Callable
+from dataclasses import dataclass
+
+from .address_plan import DEFAULT_ADDRESS_PLAN
+from .compression import compress, decompress
+
+WIRE_VERSION = 5
+MAGIC = 0xEA
+
+# типы сообщений
+DATA = 0
+HEARTBEAT = 1
+GOSSIP = 2
+# подтверждение приёма пакетов на надёжной линии между соседями
+ACK = 3
+
+# флаги заголовка
+HAS_PAYLOAD = 0x01
+HAS_COMMAND = 0x02
+# адресный пакет: после массива узлов в заголовке записан uint16 номер узла назначения
+HAS_TARGET = 0x04
+# пакет надёжной линии: после узла назначения записаны эпоха линии, номер и служебное поле
+HAS_LINK = 0x08
+# подтверждение сообщает о пропуске - отправителю нужно повторить неподтверждённые пакеты
+LINK_GAP = 0x10
+# payload сжат deflate с общим словарём (compression.dictionary)
+COMPRESSED = 0x20
+# отправивший сосед принимает сжатые payload - так сжатие согласуется на каждой линии отдельно
+ACCEPTS_COMPRESSED = 0x40
+# пакет fanout-рассылки: после полей надёжной линии записаны оставшиеся раунды и граница поддерева
+HAS_FANOUT = 0x80
+
+# возможности узла, которые расходятся по кольцу вместе с его записью в списке узлов (Member.capabilities).
+# Узлы версий без них считаются не умеющими ни того, ни другого
+# узел пересылает пакеты fanout-рассылки по своему поддереву
+CAPABILITY_FANOUT = 0x01
+# узел подтверждает пакеты надёжной линии (HAS_LINK) сообщениями ACK
+CAPABILITY_LINK = 0x02
+
+# magic, версия, тип, флаги, источник, отправивший сосед, адресат, число узлов в nodes_in_network,
+# порядковый номер пакета у источника
+HEADER = struct.Struct('!BBBBHHHHI')
+
+# ключ, которым узел в json-пакете сообщает соседу поддерживаемую версию бинарного формата
+WIRE_KEY = 'wire'
+
+ROUTING_KEYS = frozenset(('sender_node', 'from', 'to', 'nodes_in_network', 'heartbeat', 'seq', 'target', 'link',
+                          'fanout'))
+# поля json-пакета, которые узел разбирает сам. Если такие поля есть в данных DATA-пакета,
+# данные передаются целиком под ключом BODY_KEY, чтобы их не приняли за служебные
+BODY_KEY = 'body'
+RESERVED_KEYS = ROUTING_KEYS | {'gossip', 'ack', WIRE_KEY, BODY_KEY}
+TARGET = struct.Struct('!H')
+LINK = struct.Struct('!III')
+FANOUT = struct.Struct('!BH')
+
+# в заголовке порядок байт сетевой, а array пишет в порядке байт машины
+SWAP_BYTES = sys.byteorder == 'little'
+
+
+@dataclass(slots=True)
+class ERAPMessage:
+    """Extended Ring Applied Protocol Message - класс для задания структуры сообщений.
+
+    Маршрутные поля разобраны из заголовка, остальные поля пакета хранятся закодированными
+    в payload и декодируются только при обращении к body()
+    """
+
+    source: int
+    sender_neighbour: int
+    addressee: int
+    nodes: list = None
+    payload: object = None
+    msg_type: int = DATA
+    flags: int = 0
+    seq: int = 0
+    target: int = 0
+    # надёжная линия: у DATA - номер пакета на линии и самый старый неподтверждённый номер,
+    # у ACK - номер, до которого включительно всё принято, и сколько пакетов ещё можно прислать
+    link_epoch: int = 0
+    link_seq: int = 0
+    link_info: int = 0
+    # fanout-рассылка: сколько раз пакет ещё можно переслать и до какого узла кольца (не включая)
+    # получатель отвечает за доставку
+    rounds: int = 0
+    fanout_limit: int = 0
+    _body: dict = None
+
+    def body(self) -> dict:
+        """Поля payload. CodecError - payload не json-объект или не разжимается"""
+
+        if self._body is None:
+            if self.payload is None:
+                self._body = {}
+            else:
+                try:
+                    body = json.loads(self.plain_payload())
+                except ValueError as error:
+                    raise CodecError(f'Повреждённый payload: {error}') from None
+                if not isinstance(body, dict):
+                    raise CodecError(f'Payload - не json-объект: {type(body).__name__}')
+                self._body = body
+        return self._body
+
+    def plain_payload(self) -> bytes:
+        return _decompress(self.payload) if self.flags & COMPRESSED else bytes(self.payload)
+
+    @property
+    def has_command(self) -> bool:
+        return bool(self.flags & HAS_COMMAND)
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _decompress(payload) -> bytes:
+    try:
+        return decompress(payload)
+    except ValueError as error:
+        raise CodecError(str(error)) from None
+
+
+class PacketCodec:
+    """Кодирование пакетов кольца в бинарный формат ERAP и обратно.
+
+    Пакет передаётся multipart-сообщением zmq: первый кадр - заголовок фиксированной длины
+    с номерами узлов и массивом nodes_in_network (uint16), второй - непрозрачный payload
+    с остальными полями в компактном json. Пересылающий узел разбирает и переписывает только
+    заголовок, а кадр payload отправляет дальше без изменений и без копирования.
+    Json-пакеты по-прежнему принимаются, а бинарный формат отправляется только соседям,
+    которые сообщили, что поддерживают ту же версию.
+
+    С compression_threshold payload не короче порога сжимается для соседей, которые объявили
+    флагом ACCEPTS_COMPRESSED, что принимают сжатые пакеты. Сжатый payload пересылается дальше
+    как есть и разжимается только на узле, который читает пакет, или перед отправкой соседу без сжатия
+    """
+
+    def __init__(self,
+                 address_of: Callable[[int], str] = DEFAULT_ADDRESS_PLAN.address_of,
+                 node_of: Callable[[str], int] = DEFAULT_ADDRESS_PLAN.node_of,
+                 compression_threshold: int = None):
+
+        self.address_of = address_of
+        self.node_of = node_of
+        self.compression_threshold = compression_threshold
+        self.compressed = 0
+        self.bytes_saved = 0
+        # адреса соседей повторяются от пакета к пакету, поэтому разбор и сборка строк кэшируются
+        self._addresses: dict = {}
+        self._nodes: dict = {}
+        self._json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+    # --------------------ERAPMessage <-> пакет--------------------
+    def data_message(self, packet: dict, source: int, seq: int = 0, target: int = 0) -> ERAPMessage:
+        """DATA-сообщение с данными packet из mqtt или от самого узла. Все поля packet остаются
+        в данных как есть, даже если совпадают со служебными: маршрутные поля задаются аргументами
+        """
+
+        body = dict(packet)
+        return ERAPMessage(source=source, sender_neighbour=0, addressee=0,
+                           flags=HAS_COMMAND if body.get('command') else 0,
+                           seq=seq, target=target, _body=body)
+
+    def to_message(self, packet: dict) -> ERAPMessage:
+        """Сообщение из json-пакета, собранного узлом кольца (см. to_packet). Тип сообщения
+        определяется по служебным ключам, поэтому данные из mqtt сюда не передаются - для них data_message
+        """
+
+        if BODY_KEY in packet:
+            return self.__routed_message(packet, packet[BODY_KEY])
+        if 'heartbeat' in packet:
+            return ERAPMessage(source=packet['heartbeat'], sender_neighbour=0, addressee=0, msg_type=HEARTBEAT)
+        if 'gossip' in packet:
+            if not isinstance(packet['gossip'], dict):
+                raise CodecError('Поле gossip - не json-объект')
+            return ERAPMessage(source=packet.get('sender_node') or 0, sender_neighbour=0, addressee=0,
+                               msg_type=GOSSIP, _body=packet['gossip'])
+        if 'ack' in packet:
+            epoch, ack, credit, gap = packet['ack']
+            return ERAPMessage(source=packet.get('sender_node') or 0, sender_neighbour=0, addressee=0,
+                               msg_type=ACK, flags=LINK_GAP if gap else 0,
+                               link_epoch=epoch, link_seq=ack, link_info=credit)
+
+        return self.__routed_message(packet, {key: value for key, value in packet.items() if key not in ROUTING_KEYS})
+
+    def __routed_message(self, packet: dict, body: dict) -> ERAPMessage:
+        link_epoch, link_seq, link_info = packet.get('link') or (0, 0, 0)
+        fanout = packet.get('fanout')
+        rounds, fanout_limit = fanout or (0, 0)
+        return ERAPMessage(source=packet.get('sender_node') or 0,
+                           sender_neighbour=self.node_or_zero(packet.get('from')),
+                           addressee=self.node_or_zero(packet.get('to')),
+                           nodes=list(packet['nodes_in_network']) if packet.get('nodes_in_network') else None,
+                           flags=(HAS_COMMAND if body.get('command') else 0) | (HAS_FANOUT if fanout else 0),
+                           seq=packet.get('seq') or 0,
+                           target=packet.get('target') or 0,
+                           link_epoch=link_epoch,
+                           link_seq=link_seq,
+                           link_info=link_info,
+                           rounds=rounds,
+                           fanout_limit=fanout_limit,
+                           _body=body)
+
+    def to_packet(self, message: ERAPMessage) -> dict:
+        if message.msg_type == HEARTBEAT:
+            return {'heartbeat': message.source}
+        if message.msg_type == GOSSIP:
+            return {'gossip': message.body(), 'sender_node': message.source}
+        if message.msg_type == ACK:
+            return {'ack': [message.link_epoch, message.link_seq, message.link_info,
+                            int(bool(message.flags & LINK_GAP))],
+                    'sender_node': message.source}
+
+        body = message.body()
+        packet = {BODY_KEY: body} if not RESERVED_KEYS.isdisjoint(body) else dict(body)
+        if message.source:
+            packet['sender_node'] = message.source
+        if message.sender_neighbour:
+            packet['from'] = self.address(message.sender_neighbour)
+        if message.addressee:
+            packet['to'] = self.address(message.addressee)
+        if message.nodes:
+            packet['nodes_in_network'] = list(message.nodes)
+        if message.seq:
+            packet['seq'] = message.seq
+        if message.target:
+            packet['target'] = message.target
+        if message.link_epoch:
+            packet['link'] = [message.link_epoch, message.link_seq, message.link_info]
+        if message.flags & HAS_FANOUT:
+            packet['fanout'] = [message.rounds, message.fanout_limit]
+
+        return packet
+
+    # --------------------бинарный формат--------------------
+    def pack(self, message: ERAPMessage, compress_payload: bool = False) -> list:
+        """Возвращает кадры сообщения: заголовок и, если есть поля кроме маршрутных, payload.
+        compress_payload - адресат принимает сжатые payload
+        """
+
+        payload = message.payload
+        if payload is None and message._body:
+            payload = message.payload = self._json_encoder.encode(message._body).encode('utf-8')
+        flags = message.flags
+        if payload is not None:
+            payload, flags = self.__compress(message, payload, flags,
+                                             compress_payload and self.compression_threshold is not None)
+        flags = flags | ACCEPTS_COMPRESSED if self.compression_threshold is not None else flags & ~ACCEPTS_COMPRESSED
+
+        nodes = message.nodes or ()
+        flags = flags | HAS_PAYLOAD if payload is not None else flags & ~HAS_PAYLOAD
+        flags = flags | HAS_TARGET if message.target else flags & ~HAS_TARGET
+        flags = flags | HAS_LINK if message.link_epoch else flags & ~HAS_LINK
+        header = HEADER.pack(MAGIC, WIRE_VERSION, message.msg_type, flags,
+                             message.source, message.sender_neighbour, message.addressee, len(nodes),
+                             message.seq)
+        if nodes:
+            header += self.__pack_nodes(nodes)
+        if message.target:
+            header += TARGET.pack(message.target)
+        if message.link_epoch:
+            header += LINK.pack(message.link_epoch, message.link_seq, message.link_info)
+        if flags & HAS_FANOUT:
+            header += FANOUT.pack(message.rounds, message.fanout_limit)
+
+        return [header] if payload is None else [header, payload]
+
+    def unpack(self, frames: list) -> ERAPMessage:
+        header = frames[0]
+        try:
+            magic, version, msg_type, flags, source, sender_neighbour, addressee, count, seq = \
+                HEADER.unpack_from(header)
+        except struct.error as error:
+            raise CodecError(f'Короткий заголовок: {len(header)} байт') from error
+        if magic != MAGIC or version != WIRE_VERSION:
+            raise CodecError(f'Неизвестный формат пакета: {magic:#x} v{version}')
+
+        nodes_end = HEADER.size + count * 2
+        nodes = self.__unpack_nodes(header[HEADER.size:nodes_end]) if count else None
+        payload = frames[1] if flags & HAS_PAYLOAD and len(frames) > 1 else None
+        try:
+            target = TARGET.unpack_from(header, nodes_end)[0] if flags & HAS_TARGET else 0
+        except struct.error as error:
+            raise CodecError('Короткий заголовок: нет узла назначения') from error
+        link_epoch, link_seq, link_info = 0, 0, 0
+        link_start = nodes_end + TARGET.size if flags & HAS_TARGET else nodes_end
+        if flags & HAS_LINK:
+            try:
+                link_epoch, link_seq, link_info = LINK.unpack_from(header, link_start)
+            except struct.error as error:
+                raise CodecError('Короткий заголовок: нет полей надёжной линии') from error
+        rounds, fanout_limit = 0, 0
+        if flags & HAS_FANOUT:
+            try:
+                rounds, fanout_limit = FANOUT.unpack_from(header, link_start + LINK.size if flags & HAS_LINK
+                                                          else link_start)
+            except struct.error as error:
+                raise CodecError('Короткий заголовок: нет полей fanout-рассылки') from error
+
+        return ERAPMessage(source=source, sender_neighbour=sender_neighbour, addressee=addressee,
+                           nodes=nodes, payload=payload, msg_type=msg_type, flags=flags, seq=seq,
+                           target=target, link_epoch=link_epoch, link_seq=link_seq, link_info=link_info,
+                           rounds=rounds, fanout_limit=fanout_limit)
+
+    # --------------------сообщение <-> кадры zmq--------------------
+    def encode(self, message: ERAPMessage, binary: bool, compress_payload: bool = False) -> list:
+        """Кодирует сообщение в кадры бинарного формата, если binary,
+        иначе в один кадр json с объявлением версии формата
+        """
+
+        if binary:
+            try:
+                return self.pack(message, compress_payload)
+            except (struct.error, OverflowError):
+                # номер узла не помещается в заголовок - такой пакет уходит в json
+                pass
+
+        advertised = self.to_packet(message)
+        advertised[WIRE_KEY] = [WIRE_VERSION, message.sender_neighbour]
+        return [self._json_encoder.encode(advertised).encode('utf-8')]
+
+    def decode(self, frames: list) -> tuple:
+        """Декодирует кадры в сообщение и возвращает его вместе с версией бинарного формата,
+        которую поддерживает отправивший сосед (0 - только json)
+        """
+
+        first = frames[0]
+        if bytes(first[:1]) != b'{':
+            return self.unpack(frames), WIRE_VERSION
+
+        # поля json-пакета приходят от соседа как есть: любое несоответствие типов или формы
+        # сообщается одной ошибкой CodecError, как и для бинарного формата
+        try:
+            packet = json.loads(bytes(first))
+            wire = packet.pop(WIRE_KEY, None)
+            message = self.to_message(packet)
+            if not wire:
+                return message, 0
+            # объявление версии верно только если его добавил сам отправивший сосед, а не узел до него.
+            # heartbeat и gossip дальше соседа не пересылаются, поэтому им можно верить всегда
+            if message.msg_type != DATA or wire[1] == message.sender_neighbour:
+                return message, wire[0]
+            return message, 0
+        except CodecError:
+            raise
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as error:
+            raise CodecError(f'Повреждённый json-пакет: {error!r}') from None
+
+    def node_or_zero(self, address: str or None) -> int:
+        if not address:
+            return 0
+
+        node = self._nodes.get(address)
+        if node is None:
+            node = self._nodes[address] = self.node_of(address)
+        return node
+
+    def address(self, node: int) -> str:
+        address = self._addresses.get(node)
+        if address is None:
+            address = self._addresses[node] = self.address_of(node)
+        return address
+
+    def __compress(self, message: ERAPMessage, payload, flags: int, allowed: bool) -> tuple:
+        """payload и флаги для отправки: сжатый payload, если адресат его принимает,
+        иначе исходный. Результат сжатия сохраняется в сообщении - повторы и пересылка не сжимают заново
+        """
+
+        if flags & COMPRESSED:
+            if allowed:
+                return payload, flags
+            return _decompress(payload), flags & ~COMPRESSED
+        if not allowed or len(payload) < self.compression_threshold:
+            return payload, flags
+
+        compressed = compress(payload)
+        if len(compressed) >= len(payload):
+            return payload, flags
+        self.compressed += 1
+        self.bytes_saved += len(payload) - len(compressed)
+        message.payload = compressed
+        message.flags |= COMPRESSED
+        return compressed, flags | COMPRESSED
+
+    @staticmethod
+    def __pack_nodes(nodes) -> bytes:
+        packed = array('H', nodes)
+        if SWAP_BYTES:
+            packed.byteswap()
+        return packed.tobytes()
+
+    @staticmethod
+    def __unpack_nodes(data) -> list:
+        unpacked = array('H')
+        unpacked.frombytes(data)
+        if SWAP_BYTES:
+            unpacked.byteswap()
+        return unpacked.tolist()
@@ -0,0 +1,100 @@
+import re
+import json
+import zlib
+import random
+
+from pathlib import Path
+from collections import Counter
+from functools import lru_cache
+from typing import Iterable
+
+# payload сжимается deflate без заголовка zlib с общим словарём - заголовок и контрольная сумма
+# на маленьких пакетах заметны, а целостность кадров обеспечивает tcp
+WINDOW_BITS = -15
+# payload - килобайты, а не мегабайты: меньший буфер состояния заметно дешевле выделять на каждый пакет
+MEM_LEVEL = 4
+# больше этого разжатый payload не бывает - защита от пакета, разворачивающегося в гигабайты
+MAX_PAYLOAD = 64 * 1024 * 1024
+# общий словарь хранится в репозитории, а не обучается при запуске: в raw deflate нет идентификатора
+# словаря, и узлы с разными словарями молча получили бы мусор вместо payload
+DICTIONARY_PATH = Path(__file__).with_name('compression.dict')
+
+_TOKEN = re.compile(rb'"[^"]*":?|-?\d+(?:\.\d+)?|[\[\]{},]+')
+
+
+def typical_payloads(seed: int = 1) -> list:
+    """Payload типичных пакетов кольца в том виде, в каком их кодирует PacketCodec:
+    gossip со списком узлов, события соседей, команды и телеметрия, список узлов для mqtt.
+    Нужны только для обучения нового словаря - результат зависит от версии python
+    """
+
+    generator = random.Random(seed)
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    payloads = []
+    for size in (8, 40, 200):
+        nodes = sorted(generator.sample(range(1, 255), size))
+        members = [[node, generator.randrange(1, 5000), int(generator.random() > 0.05)] for node in nodes]
+        payloads.append({'d': generator.getrandbits(64), 'm': members, 'full': 1})
+        payloads.append({'all_nodes': {str(node): [f'10.20.{node}.1', 1700000000 + generator.randrange(10 ** 6)]
+                                       for node in nodes}})
+    for event in ('neighbour_gone', 'neighbour_back'):
+        node = generator.randrange(1, 255)
+        payloads.append({'event': event, 'neighbour_ip': f'10.20.{node}.1', 'neighbour_node': node})
+    payloads.append({'event': 'member_expired', 'node': generator.randrange(1, 255)})
+    payloads.append({'command': 'update', 'message': {'version': '1.2.3', 'force': True}})
+    for _ in range(4):
+        payloads.append({'command': 'telemetry',
+                         'message': {'cpu': round(generator.random() * 100, 1),
+                                     'memory': generator.randrange(10 ** 9),
+                                     'uptime': generator.randrange(10 ** 6),
+                                     'interfaces': [{'name': f'eth{index}', 'rx_bytes': generator.randrange(10 ** 9),
+                                                     'tx_bytes': generator.randrange(10 ** 9), 'up': True}
+                                                    for index in range(3)]}})
+
+    return [encoder.encode(payload).encode('utf-8') for payload in payloads]
+
+
+def train_dictionary(samples: Iterable[bytes], max_size: int = 2048) -> bytes:
+    """Словарь для deflate из повторяющихся фрагментов samples: ключи json, структура и частые числа.
+    Фрагмент ценнее, чем больше байт он покрывает во всех образцах; deflate дешевле ссылается на
+    конец словаря, поэтому самые ценные фрагменты идут последними
+    """
+
+    counts = Counter()
+    for sample in samples:
+        counts.update(_TOKEN.findall(sample))
+
+    chosen = []
+    size = 0
+    for token, count in sorted(counts.items(), key=lambda item: (-item[1] * len(item[0]), item[0])):
+        if count < 2 or size + len(token) > max_size:
+            continue
+        chosen.append(token)
+        size += len(token)
+
+    return b''.join(reversed(chosen))
+
+
+@lru_cache(maxsize=None)
+def dictionary() -> bytes:
+    """Общий словарь всех узлов из DICTIONARY_PATH. Он входит в формат пакета: файл получен
+    train_dictionary(typical_payloads()), а его изменение требует новой версии WIRE_VERSION
+    """
+
+    return DICTIONARY_PATH.read_bytes()
+
+
+def compress(data, level: int = 6) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WINDOW_BITS, MEM_LEVEL, zdict=dictionary())
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data) -> bytes:
+    decompressor = zlib.decompressobj(WINDOW_BITS, zdict=dictionary())
+    try:
+        plain = decompressor.decompress(data, MAX_PAYLOAD)
+    except zlib.error as error:
+        raise ValueError(f'Повреждённый сжатый payload: {error}') from None
+    if decompressor.unconsumed_tail:
+        raise ValueError(f'Разжатый payload больше {MAX_PAYLOAD} байт')
+    return plain
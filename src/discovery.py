@@ -0,0 +1,257 @@
+import time
+import errno
+import asyncio
+import socket
+import selectors
+
+from bisect import bisect_left
+from typing import Callable, Iterable, Sequence, Tuple
+
+from .address_plan import DEFAULT_ADDRESS_PLAN
+
+
+class NeighbourDiscovery:
+    """Параллельный поиск соседей по кольцу подсетей.
+
+    Кандидаты опрашиваются неблокирующими TCP-подключениями одновременно в обе стороны
+    кольца, в порядке удалённости от node_id, не более concurrency подключений за раз.
+    Сосед с каждой стороны считается найденным, как только ответил ближайший к node_id узел,
+    а все более близкие кандидаты с этой стороны уже признаны недоступными.
+    observe_rtt вызывается со временем каждого успешного подключения, например для гистограммы
+    """
+
+    IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+    def __init__(self,
+                 node_id: int,
+                 port: int,
+                 host_ip: str = None,
+                 max_node: int = 255,
+                 concurrency: int = 32,
+                 timeout: float = 0.15,
+                 address_of: Callable[[int], str] = DEFAULT_ADDRESS_PLAN.address_of,
+                 observe_rtt: Callable[[float], object] = None,
+                 nodes: Sequence[int] = None):
+
+        self.node_id = node_id
+        self.port = port
+        self.host_ip = host_ip
+        self.max_node = max_node
+        # все возможные номера узлов по возрастанию, по умолчанию 1..max_node
+        self.nodes = nodes if nodes is not None else range(1, max_node + 1)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.address_of = address_of
+        self.observe_rtt = observe_rtt
+
+        self.probes_started = 0
+
+    def find_neighbors(self) -> Tuple[str or bool, str or bool]:
+        """Возвращает адреса ближайших живых соседей слева и справа или False, если соседей нет"""
+
+        order, results, wanted, decide, neighbours = self.__neighbours_search()
+        self.__run_probes(order, results, wanted, decide)
+
+        return neighbours()
+
+    async def find_neighbors_async(self) -> Tuple[str or bool, str or bool]:
+        """То же, что find_neighbors, но подключения выполняются задачами текущего event loop"""
+
+        order, results, wanted, decide, neighbours = self.__neighbours_search()
+        await self.__run_probes_async(order, results, wanted, decide)
+
+        return neighbours()
+
+    def closest_candidates(self) -> list:
+        """Адреса ближайших кандидатов в соседи слева и справа - с них начинается поиск"""
+
+        return [self.address_of(self.__ring_order(step=-1)[0]), self.address_of(self.__ring_order(step=1)[0])]
+
+    def probe(self, nodes: Iterable[int]) -> set:
+        """Одновременно проверяет доступность узлов nodes, возвращает множество живых"""
+
+        results = {}
+        order = [(node, 0) for node in nodes]
+        self.__run_probes(order, results, lambda candidate: candidate[0] not in results, lambda: False)
+
+        return {node for node, alive in results.items() if alive}
+
+    async def probe_async(self, nodes: Iterable[int]) -> set:
+        results = {}
+        order = [(node, 0) for node in nodes]
+        await self.__run_probes_async(order, results, lambda candidate: candidate[0] not in results, lambda: False)
+
+        return {node for node, alive in results.items() if alive}
+
+    def __neighbours_search(self) -> tuple:
+        """Порядок опроса кандидатов и функции принятия решения, общие для обоих вариантов поиска"""
+
+        left_nodes = self.__ring_order(step=-1)
+        right_nodes = self.__ring_order(step=1)
+
+        # кандидаты чередуются по сторонам и идут по возрастанию расстояния
+        order = []
+        for left_node, right_node in zip(left_nodes, right_nodes):
+            order.append((right_node, 1))
+            order.append((left_node, -1))
+
+        results = {}
+        decided = {-1: None, 1: None}
+
+        def decide() -> bool:
+            decided[-1] = self.__nearest_alive(left_nodes, results)
+            decided[1] = self.__nearest_alive(right_nodes, results)
+            return decided[-1] is not None and decided[1] is not None
+
+        def wanted(candidate: Tuple[int, int]) -> bool:
+            node, direction = candidate
+            return decided[direction] is None and node not in results
+
+        def neighbours() -> Tuple[str or bool, str or bool]:
+            decide()
+            left_neighbour = self.address_of(decided[-1]) if decided[-1] else False
+            right_neighbour = self.address_of(decided[1]) if decided[1] else False
+            return left_neighbour, right_neighbour
+
+        return order, results, wanted, decide, neighbours
+
+    def __ring_order(self, step: int) -> list:
+        """Номера узлов кольца в порядке удаления от node_id в сторону step, без самого узла"""
+
+        nodes = self.nodes
+        position = bisect_left(nodes, self.node_id)
+        after = position + 1 if position < len(nodes) and nodes[position] == self.node_id else position
+        if step == 1:
+            return [*nodes[after:], *nodes[:position]]
+        return [*reversed(nodes[:position]), *reversed(nodes[after:])]
+
+    @staticmethod
+    def __nearest_alive(nodes: list, results: dict) -> int or bool or None:
+        """Ближайший живой узел из nodes, False если живых нет, None если решение ещё не принято"""
+
+        for node in nodes:
+            alive = results.get(node)
+            if alive is None:
+                return None
+            if alive:
+                return node
+
+        return False
+
+    def __run_probes(self, order: list, results: dict, wanted: Callable, done: Callable) -> None:
+        selector = selectors.DefaultSelector()
+        in_flight = {}
+        position = 0
+
+        try:
+            while True:
+                while position < len(order) and len(in_flight) < self.concurrency:
+                    candidate = order[position]
+                    position += 1
+                    if candidate[0] in in_flight or not wanted(candidate):
+                        continue
+                    self.__start_probe(candidate[0], selector, in_flight, results)
+
+                if not in_flight:
+                    return
+
+                now = time.monotonic()
+                wait = max(0.0, min(deadline for _, deadline in in_flight.values()) - now)
+                for key, _ in selector.select(timeout=wait):
+                    node = key.data
+                    tcp_client_socket, deadline = in_flight.pop(node)
+                    error = tcp_client_socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    results[node] = error == 0
+                    if error == 0 and self.observe_rtt is not None:
+                        self.observe_rtt(time.monotonic() - deadline + self.timeout)
+                    self.__close_probe(tcp_client_socket, selector)
+
+                now = time.monotonic()
+                for node, (tcp_client_socket, deadline) in tuple(in_flight.items()):
+                    if deadline <= now:
+                        del in_flight[node]
+                        results[node] = False
+                        self.__close_probe(tcp_client_socket, selector)
+
+                if done():
+                    return
+        finally:
+            for tcp_client_socket, _ in in_flight.values():
+                self.__close_probe(tcp_client_socket, selector)
+            selector.close()
+
+    async def __run_probes_async(self, order: list, results: dict, wanted: Callable, done: Callable) -> None:
+        in_flight = {}
+        position = 0
+
+        try:
+            while True:
+                while position < len(order) and len(in_flight) < self.concurrency:
+                    candidate = order[position]
+                    position += 1
+                    node = candidate[0]
+                    if node in in_flight.values() or not wanted(candidate):
+                        continue
+                    if self.__is_self(node):
+                        results[node] = False
+                        continue
+                    in_flight[asyncio.ensure_future(self.__probe_async(node))] = node
+
+                if not in_flight:
+                    return
+
+                finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    results[in_flight.pop(task)] = task.result()
+
+                if done():
+                    return
+        finally:
+            # решение принято - оставшиеся подключения больше не нужны
+            for task in in_flight:
+                task.cancel()
+
+    async def __probe_async(self, node: int) -> bool:
+        self.probes_started += 1
+        loop = asyncio.get_running_loop()
+        tcp_client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_client_socket.setblocking(False)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(loop.sock_connect(tcp_client_socket, (self.address_of(node), self.port)),
+                                   self.timeout)
+            if self.observe_rtt is not None:
+                self.observe_rtt(time.monotonic() - started)
+            return True
+        except (OSError, asyncio.TimeoutError):
+            return False
+        finally:
+            tcp_client_socket.close()
+
+    def __is_self(self, node: int) -> bool:
+        return node == self.node_id or self.address_of(node) == self.host_ip
+
+    def __start_probe(self, node: int, selector: selectors.BaseSelector, in_flight: dict, results: dict) -> None:
+        if self.__is_self(node):
+            results[node] = False
+            return
+
+        self.probes_started += 1
+        tcp_client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_client_socket.setblocking(False)
+        try:
+            error = tcp_client_socket.connect_ex((self.address_of(node), self.port))
+        except OSError:
+            error = errno.EHOSTUNREACH
+
+        if error in self.IN_PROGRESS:
+            selector.register(tcp_client_socket, selectors.EVENT_WRITE, data=node)
+            in_flight[node] = (tcp_client_socket, time.monotonic() + self.timeout)
+        else:
+            results[node] = error == 0
+            tcp_client_socket.close()
+
+    @staticmethod
+    def __close_probe(tcp_client_socket: socket.socket, selector: selectors.BaseSelector) -> None:
+        selector.unregister(tcp_client_socket)
+        tcp_client_socket.close()
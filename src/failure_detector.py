@@ -0,0 +1,179 @@
+import math
+import time
+import threading
+
+from collections import deque
+from typing import Callable, Iterable
+
+
+class HeartbeatHistory:
+    """Окно интервалов между heartbeat-сообщениями одного узла с накопленными суммами"""
+
+    __slots__ = ('intervals', 'interval_sum', 'interval_sq_sum', 'last_arrival', 'suspected_at')
+
+    def __init__(self, window_size: int, last_arrival: float):
+        self.intervals = deque(maxlen=window_size)
+        self.interval_sum = 0.0
+        self.interval_sq_sum = 0.0
+        self.last_arrival = last_arrival
+        self.suspected_at = None
+
+    def add(self, interval: float) -> None:
+        if len(self.intervals) == self.intervals.maxlen:
+            dropped = self.intervals[0]
+            self.interval_sum -= dropped
+            self.interval_sq_sum -= dropped * dropped
+        self.intervals.append(interval)
+        self.interval_sum += interval
+        self.interval_sq_sum += interval * interval
+
+    def mean(self) -> float:
+        return self.interval_sum / len(self.intervals)
+
+    def std(self) -> float:
+        mean = self.mean()
+        return math.sqrt(max(self.interval_sq_sum / len(self.intervals) - mean * mean, 0.0))
+
+
+class PhiAccrualFailureDetector:
+    """Детектор отказов соседей по heartbeat-сообщениям (phi accrual).
+
+    По окну интервалов между heartbeat-сообщениями считается уровень подозрения phi.
+    Узел считается ушедшим, если phi достиг threshold или узел молчит дольше max_silence -
+    это верхняя граница времени обнаружения отказа. Если от подозреваемого узла снова пришёл
+    heartbeat не позже refute_window после подозрения, подозрение считается ложным
+    """
+
+    def __init__(self,
+                 heartbeat_interval: float = 0.1,
+                 threshold: float = 8.0,
+                 max_silence: float = 1.0,
+                 min_std: float = 0.02,
+                 window_size: int = 100,
+                 refute_window: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+
+        self.heartbeat_interval = heartbeat_interval
+        self.threshold = threshold
+        self.max_silence = max_silence
+        self.min_std = min_std
+        self.window_size = window_size
+        self.refute_window = refute_window
+        self.clock = clock
+
+        self.detections = 0
+        self.false_positives = 0
+        self.detection_latency_sum = 0.0
+        self.detection_latency_max = 0.0
+
+        self._histories: dict = {}
+        self._arrivals: set = set()
+        self._lock = threading.Lock()
+
+    def watch(self, nodes: Iterable[int]) -> None:
+        """Начинает следить за узлами nodes, даже если от них ещё не было heartbeat"""
+
+        now = self.clock()
+        with self._lock:
+            for node in nodes:
+                if node not in self._histories:
+                    self._histories[node] = self.__new_history(now)
+
+    def forget(self, node: int) -> None:
+        with self._lock:
+            self._histories.pop(node, None)
+
+    def heartbeat(self, node: int) -> None:
+        """Учитывает heartbeat от узла node"""
+
+        now = self.clock()
+        with self._lock:
+            history = self._histories.get(node)
+            if history is None:
+                self._histories[node] = self.__new_history(now)
+                self._arrivals.add(node)
+                return
+
+            if history.suspected_at is not None:
+                if now - history.suspected_at <= self.refute_window:
+                    self.false_positives += 1
+                history.suspected_at = None
+                self._arrivals.add(node)
+            else:
+                history.add(now - history.last_arrival)
+            history.last_arrival = now
+
+    def refute(self, node: int) -> None:
+        """Снимает подозрение с узла node, который оказался жив по другой проверке.
+        Подозрение считается ложным, а молчание узла отсчитывается заново
+        """
+
+        with self._lock:
+            history = self._histories.get(node)
+            if history is None or history.suspected_at is None:
+                return
+            self.false_positives += 1
+            history.suspected_at = None
+            history.last_arrival = self.clock()
+
+    def drain_arrivals(self) -> set:
+        """Возвращает узлы, от которых heartbeat пришёл впервые или после подозрения"""
+
+        with self._lock:
+            arrivals, self._arrivals = self._arrivals, set()
+
+        return arrivals
+
+    def phi(self, node: int) -> float:
+        with self._lock:
+            history = self._histories.get(node)
+            if history is None:
+                return 0.0
+            return self.__phi(history, self.clock() - history.last_arrival)
+
+    def check(self) -> tuple:
+        """Возвращает узлы, которые стали подозреваемыми с прошлой проверки"""
+
+        now = self.clock()
+        suspected = []
+        with self._lock:
+            for node, history in self._histories.items():
+                if history.suspected_at is not None:
+                    continue
+
+                silence = now - history.last_arrival
+                if silence >= self.max_silence or self.__phi(history, silence) >= self.threshold:
+                    history.suspected_at = now
+                    suspected.append(node)
+                    self.detections += 1
+                    self.detection_latency_sum += silence
+                    self.detection_latency_max = max(self.detection_latency_max, silence)
+
+        return tuple(suspected)
+
+    def stats(self) -> dict:
+        return {'detections': self.detections,
+                'false_positives': self.false_positives,
+                'false_positive_rate': self.false_positives / self.detections if self.detections else 0.0,
+                'detection_latency_avg': self.detection_latency_sum / self.detections if self.detections else 0.0,
+                'detection_latency_max': self.detection_latency_max}
+
+    def __new_history(self, now: float) -> HeartbeatHistory:
+        history = HeartbeatHistory(self.window_size, now)
+        # начальная оценка интервала, пока реальных измерений мало
+        history.add(self.heartbeat_interval - self.heartbeat_interval / 4)
+        history.add(self.heartbeat_interval + self.heartbeat_interval / 4)
+
+        return history
+
+    def __phi(self, history: HeartbeatHistory, silence: float) -> float:
+        mean = history.mean()
+        std = max(history.std(), self.min_std)
+        y = (silence - mean) / std
+        e = math.exp(min(-y * (1.5976 + 0.070566 * y * y), 700.0))
+        if silence > mean:
+            if e == 0.0:
+                return math.inf
+            return -math.log10(e / (1.0 + e))
+
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
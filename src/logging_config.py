@@ -0,0 +1,207 @@
+import sys
+import time
+import queue
+import threading
+
+from loguru import logger
+
+DEFAULT_FORMAT = "{time:HH:mm:ss} | {level} | {message}"
+
+# категории сообщений: node - жизненный цикл узла, discovery - поиск и проверка соседей,
+# zmq - сокеты и разбор пакетов, mqtt - брокер, packets - сообщения о каждом пакете
+DEFAULT_LEVELS = {'node': 'DEBUG', 'discovery': 'DEBUG', 'zmq': 'INFO', 'mqtt': 'INFO', 'packets': 'INFO'}
+
+LEVEL_NUMBERS = {'TRACE': 5, 'DEBUG': 10, 'INFO': 20, 'SUCCESS': 25, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+
+class LogSettings:
+    """Общие для всего процесса уровни категорий и ограничение частоты сообщений о пакетах"""
+
+    def __init__(self):
+        self.default_level = LEVEL_NUMBERS['DEBUG']
+        self.levels: dict = {}
+        # сообщений о пакетах в секунду на один RateLimitedLogger, 0 - без ограничения
+        self.packet_rate = 20.0
+        # писать только каждое n-е сообщение о пакете
+        self.packet_sample_every = 1
+
+    def level_of(self, category: str) -> int:
+        return self.levels.get(category, self.default_level)
+
+    def filter(self, record: dict) -> bool:
+        return record['level'].no >= self.level_of(record['extra'].get('category'))
+
+
+settings = LogSettings()
+_configured_sink = None
+
+
+def get_logger(category: str):
+    """Логгер loguru для модуля категории category - её уровень задаётся в configure_logging"""
+
+    return logger.bind(category=category)
+
+
+def is_enabled(category: str, level: str) -> bool:
+    """Будут ли записаны сообщения категории category уровня level. Фильтр категорий стоит на sink,
+    поэтому loguru вычисляет ленивые аргументы сообщения, даже если категория его потом отбросит
+    """
+
+    return LEVEL_NUMBERS[level] >= settings.level_of(category)
+
+
+def parse_levels(spec: str) -> dict:
+    """Разбирает уровни категорий вида 'packets=DEBUG,mqtt=WARNING'"""
+
+    levels = {}
+    for item in filter(None, spec.split(',')):
+        category, _, level = item.partition('=')
+        level = level.strip().upper()
+        if level not in LEVEL_NUMBERS:
+            raise ValueError(f'Неизвестный уровень логирования: {level}')
+        levels[category.strip()] = level
+    return levels
+
+
+def configure_logging(levels: dict = None,
+                      default_level: str = 'DEBUG',
+                      sink=sys.stdout,
+                      log_format: str = DEFAULT_FORMAT,
+                      enqueue: bool = False,
+                      queue_size: int = 10000,
+                      packet_rate: float = 20.0,
+                      packet_sample_every: int = 1) -> None:
+    """Единственная настройка логирования процесса: заменяет все sink loguru одним sink.
+    levels - уровни категорий поверх DEFAULT_LEVELS, default_level - для сообщений без категории.
+    enqueue - сообщения пишет отдельный поток из ограниченной очереди, при её переполнении
+    сообщения отбрасываются, так что логирование не задерживает пересылку пакетов
+    """
+
+    global _configured_sink
+
+    levels = {**DEFAULT_LEVELS, **(levels or {})}
+    settings.levels = {category: LEVEL_NUMBERS[level.upper()] for category, level in levels.items()}
+    settings.default_level = LEVEL_NUMBERS[default_level.upper()]
+    settings.packet_rate = packet_rate
+    settings.packet_sample_every = max(packet_sample_every, 1)
+
+    logger.remove()
+    if _configured_sink is not None:
+        _configured_sink.close()
+        _configured_sink = None
+
+    if enqueue:
+        sink = _configured_sink = QueuedSink(sink, max_size=queue_size)
+        sink.start()
+
+    logger.add(sink, format=log_format, filter=settings.filter,
+               level=min(settings.default_level, *settings.levels.values()))
+
+
+def shutdown_logging() -> None:
+    """Дописывает накопленные в очереди сообщения"""
+
+    global _configured_sink
+
+    if _configured_sink is not None:
+        logger.remove()
+        _configured_sink.close()
+        _configured_sink = None
+
+
+class RateLimitedLogger:
+    """Логгер сообщений о каждом пакете. Аргументы сообщения - функции, которые вызываются
+    только если сообщение будет записано, так что пакет не форматируется, когда уровень категории
+    выключен. Записывается только каждое packet_sample_every-е сообщение и не больше packet_rate
+    сообщений в секунду, число пропущенных добавляется к следующему записанному.
+    Счётчики без блокировки: при записи из нескольких потоков ограничение приблизительное
+    """
+
+    def __init__(self, category: str = 'packets'):
+        self.category = category
+        self._logger = logger.bind(category=category)
+        self._calls = 0
+        self._suppressed = 0
+        # запас пересчитывается в __allow и не превышает packet_rate - первые сообщения пишутся сразу
+        self._tokens = float('inf')
+        self._updated = time.monotonic()
+
+    def enabled(self, level: str) -> bool:
+        return is_enabled(self.category, level)
+
+    def debug(self, message: str, *args) -> None:
+        self.__log('DEBUG', message, args)
+
+    def info(self, message: str, *args) -> None:
+        self.__log('INFO', message, args)
+
+    def warning(self, message: str, *args) -> None:
+        self.__log('WARNING', message, args)
+
+    def __log(self, level: str, message: str, args: tuple) -> None:
+        if LEVEL_NUMBERS[level] < settings.level_of(self.category):
+            return
+        if not self.__allow():
+            self._suppressed += 1
+            return
+
+        if self._suppressed:
+            message = f'{message} [пропущено {self._suppressed}]'
+            self._suppressed = 0
+        self._logger.opt(lazy=True, depth=2).log(level, message, *args)
+
+    def __allow(self) -> bool:
+        self._calls += 1
+        if self._calls % settings.packet_sample_every:
+            return False
+
+        rate = settings.packet_rate
+        if not rate:
+            return True
+
+        # token bucket: запас не больше rate сообщений, пополняется rate в секунду
+        now = time.monotonic()
+        self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class QueuedSink:
+    """Sink loguru, который только кладёт готовую строку в ограниченную очередь, а пишет её
+    в stream отдельный поток. При переполнении очереди сообщение отбрасывается
+    """
+
+    def __init__(self, stream, max_size: int = 10000):
+        self.stream = stream
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+
+    def __call__(self, message: str) -> None:
+        try:
+            self._queue.put_nowait(str(message))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.__run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 1.0) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __run(self) -> None:
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            self.stream.write(message)
+            if self._queue.empty():
+                self.stream.flush()
+        self.stream.flush()
@@ -0,0 +1,206 @@
+import math
+import time
+import itertools
+import threading
+
+from array import array
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+
+class MemberRecord:
+    """Запись об узле кольца: адрес, когда узел последний раз подавал признаки жизни (time.monotonic),
+    и поколение записи - ключ записи в колесе сроков
+    """
+
+    __slots__ = ('address', 'refreshed_at', 'generation')
+
+    def __init__(self, address: str, refreshed_at: float, generation: int = 0):
+        self.address = address
+        self.refreshed_at = refreshed_at
+        self.generation = generation
+
+
+class TimingWheel:
+    """Hashed timing wheel: ключи раскладываются по slots корзинам по тику своего срока, тик - tick секунд.
+
+    Продвижение колеса разбирает только корзины прошедших тиков, так что стоимость не зависит
+    от числа ключей. Сроки в колесе не обновляются при продлении - продлённый ключ при разборе
+    корзины перекладывается в корзину нового срока (deadline_of возвращает актуальный срок),
+    поэтому продление стоит O(1) и у каждого ключа в колесе не больше одной записи
+    """
+
+    def __init__(self, tick: float, slots: int = 512, start: float = None):
+        self.tick = tick
+        self.slots = slots
+        self._buckets = [set() for _ in range(slots)]
+        self._current = self.__tick_of(time.monotonic() if start is None else start)
+
+    def schedule(self, key, deadline: float) -> None:
+        # срок, выпадающий на уже разобранный тик, попадает в следующую корзину
+        self._buckets[max(self.__tick_of(deadline), self._current + 1) % self.slots].add(key)
+
+    def advance(self, now: float, deadline_of: Callable[[object], float or None]) -> list:
+        """Разбирает корзины тиков до now и возвращает ключи, срок которых истёк.
+        deadline_of(key) - актуальный срок ключа, None - ключ удалён и из колеса выбрасывается
+        """
+
+        expired = []
+        target = self.__tick_of(now)
+        # за один оборот колеса разбираются все корзины, больше проходить незачем
+        first = max(self._current + 1, target - self.slots + 1)
+        self._current = target
+        for tick in range(first, target + 1):
+            bucket = self._buckets[tick % self.slots]
+            if not bucket:
+                continue
+            self._buckets[tick % self.slots] = set()
+            for key in bucket:
+                deadline = deadline_of(key)
+                if deadline is None:
+                    continue
+                if deadline <= now:
+                    expired.append(key)
+                else:
+                    self.schedule(key, deadline)
+
+        return expired
+
+    def __len__(self) -> int:
+        return sum(map(len, self._buckets))
+
+    def __tick_of(self, moment: float) -> int:
+        return math.floor(moment / self.tick)
+
+
+class MemberStore:
+    """Список живых узлов кольца: номера в отсортированном array('H') с поиском и вставкой через bisect
+    и записи MemberRecord со __slots__. На узел приходится одна запись и 2 байта в массиве номеров.
+
+    С ttl запись, не продлённая за ttl секунд, удаляется при вызове expire(), сроки отслеживает
+    TimingWheel по ключу (номер, поколение записи): запись в колесе от удалённой и заново добавленной
+    записи узла устаревает и выбрасывается. Продление - refresh() - стоит одного поиска в словаре и присваивания.
+    Представление в виде словаря {номер: SenderNode} для публикации кэшируется и пересобирается
+    только после изменения состава, так что время жизни в нём - на момент последнего изменения
+    """
+
+    def __init__(self, my_node: int, ttl: float = None, wheel_slots: int = 512,
+                 clock: Callable[[], float] = time.monotonic):
+        self.my_node = my_node
+        self.ttl = ttl
+        self.clock = clock
+        self.version = 0
+        self.expired = 0
+
+        self._nodes = array('H')
+        self._records: dict = {}
+        self._generations = itertools.count()
+        self._wheel = TimingWheel(ttl / wheel_slots * 4, wheel_slots, start=clock()) if ttl else None
+        self._view = None
+        self._view_version = -1
+        self._lock = threading.Lock()
+
+    def __contains__(self, node: int) -> bool:
+        return node in self._records
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def nodes(self) -> array:
+        return self._nodes
+
+    def get(self, node: int) -> MemberRecord or None:
+        return self._records.get(node)
+
+    def add(self, nodes: Iterable[int], address_of: Callable[[int], str]) -> None:
+        """Добавляет узлы nodes или продлевает записи уже известных"""
+
+        now = self.clock()
+        with self._lock:
+            for node in nodes:
+                record = self._records.get(node)
+                if record is not None:
+                    record.refreshed_at = now
+                    continue
+
+                record = self._records[node] = MemberRecord(address_of(node), now, next(self._generations))
+                self._nodes.insert(bisect_left(self._nodes, node), node)
+                if self._wheel is not None and node != self.my_node:
+                    self._wheel.schedule((node, record.generation), now + self.ttl)
+                self.version += 1
+
+    def refresh(self, node: int) -> None:
+        """Узел node подал признак жизни - пакет, heartbeat или запись gossip"""
+
+        record = self._records.get(node)
+        if record is not None:
+            record.refreshed_at = self.clock()
+
+    def backdate(self, node: int, refreshed_at: float) -> None:
+        """Узел node последний раз подавал признаки жизни раньше, в момент refreshed_at по clock, - например,
+        запись восстановлена из снимка. Срок записи отсчитывается от этого момента
+        """
+
+        with self._lock:
+            record = self._records.get(node)
+            if record is None or refreshed_at >= record.refreshed_at:
+                return
+            record.refreshed_at = refreshed_at
+            if self._wheel is not None and node != self.my_node:
+                # колесо не переставляет ключ на более ранний срок: запись получает новое поколение
+                # и новый ключ, а прежний устареет и выбросится при разборе своей корзины
+                record.generation = next(self._generations)
+                self._wheel.schedule((node, record.generation), refreshed_at + self.ttl)
+
+    def remove(self, node: int) -> bool:
+        with self._lock:
+            return self.__remove(node)
+
+    def expire(self) -> list:
+        """Удаляет записи, не продлённые за ttl, и возвращает номера их узлов"""
+
+        if self._wheel is None:
+            return []
+
+        now = self.clock()
+        with self._lock:
+            expired = [node for node, _ in self._wheel.advance(now, self.__deadline_of)]
+            for node in expired:
+                self.__remove(node)
+        self.expired += len(expired)
+
+        return expired
+
+    def as_dict(self, record_view: Callable[[str, int], object]) -> dict:
+        """Словарь {номер: record_view(адрес, unix-время последнего признака жизни)} по возрастанию номеров"""
+
+        with self._lock:
+            if self._view_version != self.version:
+                offset = time.time() - self.clock()
+                records = self._records
+                self._view = {node: record_view(records[node].address, int(records[node].refreshed_at + offset))
+                              for node in self._nodes}
+                self._view_version = self.version
+            return self._view
+
+    def stats(self) -> dict:
+        return {'size': len(self._nodes), 'expired': self.expired,
+                'wheel': len(self._wheel) if self._wheel is not None else 0}
+
+    def __deadline_of(self, key: tuple) -> float or None:
+        node, generation = key
+        record = self._records.get(node)
+        if record is None or record.generation != generation:
+            return None
+        return record.refreshed_at + self.ttl
+
+    def __remove(self, node: int) -> bool:
+        record = self._records.pop(node, None)
+        if record is None:
+            return False
+
+        del self._nodes[bisect_left(self._nodes, node)]
+        self.version += 1
+        # запись в колесе выбросится сама при разборе корзины - __deadline_of вернёт None,
+        # даже если узел к тому времени добавлен снова: у новой записи другое поколение
+        return True
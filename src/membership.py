@@ -0,0 +1,190 @@
+import time
+import struct
+import hashlib
+import threading
+
+from collections import OrderedDict
+from typing import Iterable, NamedTuple
+
+# номер узла, воплощение, жив ли узел - для хэша записи в digest
+ENTRY = struct.Struct('!HQB')
+
+
+class Member(NamedTuple):
+    node: int
+    incarnation: int
+    alive: bool
+    # возможности узла (codec.CAPABILITY_*), в хэш записи не входят: они задаются при запуске
+    # и не меняются в пределах одного воплощения
+    capabilities: int = 0
+
+
+def entry_hash(member: Member) -> int:
+    data = ENTRY.pack(member.node, member.incarnation, member.alive)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+class Membership:
+    """Версионированный список узлов кольца.
+
+    У каждого узла есть номер воплощения (incarnation): его увеличивает только сам узел -
+    при перезапуске или опровергая ложное объявление себя ушедшим. Более новое воплощение
+    всегда побеждает, а при равных воплощениях запись об уходе побеждает запись о живом узле.
+    Поэтому слияние состояний коммутативно, и узлы, обменявшиеся изменениями, приходят
+    к одному состоянию независимо от порядка пакетов.
+
+    Каждое изменение получает локальную версию, так что соседу отправляются только изменения
+    после уже отправленной ему версии. Для сверки состояний поддерживается digest - xor хэшей
+    записей, который пересчитывается за O(1) на изменение.
+
+    Вместе с записью узла расходятся его возможности capabilities - например, умеет ли он
+    пересылать пакеты fanout-рассылки
+    """
+
+    def __init__(self, my_node: int, incarnation: int = None, capabilities: int = 0):
+        self.my_node = my_node
+        self.version = 0
+
+        self._members: dict = {}
+        # узел -> версия последнего изменения, в порядке изменения
+        self._changes: OrderedDict = OrderedDict()
+        self._digest = 0
+        self._lock = threading.Lock()
+
+        # время запуска как воплощение: после перезапуска узел объявляет себя заново с большим номером
+        self.__set(Member(my_node, time.time_ns() // 1_000_000 if incarnation is None else incarnation, True,
+                          capabilities))
+
+    def __contains__(self, node: int) -> bool:
+        member = self._members.get(node)
+        return member is not None and member.alive
+
+    def get(self, node: int) -> Member or None:
+        return self._members.get(node)
+
+    @property
+    def incarnation(self) -> int:
+        return self._members[self.my_node].incarnation
+
+    def alive_nodes(self) -> list:
+        return sorted(node for node, member in self._members.items() if member.alive)
+
+    def digest(self) -> int:
+        return self._digest
+
+    # --------------------изменения--------------------
+    def merge(self, entries: Iterable, capabilities: Iterable[int] = ()) -> list:
+        """Сливает записи [node, incarnation, alive] от другого узла, возвращает изменившиеся записи.
+        capabilities - возможности узлов тех же записей по порядку; узлы старых версий их не присылают
+        """
+
+        changed = []
+        capabilities = iter(capabilities or ())
+        with self._lock:
+            for node, incarnation, alive in entries:
+                member = Member(node, incarnation, bool(alive), next(capabilities, 0))
+                old = self._members.get(node)
+                if node == self.my_node:
+                    refuted = self.__refute(member)
+                    if refuted is not None:
+                        changed.append(refuted)
+                elif self.__supersedes(member, old):
+                    self.__set(member)
+                    changed.append(member)
+                elif member.capabilities and old.incarnation == incarnation and not old.capabilities:
+                    # то же воплощение, о возможностях которого узнали только сейчас, например после снимка
+                    member = old._replace(capabilities=member.capabilities)
+                    self.__set(member)
+                    changed.append(member)
+
+        return changed
+
+    def observe(self, nodes: Iterable[int]) -> list:
+        """Добавляет узлы, о которых известно только то, что они есть в кольце.
+
+        Уже известные записи не меняются: вернувшийся после ухода узел сам сообщит
+        о себе с новым воплощением
+        """
+
+        changed = []
+        with self._lock:
+            for node in nodes:
+                if node not in self._members:
+                    member = Member(node, 0, True)
+                    self.__set(member)
+                    changed.append(member)
+
+        return changed
+
+    def refresh(self) -> list:
+        """Объявляет себя живым с новым воплощением - изменение расходится по кольцу gossip-обменом
+        и продлевает запись об узле у всех, кто удаляет записи без признаков жизни
+        """
+
+        with self._lock:
+            mine = self._members[self.my_node]
+            mine = mine._replace(incarnation=mine.incarnation + 1, alive=True)
+            self.__set(mine)
+            return [mine]
+
+    def declare_dead(self, node: int) -> list:
+        with self._lock:
+            member = self._members.get(node)
+            if node == self.my_node or member is None or not member.alive:
+                return []
+
+            member = member._replace(alive=False)
+            self.__set(member)
+            return [member]
+
+    # --------------------обмен--------------------
+    def delta_since(self, version: int) -> list:
+        """Записи, изменившиеся после локальной версии version, в виде [node, incarnation, alive]"""
+
+        delta = []
+        with self._lock:
+            for node in reversed(self._changes):
+                if self._changes[node] <= version:
+                    break
+                member = self._members[node]
+                delta.append([member.node, member.incarnation, int(member.alive)])
+
+        return delta
+
+    def snapshot(self) -> list:
+        return self.delta_since(0)
+
+    def capabilities_of(self, entries: Iterable) -> list:
+        """Возможности узлов записей entries по порядку - отправляются вместе с записями"""
+
+        members = self._members
+        return [members[entry[0]].capabilities for entry in entries]
+
+    # --------------------внутренние--------------------
+    @staticmethod
+    def __supersedes(new: Member, old: Member or None) -> bool:
+        if old is None or new.incarnation > old.incarnation:
+            return True
+        return new.incarnation == old.incarnation and old.alive and not new.alive
+
+    def __refute(self, member: Member) -> Member or None:
+        """Если кто-то считает этот узел ушедшим, узел объявляет себя живым с новым воплощением"""
+
+        mine = self._members[self.my_node]
+        if member.alive or member.incarnation < mine.incarnation:
+            return None
+
+        mine = mine._replace(incarnation=member.incarnation + 1, alive=True)
+        self.__set(mine)
+        return mine
+
+    def __set(self, member: Member) -> None:
+        old = self._members.get(member.node)
+        if old is not None:
+            self._digest ^= entry_hash(old)
+        self._digest ^= entry_hash(member)
+        self._members[member.node] = member
+
+        self.version += 1
+        self._changes[member.node] = self.version
+        self._changes.move_to_end(member.node)
@@ -0,0 +1,212 @@
+import math
+import threading
+
+from bisect import bisect_left
+from typing import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# границы корзин гистограмм задержек, секунды: от 10 мкс до 10 с
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """Монотонно растущий счётчик. function - значение берётся из уже существующего счётчика
+    компонента в момент снятия метрик, и на горячем пути ничего не добавляется
+    """
+
+    kind = 'counter'
+    __slots__ = ('name', 'help', 'function', '_value', '_lock')
+
+    def __init__(self, name: str, help: str = '', function: Callable[[], float] = None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self._value
+
+    def snapshot(self) -> float:
+        return self.get()
+
+
+class Gauge(Counter):
+    """Текущее значение величины, например размер кольца. Может уменьшаться"""
+
+    kind = 'gauge'
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+
+class Histogram:
+    """Распределение значений по корзинам с границами buckets, например задержек в секундах.
+    Хранит только число попаданий в каждую корзину, сумму и число наблюдений,
+    квантили в снимке оцениваются по корзинам
+    """
+
+    kind = 'histogram'
+    __slots__ = ('name', 'help', 'buckets', '_counts', '_sum', '_count', '_lock')
+
+    def __init__(self, name: str, help: str = '', buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # последняя корзина - значения больше самой большой границы
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def counts(self) -> tuple:
+        """Число наблюдений, сумма и попадания по корзинам, снятые согласованно"""
+
+        with self._lock:
+            return self._count, self._sum, list(self._counts)
+
+    def quantile(self, q: float, counts: list = None) -> float:
+        """Оценка квантиля q - верхняя граница корзины, в которую он попадает"""
+
+        if counts is None:
+            counts = self.counts()[2]
+        total = sum(counts)
+        if not total:
+            return 0.0
+
+        rank = q * total
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else math.inf
+        return math.inf
+
+    def snapshot(self) -> dict:
+        count, total, counts = self.counts()
+        snapshot = {'count': count, 'sum': round(total, 6)}
+        for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            value = self.quantile(q, counts)
+            # бесконечность в json не представима - как в Prometheus, пишется строкой
+            snapshot[name] = value if value != math.inf else '+Inf'
+        return snapshot
+
+
+class MetricsRegistry:
+    """Набор метрик узла. Компоненты регистрируют метрики по имени при создании и дальше
+    только обновляют их; повторная регистрация того же имени возвращает уже существующую метрику,
+    так что несколько компонентов могут делить один реестр
+    """
+
+    def __init__(self):
+        self._metrics: dict = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str = '', function: Callable[[], float] = None) -> Counter:
+        return self.__register(Counter, name, help=help, function=function)
+
+    def gauge(self, name: str, help: str = '', function: Callable[[], float] = None) -> Gauge:
+        return self.__register(Gauge, name, help=help, function=function)
+
+    def histogram(self, name: str, help: str = '', buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.__register(Histogram, name, help=help, buckets=buckets)
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def snapshot(self) -> dict:
+        """Текущие значения всех метрик: число для счётчиков и gauge, словарь для гистограмм"""
+
+        return {name: metric.snapshot() for name, metric in sorted(tuple(self._metrics.items()))}
+
+    def prometheus_text(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+
+        lines = []
+        for name, metric in sorted(tuple(self._metrics.items())):
+            if metric.help:
+                lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            if metric.kind != 'histogram':
+                lines.append(f'{name} {metric.get()}')
+                continue
+
+            count, total, counts = metric.counts()
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {count}')
+            lines.append(f'{name}_sum {total}')
+            lines.append(f'{name}_count {count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def __register(self, metric_class: type, name: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, **kwargs)
+            elif type(metric) is not metric_class:
+                raise ValueError(f'Метрика {name} уже зарегистрирована с типом {metric.kind}')
+            elif kwargs.get('function') is not None:
+                # компонент пересоздан (например, после перезапуска) - значение берётся из нового
+                metric.function = kwargs['function']
+            return metric
+
+
+class MetricsHttpServer:
+    """Локальный http-сервер, отдающий метрики реестра registry в формате Prometheus по GET /metrics"""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = '127.0.0.1'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self) -> None:
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        # порт 0 - свободный порт выбирает система
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
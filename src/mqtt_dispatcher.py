@@ -0,0 +1,233 @@
+import json
+import time
+import threading
+
+from typing import Callable
+from collections import OrderedDict
+
+from .logging_config import RateLimitedLogger
+from .worker_pool import ShardedWorkerPool
+
+logger = RateLimitedLogger('mqtt')
+
+
+class TopicTrie:
+    """Индекс подписок mqtt по уровням топика с шаблонами '+' (один уровень) и '#' (все оставшиеся).
+
+    Подписки раскладываются по дереву уровней один раз при добавлении, а поиск проходит только
+    по совпадающим ветвям. Результат поиска кэшируется по топику - команды приходят в несколько
+    постоянных топиков, - и кэш сбрасывается при добавлении подписки
+    """
+
+    def __init__(self, cache_size: int = 1024):
+        self._root: dict = {}
+        self._cache: dict = {}
+        self.cache_size = cache_size
+
+    def add(self, pattern: str, value) -> None:
+        levels = pattern.split('/')
+        if '#' in levels[:-1] or any(('+' in level or '#' in level) and len(level) > 1 for level in levels):
+            raise ValueError(f'Некорректный шаблон топика {pattern}')
+
+        node = self._root
+        for level in levels:
+            node = node.setdefault(level, {})
+        # значения узла хранятся под ключом None, который не может быть уровнем топика
+        node.setdefault(None, []).append(value)
+        self._cache.clear()
+
+    def match(self, topic: str) -> list:
+        """Значения всех подписок, под которые подходит топик topic, в порядке добавления шаблонов"""
+
+        values = self._cache.get(topic)
+        if values is None:
+            values = []
+            self.__collect(self._root, topic.split('/'), 0, values)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[topic] = values
+        return values
+
+    def __collect(self, node: dict, levels: list, index: int, values: list) -> None:
+        rest = node.get('#')
+        # '#' подходит и к самому родительскому уровню: 'a/#' совпадает с 'a'
+        if rest is not None and not (index == 0 and levels[0].startswith('$')):
+            values.extend(rest[None])
+        if index == len(levels):
+            values.extend(node.get(None, ()))
+            return
+
+        level = levels[index]
+        child = node.get(level)
+        if child is not None:
+            self.__collect(child, levels, index + 1, values)
+        # шаблоны не подходят к служебным топикам '$SYS/...'
+        child = node.get('+')
+        if child is not None and not (index == 0 and level.startswith('$')):
+            self.__collect(child, levels, index + 1, values)
+
+
+class TokenBucket:
+    """Ограничение частоты: rate событий в секунду с запасом burst на всплеск"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class _Subscription:
+    """Подписка на шаблон pattern с ограничением частоты отдельно для каждого подходящего топика.
+    Ведра последних max_topics топиков хранятся в LRU: топик, из которого давно ничего не приходило,
+    вытесняется и начинает снова с полного ведра
+    """
+
+    __slots__ = ('pattern', 'rate', 'burst', 'max_topics', 'limited', '_buckets', '_lock')
+
+    def __init__(self, pattern: str, rate: float or None, burst: float or None, max_topics: int):
+        self.pattern = pattern
+        self.rate = rate
+        self.burst = burst
+        self.max_topics = max_topics
+        self.limited = 0
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, topic: str) -> bool:
+        if not self.rate:
+            return True
+
+        with self._lock:
+            bucket = self._buckets.get(topic)
+            if bucket is None:
+                bucket = self._buckets[topic] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_topics:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(topic)
+        if bucket.allow():
+            return True
+        self.limited += 1
+        return False
+
+
+class CommandDispatcher:
+    """Разбор команд из mqtt вне сетевого потока клиента.
+
+    Сообщение сопоставляется с подписками через TopicTrie, проверяется ограничение частоты каждой
+    подходящей подписки для этого топика и ставится в очередь пула обработчиков - в сетевом потоке
+    не выполняется ни разбор json, ни отправка в кольцо, так что keepalive не задерживается. Сообщения
+    одного топика обрабатываются одним потоком строго по порядку. Обработчик выбирается по полю 'command',
+    а команды без своего обработчика получает обработчик по умолчанию.
+    Если очередь заполнена, сообщение отбрасывается и учитывается в dropped - сетевой поток клиента
+    никогда не ждёт. С workers=0 команды обрабатываются прямо в вызове dispatch.
+    rate_limit_topics - сколько топиков одной подписки помнят свою частоту
+    """
+
+    def __init__(self,
+                 workers: int = 2,
+                 queue_size: int = 1024,
+                 rate_limit_topics: int = 1024,
+                 name: str = 'mqtt-command'):
+
+        self.rate_limit_topics = rate_limit_topics
+        self.received = 0
+        self.unmatched = 0
+        self.rate_limited = 0
+        self.malformed = 0
+        self.dropped = 0
+
+        self._subscriptions = TopicTrie()
+        self._handlers: dict = {}
+        self._default_handler = None
+        self._pool = ShardedWorkerPool(self.__handle, workers, queue_size, name) if workers else None
+
+    def subscribe(self, pattern: str, rate_limit: float = None, burst: float = None) -> None:
+        """Принимает команды из топиков по шаблону pattern, из каждого топика не чаще rate_limit в секунду,
+        None - без ограничения
+        """
+
+        self._subscriptions.add(pattern, _Subscription(pattern, rate_limit, burst, self.rate_limit_topics))
+
+    def register(self, command: str, handler: Callable[[dict, str], None]) -> None:
+        """Обработчик handler(payload, topic) команд command, None - обработчик по умолчанию"""
+
+        if command is None:
+            self._default_handler = handler
+        else:
+            self._handlers[command] = handler
+
+    def start(self) -> None:
+        if self._pool is not None:
+            self._pool.start()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+
+    def dispatch(self, topic: str, payload: bytes) -> bool:
+        """Ставит сообщение в очередь обработки. Возвращает False, если оно отброшено:
+        топик ни с чем не совпал, превышена частота или очередь заполнена
+        """
+
+        subscriptions = self._subscriptions.match(topic)
+        if not subscriptions:
+            self.unmatched += 1
+            return False
+        for subscription in subscriptions:
+            if not subscription.allow(topic):
+                self.rate_limited += 1
+                logger.warning('Превышена частота команд в топике {}, команда отброшена', lambda: topic)
+                return False
+
+        self.received += 1
+        if self._pool is None:
+            self.__handle((topic, payload))
+            return True
+        if not self._pool.submit(topic, (topic, payload), timeout=0):
+            self.dropped += 1
+            logger.warning('Очередь обработки команд из mqtt заполнена, команда отброшена')
+            return False
+        return True
+
+    def depth(self) -> int:
+        return sum(self._pool.depths()) if self._pool is not None else 0
+
+    def stats(self) -> dict:
+        pool = self._pool.stats() if self._pool is not None else {}
+        return {'received': self.received,
+                'unmatched': self.unmatched,
+                'rate_limited': self.rate_limited,
+                'malformed': self.malformed,
+                'dropped': self.dropped,
+                'processed': pool.get('processed', 0),
+                'errors': pool.get('errors', 0),
+                'rejected': pool.get('rejected', 0)}
+
+    def __handle(self, item: tuple) -> None:
+        topic, payload = item
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            self.malformed += 1
+            logger.warning('Сообщение в топике {} - не json, пропущено', lambda: topic)
+            return
+        if not isinstance(payload, dict):
+            self.malformed += 1
+            return
+
+        handler = self._handlers.get(payload.get('command'), self._default_handler)
+        if handler is not None:
+            handler(payload, topic)
@@ -1,10 +1,18 @@
 import json
+import asyncio
+import time
 
 import paho.mqtt.client as mqtt
 
 from paho.mqtt.client import Client
+from .logging_config import get_logger
+from .metrics import MetricsRegistry
+from .mqtt_dispatcher import CommandDispatcher
+from .publish_queue import PublishQueue, AsyncPublishQueue
 from .zmq_pipeline import ZmqPipelineNode
 
+logger = get_logger('mqtt')
+
 
 class MqttWorker:
     def __init__(self,
@@ -13,7 +21,19 @@ class MqttWorker:
                  mqtt_topic: str,
                  host_ip: str,
                  neighbors: list,
-                 zmq_pipeline: ZmqPipelineNode):
+                 zmq_pipeline: ZmqPipelineNode,
+                 connect: bool = True,
+                 qos: int = 0,
+                 queue_size: int = 1000,
+                 queue_policy: str = 'drop',
+                 batch_interval: float = 0.0,
+                 client: Client = None,
+                 metrics: MetricsRegistry = None,
+                 ingest_timeout: float = 1.0,
+                 command_workers: int = 2,
+                 command_queue_size: int = 1024,
+                 command_rate_limit: float = None,
+                 event_loop: bool = False):
 
         self.mqtt_broker = mqtt_broker
         self.mqtt_port = mqtt_port
@@ -22,37 +42,122 @@ class MqttWorker:
         self.neighbors = neighbors
 
         self.zmq_pipeline = zmq_pipeline
-        self.client = self.__connect_mqtt()
+        # event_loop - клиент ведёт AsyncioMqttLoop, и команды с публикацией обрабатываются в том же
+        # event loop, без своих потоков. Создавать такой MqttWorker нужно внутри работающего event loop
+        self.event_loop = event_loop
+        # сколько команда из mqtt ждёт места в очередях надёжных линий, прежде чем будет отброшена.
+        # Ждёт обработчик команд, а новые сообщения тем временем копятся в его очереди; в event loop
+        # ждать нельзя, и команда без места отбрасывается сразу
+        self.ingest_timeout = 0 if event_loop else ingest_timeout
+        # команды разбираются и рассылаются в пуле обработчиков, а не в сетевом потоке клиента.
+        # command_rate_limit - сколько команд в секунду принимается из каждого прослушиваемого топика
+        self.command_rate_limit = command_rate_limit
+        self.dispatcher = CommandDispatcher(workers=0 if event_loop else command_workers,
+                                            queue_size=command_queue_size)
+        self.dispatcher.register(None, self.__forward_command)
+        # без connect клиент подключается позже через connect(), например после привязки к event loop.
+        # client - уже созданный клиент с интерфейсом paho, например локальная замена брокера в симуляторе
+        if client is not None:
+            self.client = client
+        else:
+            self.client = self.__connect_mqtt() if connect else mqtt.Client()
+
+        # публикация идёт из отдельного потока или задачи event loop, чтобы медленный брокер
+        # не задерживал пересылку по кольцу
+        self.qos = qos
+        self.metrics = metrics or MetricsRegistry()
+        publish_latency = self.metrics.histogram('mqtt_publish_latency_seconds',
+                                                 'Задержка сообщения от постановки в очередь до публикации, с')
+        if event_loop:
+            self.publish_queue = AsyncPublishQueue(publish=self.__publish,
+                                                   max_size=queue_size,
+                                                   policy=queue_policy,
+                                                   batch_interval=batch_interval,
+                                                   observe_latency=publish_latency.observe)
+        else:
+            self.publish_queue = PublishQueue(publish=self.__publish,
+                                              max_size=queue_size,
+                                              policy=queue_policy,
+                                              batch_interval=batch_interval,
+                                              observe_latency=publish_latency.observe)
+        self.publish_queue.start()
+        self.__register_metrics()
 
     def publish_neighbours(self, neighbours: list) -> None:
         """Отправляет список соседей neighbours узла брокеру"""
 
         self.send_message_on_mqtt({'command': 'neighbors', 'neighbors': neighbours})
-        print('Отправил соседей в mqtt')
+        logger.info('Отправил соседей в mqtt')
 
     def publish_nodes(self, nodes_dict: dict):
         self.send_message_on_mqtt({'all_nodes': nodes_dict})
 
-    def start_listening_topic(self, listen_topic: str) -> None:
+    def connect(self) -> None:
+        self.client.connect(self.mqtt_broker, self.mqtt_port)
+
+    def start_listening_topic(self, listen_topic: str, start_loop: bool = True) -> None:
         """Запускает прослушивание топика listen_topic, проверив что он указан,
-        и если приходит нужная команда - рассылает её соседям
+        и если приходит нужная команда - рассылает её соседям.
+        Без start_loop сетевой цикл клиента не запускается в отдельном потоке - его ведёт AsyncioMqttLoop
         """
 
         def on_message(client, userdata, message):
-            """Обработчик сообщений из MQTT"""
+            """Обработчик сообщений из MQTT - только передаёт сообщение в пул обработчиков"""
 
-            payload = json.loads(message.payload.decode('utf-8'))
-            if 'command' in payload and 'message' in payload:
-                for neighbour in self.neighbors:
-                    self.zmq_pipeline.start_sending_packet(neighbour, payload)
+            self.dispatcher.dispatch(message.topic, message.payload)
 
         self.client.on_message = on_message
 
         if listen_topic:
-            self.client.subscribe(listen_topic)
-            self.client.loop_start()
+            self.dispatcher.start()
+            self.subscribe(listen_topic)
+            if start_loop:
+                self.client.loop_start()
         else:
-            print("Ошибка: Топик для прослушивания не указан.")
+            logger.error('Топик для прослушивания не указан')
+
+    def subscribe(self, topic: str, rate_limit: float = None) -> None:
+        """Добавляет прослушиваемый топик topic, в том числе с шаблонами '+' и '#'.
+        rate_limit - сколько команд в секунду из него принимается, по умолчанию command_rate_limit
+        """
+
+        self.dispatcher.subscribe(topic, rate_limit or self.command_rate_limit)
+        self.client.subscribe(topic)
+
+    def register_command(self, command: str, handler) -> None:
+        """Обработчик handler(payload, topic) команды command вместо рассылки её по кольцу"""
+
+        self.dispatcher.register(command, handler)
+
+    def __forward_command(self, payload: dict, topic: str) -> None:
+        """Рассылает команду всем узлам кольца или адресным пакетом одному узлу"""
+
+        if 'command' not in payload or 'message' not in payload:
+            return
+        if not self.zmq_pipeline.wait_for_credit(self.ingest_timeout):
+            self._commands_rejected.inc()
+            logger.warning('Линии к соседям перегружены, команда из mqtt отброшена')
+            return
+        if payload.get('target'):
+            # команда одному узлу - адресным пакетом, а не по всему кольцу
+            self.zmq_pipeline.send_unicast(int(payload['target']), payload)
+        else:
+            self.zmq_pipeline.broadcast(payload)
+
+    def publish_stats(self, topic: str, snapshot: dict) -> None:
+        """Публикует снимок метрик snapshot в топик статистики topic в обход очереди событий:
+        снимки редкие, а при переполнении очереди они нужнее всего
+        """
+
+        self.client.publish(topic, json.dumps({'time': time.time(), 'metrics': snapshot}), qos=0)
+
+    def stop(self) -> None:
+        """Отправляет оставшиеся в очереди сообщения и отключается от брокера"""
+
+        self.publish_queue.close()
+        self.dispatcher.close()
+        self.client.loop_stop()
+        self.client.disconnect()
 
     def __connect_mqtt(self) -> Client:
         """Подключается к брокеру mqtt по его адрессу mqtt_broker и порту mqtt_port"""
@@ -62,7 +167,93 @@ class MqttWorker:
 
         return client
 
-    def send_message_on_mqtt(self, message: dict) -> None:
-        """Отправляет сообщение message в виде json по топику mqtt_topic"""
+    def send_message_on_mqtt(self, message: dict) -> bool:
+        """Ставит сообщение message в очередь на отправку в виде json по топику mqtt_topic.
+        Возвращает False, если очередь переполнена и сообщение отброшено
+        """
+
+        return self.publish_queue.put(message)
+
+    def __register_metrics(self) -> None:
+        publish_queue = self.publish_queue
+        self.metrics.counter('mqtt_messages_published_total', 'Сообщения, опубликованные в mqtt',
+                             function=lambda: publish_queue.published)
+        self.metrics.counter('mqtt_messages_dropped_total', 'Сообщения, отброшенные при переполнении очереди',
+                             function=lambda: publish_queue.dropped)
+        self.metrics.counter('mqtt_publish_errors_total', 'Ошибки публикации в mqtt',
+                             function=lambda: publish_queue.errors)
+        self.metrics.gauge('mqtt_queue_depth', 'Сообщения в очереди публикации', function=publish_queue.depth)
+        dispatcher = self.dispatcher
+        self.metrics.counter('mqtt_commands_received_total', 'Сообщения, принятые из mqtt',
+                             function=lambda: dispatcher.received)
+        self._commands_rejected = self.metrics.counter('mqtt_commands_rejected_total',
+                                                       'Команды из mqtt, отброшенные из-за перегрузки линий')
+        self.metrics.counter('mqtt_commands_rate_limited_total',
+                             'Команды из mqtt, отброшенные из-за превышения частоты в топике',
+                             function=lambda: dispatcher.rate_limited)
+        self.metrics.counter('mqtt_commands_dropped_total',
+                             'Команды из mqtt, отброшенные из-за заполненной очереди обработки',
+                             function=lambda: dispatcher.dropped)
+        self.metrics.gauge('mqtt_command_queue_depth', 'Команды из mqtt в очереди обработки',
+                           function=dispatcher.depth)
+
+    def __publish(self, payload: str) -> None:
+        self.client.publish(self.mqtt_topic, payload, qos=self.qos)
+
+
+class AsyncioMqttLoop:
+    """Ведёт сетевой цикл клиента paho в asyncio вместо потока loop_start():
+    чтение и запись сокета - по готовности через add_reader/add_writer, служебные действия
+    (keepalive, переподключение) - в отдельной задаче раз в misc_interval секунд
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: Client, misc_interval: float = 1):
+        self.loop = loop
+        self.client = client
+        self.misc_interval = misc_interval
+        self._misc_task = None
+
+        client.on_socket_open = self.__on_socket_open
+        client.on_socket_close = self.__on_socket_close
+        client.on_socket_register_write = self.__on_socket_register_write
+        client.on_socket_unregister_write = self.__on_socket_unregister_write
+
+    def start(self) -> None:
+        """Начинает обслуживание клиента. Если клиент уже подключён, его сокет подхватывается сразу"""
+
+        sock = self.client.socket()
+        if sock is not None:
+            self.__on_socket_open(self.client, None, sock)
+            if self.client.want_write():
+                self.__on_socket_register_write(self.client, None, sock)
+        self._misc_task = self.loop.create_task(self.__misc_loop())
+
+    def stop(self) -> None:
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+        sock = self.client.socket()
+        if sock is not None:
+            self.__on_socket_close(self.client, None, sock)
+
+    async def __misc_loop(self) -> None:
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    self.client.reconnect()
+                except OSError:
+                    pass
+            await asyncio.sleep(self.misc_interval)
+
+    def __on_socket_open(self, client: Client, userdata, sock) -> None:
+        self.loop.add_reader(sock, client.loop_read)
+
+    def __on_socket_close(self, client: Client, userdata, sock) -> None:
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def __on_socket_register_write(self, client: Client, userdata, sock) -> None:
+        # publish вызывают только задачи того же event loop - очередь публикации MqttWorker(event_loop=True)
+        self.loop.add_writer(sock, client.loop_write)
 
-        self.client.publish(self.mqtt_topic, json.dumps(message))
+    def __on_socket_unregister_write(self, client: Client, userdata, sock) -> None:
+        self.loop.remove_writer(sock)
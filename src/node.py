@@ -1,89 +1,425 @@
-import sys
+import os
 import time
+import tempfile
 import threading
 
-from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
 
+from .logging_config import get_logger, is_enabled
+from .address_plan import AddressPlan, DEFAULT_ADDRESS_PLAN
+from .failure_detector import PhiAccrualFailureDetector
+from .metrics import MetricsRegistry, MetricsHttpServer
 from .mqtt_worker import MqttWorker
 from .zmq_pipeline import ZmqPipelineNode
 from .node_monitor import NodeMonitor
-from .utils import get_node_id_from_addr, get_my_ip, sleeping
+from .snapshot import RingSnapshot
+from .utils import get_my_ip
 
-logger.remove()
-logger.add(sys.stdout, format="{time:HH:mm:ss} | {level} | {message}", level="DEBUG")
+logger = get_logger('node')
 
 
 class Node:
+    # номера узлов и их адреса; задаётся до _configure, потому что по нему ищется адрес узла
+    _address_plan: AddressPlan = DEFAULT_ADDRESS_PLAN
+
     def __init__(self):
+        self._started_at = time.monotonic()
         logger.info('Старт инициализации')
 
-        self._my_ip: str = get_my_ip()
+        self._configure()
+        self._neighbors: list = []
+        self._create_components(mqtt_connect=False)
+        self._start_concurrently()
+
+    def _configure(self, my_ip: str = None) -> None:
+        self._my_ip: str = my_ip or get_my_ip(self._address_plan)
+        self._my_node: int = self._address_plan.node_of(self._my_ip)
         self._ping_port: int = 80
         self._zmq_port: int = 5566
         self._mqtt_broker_port: int = 1883
         self._mqtt_broker_host: str = 'localhost'
-
-        self._neighbors_monitor = NodeMonitor(get_node_id_from_addr(addr=self._my_ip), self._ping_port, self._my_ip)
-        self._neighbors: list = self.__get_neighbors()
-        self.zmq_pipeline = ZmqPipelineNode(self._zmq_port, self._my_ip, self._neighbors)
+        self._mqtt_qos: int = 0
+        # 0 - каждое событие кольца публикуется отдельным сообщением, иначе пачкой раз в интервал
+        self._mqtt_batch_interval: float = 0.0
+        self._mqtt_queue_size: int = 1000
+        self._mqtt_queue_policy: str = 'drop'
+        # потоки разбора команд из mqtt, 0 - в сетевом потоке клиента, и сколько команд в секунду
+        # принимается из топика, None - без ограничения
+        self._mqtt_command_workers: int = 2
+        self._mqtt_command_rate_limit: float = None
+        # число обработчиков принятых пакетов, 0 - обработка прямо в цикле приёма
+        self._pipeline_workers: int = 4
+        # 'ring' - адресные пакеты идут по соседям кольца, 'finger' - напрямую через finger table; прямые
+        # линии открываются к далёким узлам, поэтому finger включается только явно
+        self._routing_mode: str = 'ring'
+        # 'ring' - команды и события расходятся по кольцу через соседей, 'fanout' - каждый узел пересылает
+        # их _fanout узлам кольца (_fanout_peers: 'structured' или 'random') за O(log n) раундов
+        self._broadcast_mode: str = 'ring'
+        self._fanout: int = 3
+        self._fanout_peers: str = 'structured'
+        # 'plain' - пакеты данных без подтверждений, 'reliable' - с подтверждениями, повторами и окном на линию
+        self._link_mode: str = 'plain'
+        # 'off' - без сжатия, 'zlib' - payload от _compression_threshold байт сжимается на линиях
+        # к соседям, которые тоже сжимают
+        self._compression: str = 'off'
+        self._compression_threshold: int = 512
+        # 'heartbeat' - отказ соседа определяется по heartbeat через zmq, 'tcp' - подключением к ping_port
+        self._liveness: str = 'heartbeat'
+        self._heartbeat_interval: float = 0.1
+        # сколько секунд без heartbeat сосед точно считается ушедшим
+        self._heartbeat_max_silence: float = 1.0
+        self._probe_interval: float = 5
+        # сколько ближайших узлов кольца с каждой стороны проверяется при уходе соседа до полного поиска
+        self._successor_list_size: int = 4
+        self._unknown_nodes: set = set()
+        self._stats_interval: float = 5
+        # раз в интервал соседям уходят изменения списка узлов или только digest для сверки
+        self._gossip_interval: float = 1
+        self._last_gossip_time: float = 0
+        # узел кольца, о котором столько секунд ничего не слышно, удаляется из списка, None - не удаляется.
+        # Сам узел объявляет себя живым раз в четверть этого времени
+        self._member_ttl: float = 120
+        self._last_announce_time: float = 0
+        self._last_stats_time: float = 0
+        # снимок метрик раз в интервал публикуется в mqtt, None - не публикуется
+        self._metrics_interval: float = 10
+        self._metrics_topic: str = '/leader/$SYS/{node}/stats'
+        # порт локального http для сбора метрик Prometheus, None - сервер не запускается
+        self._metrics_http_port: int = None
+        self._last_metrics_time: float = 0
+        self._metrics_server = None
+        # снимок соседей и списка узлов для быстрого перезапуска, None - снимок не ведётся
+        self._snapshot_path: str = os.path.join(tempfile.gettempdir(), 'ring-snapshot-{node}.bin')
+        self._snapshot_interval: float = 5
+        self._snapshot_max_age: float = 3600
+        self._last_snapshot_time: float = 0
+        self._snapshot_written_time: float = 0
+        self._snapshot_state = None
+        self.metrics = MetricsRegistry()
+        self._startup_phase('interface', time.monotonic() - self._started_at)
+        # по умолчанию каждый узел - отдельная машина: свой контекст zmq, tcp и брокер mqtt на localhost
+        self._zmq_context = None
+        self._zmq_endpoint_of = None
+        self._mqtt_client = None
+        self._stopped = threading.Event()
+
+        self._neighbors_monitor = self._create_monitor()
+
+    def _create_monitor(self) -> NodeMonitor:
+        return NodeMonitor(self._my_node, self._ping_port, self._my_ip, metrics=self.metrics,
+                           address_plan=self._address_plan, successor_list_size=self._successor_list_size)
+
+    def _create_components(self, mqtt_connect: bool = True, event_loop: bool = False) -> None:
+        self.failure_detector = PhiAccrualFailureDetector(heartbeat_interval=self._heartbeat_interval,
+                                                          max_silence=self._heartbeat_max_silence)
+        self.failure_detector.watch(map(self._address_plan.node_of, self._neighbors))
+        self.zmq_pipeline = ZmqPipelineNode(self._zmq_port, self._my_ip, self._neighbors, self.failure_detector,
+                                            workers=self._pipeline_workers, routing_mode=self._routing_mode,
+                                            context=self._zmq_context, endpoint_of=self._zmq_endpoint_of,
+                                            metrics=self.metrics, address_plan=self._address_plan,
+                                            link_mode=self._link_mode, member_ttl=self._member_ttl,
+                                            compression=self._compression,
+                                            compression_threshold=self._compression_threshold,
+                                            broadcast_mode=self._broadcast_mode, fanout=self._fanout,
+                                            fanout_peers=self._fanout_peers)
         self.mqtt_worker = MqttWorker(mqtt_broker=self._mqtt_broker_host, mqtt_port=self._mqtt_broker_port,
                                       mqtt_topic='/leader/core', host_ip=self._my_ip,
-                                      neighbors=self._neighbors, zmq_pipeline=self.zmq_pipeline
+                                      neighbors=self._neighbors, zmq_pipeline=self.zmq_pipeline,
+                                      connect=mqtt_connect, qos=self._mqtt_qos,
+                                      queue_size=self._mqtt_queue_size, queue_policy=self._mqtt_queue_policy,
+                                      batch_interval=self._mqtt_batch_interval, client=self._mqtt_client,
+                                      metrics=self.metrics, command_workers=self._mqtt_command_workers,
+                                      command_rate_limit=self._mqtt_command_rate_limit,
+                                      event_loop=event_loop
                                       )
+        self._snapshot = None
+        if self._snapshot_path:
+            self._snapshot = RingSnapshot(self._snapshot_path.format(node=self._my_node),
+                                          max_age=self._snapshot_max_age)
+        self._monitor_round_time = self.metrics.histogram('monitor_round_seconds',
+                                                          'Время одного круга мониторинга соседей, с')
+        self._neighbour_events = {event: self.metrics.counter(f'{event}_total', f'События {event}')
+                                  for event in ('neighbour_gone', 'neighbour_back')}
+        detector = self.failure_detector
+        self.metrics.counter('failure_detector_detections_total', 'Соседи, признанные отказавшими детектором',
+                             function=lambda: detector.detections)
+        self.metrics.counter('failure_detector_false_positives_total',
+                             'Подозрения детектора, опровергнутые признаками жизни соседа',
+                             function=lambda: detector.false_positives)
+        self.metrics.gauge('failure_detector_false_positive_rate', 'Доля опровергнутых подозрений детектора',
+                           function=lambda: detector.stats()['false_positive_rate'])
+        self.metrics.gauge('failure_detector_detection_latency_avg_seconds',
+                           'Среднее время от последнего heartbeat до признания отказа, с',
+                           function=lambda: detector.stats()['detection_latency_avg'])
+        self.metrics.gauge('failure_detector_detection_latency_max_seconds',
+                           'Наибольшее время от последнего heartbeat до признания отказа, с',
+                           function=lambda: detector.detection_latency_max)
+
+    def _start_concurrently(self) -> None:
+        """Подключение к брокеру, открытие сокета приёма и поиск соседей не зависят друг от друга
+        и выполняются одновременно, так что запуск занимает время самого долгого из них
+        """
+
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='startup') as executor:
+            connected = executor.submit(self.__timed, 'mqtt_connect', self.mqtt_worker.connect)
+            bound = executor.submit(self.__timed, 'zmq_bind', self.zmq_pipeline.bind)
+            neighbors = executor.submit(self.__timed, 'discovery',
+                                        lambda: self._neighbors_monitor.init_neighbors(self._restore_snapshot()))
+            connected.result()
+            bound.result()
+            self._set_initial_neighbors(neighbors.result())
+
+    def _restore_snapshot(self) -> tuple:
+        """Восстанавливает список узлов из снимка, сохранённого до перезапуска, и возвращает узлы кольца,
+        среди которых одновременной проверкой ищутся соседи. Пустой кортеж - снимка нет, нужен полный поиск
+        """
+
+        snapshot = self._snapshot.load(self._my_node) if self._snapshot is not None else None
+        if snapshot is None:
+            return ()
+
+        # узлы, не ответившие при поиске соседей, не удаляются сразу: их записи истекут через _member_ttl
+        # от последнего признака жизни до перезапуска, если gossip не сообщит о них новое
+        self.zmq_pipeline.restore_members(snapshot.members, snapshot.seen_at)
+        self.metrics.gauge('startup_snapshot_members', 'Записи списка узлов, восстановленные из снимка'
+                           ).set(len(snapshot.members))
+        logger.info('Список узлов восстановлен из снимка {:.0f} с назад', time.time() - snapshot.saved_at)
+        return self._known_nodes()
+
+    def __timed(self, phase: str, function):
+        started = time.monotonic()
+        result = function()
+        self._startup_phase(phase, time.monotonic() - started)
+        return result
+
+    def _startup_phase(self, phase: str, seconds: float) -> None:
+        self.metrics.gauge(f'startup_{phase}_seconds', f'Длительность этапа запуска {phase}, с').set(round(seconds, 6))
+
+    def _mark_ready(self) -> None:
+        seconds = time.monotonic() - self._started_at
+        self._startup_phase('ready', seconds)
+        logger.info('Инициализация завершена за {:.3f} с. Начало работы...', seconds)
 
     def start_work(self):
-        my_node = get_node_id_from_addr(addr=self._my_ip)
-        logger.info(f'Node: {my_node}')
+        logger.info('Node: {}', self._my_node)
 
         self._neighbors_monitor.mqtt = self.mqtt_worker
+        self._start_metrics_server()
         threading.Thread(target=self.zmq_pipeline.handle_received_packet, args=(self.mqtt_worker,)).start()
 
         self.mqtt_worker.start_listening_topic(listen_topic='/leader/network')
-        self.mqtt_worker.publish_neighbours(self._neighbors)
+        self._announce()
 
-        for neighbour in self._neighbors:
-            self.zmq_pipeline.start_sending_packet(addressee=neighbour,
-                                                   packet={'nodes_in_network': [my_node]})
+        # список узлов собирается gossip-обменом с соседями: ждём, пока состояние совпадёт хотя бы с одним
+        while not self.zmq_pipeline.membership_synced.wait(self._gossip_interval):
+            if self._stopped.is_set():
+                return
+            self.zmq_pipeline.send_gossip(self._neighbors, full=1)
 
-        all_nodes = self.zmq_pipeline.get_all_node()
-        while my_node not in all_nodes:
-            sleeping(True)
-            all_nodes = self.zmq_pipeline.get_all_node()
+        self.mqtt_worker.publish_nodes(self.zmq_pipeline.get_all_node())
+        self._mark_ready()
 
-        self.mqtt_worker.publish_nodes(all_nodes)
+        self.monitor_network()
 
-        logger.info('Инициализация завершена. Начало работы...')
+    def _announce(self) -> None:
+        """Сообщает брокеру своих соседей и обменивается с соседями списком узлов"""
 
-        self.monitor_network()
+        self.mqtt_worker.publish_neighbours(self._neighbors)
+        self.zmq_pipeline.send_gossip(self._neighbors, full=1)
+
+    def _start_metrics_server(self) -> None:
+        if self._metrics_http_port is not None:
+            self._metrics_server = MetricsHttpServer(self.metrics, self._metrics_http_port)
+            self._metrics_server.start()
+            logger.info('Метрики Prometheus: http://127.0.0.1:{}/metrics', self._metrics_server.port)
+
+    def stop(self) -> None:
+        """Останавливает мониторинг сети и приём пакетов и отключается от брокера"""
+
+        self._stopped.set()
+        self._save_snapshot(force=True)
+        self.zmq_pipeline.stop()
+        self.mqtt_worker.stop()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
 
     def monitor_network(self) -> None:
-        while True:
+        while not self._stopped.is_set():
+            started = time.monotonic()
             if not self._neighbors:
-                print('Нет соседей. Поиск...')
-                self._neighbors = self._neighbors_monitor.init_neighbors()
+                logger.warning('Нет соседей. Поиск...')
+                self._neighbors = self._neighbors_monitor.init_neighbors(self._known_nodes())
+                self.failure_detector.watch(map(self._address_plan.node_of, self._neighbors))
                 self.mqtt_worker.publish_neighbours(self._neighbors)
+            elif self._liveness == 'heartbeat':
+                self.__check_neighbors_by_heartbeat()
+            else:
+                self.__check_neighbors_by_probe()
+
+            self._gossip_round()
+            self._monitor_round_time.observe(time.monotonic() - started)
+            self._log_stats()
+            self._publish_metrics()
+            self._save_snapshot()
+            self._stopped.wait(self._monitor_interval())
+
+    def _monitor_interval(self) -> float:
+        return self._heartbeat_interval if self._liveness == 'heartbeat' else self._probe_interval
+
+    def __check_neighbors_by_probe(self) -> None:
+        gone_neighbors = self.get_gone_neighbors()
+        new_neighbors = self._neighbors_monitor.get_neighbors(self._known_nodes())
+
+        if new_neighbors != self._neighbors and not gone_neighbors:
+            # если соседи изменились, но при прошлой проверке никто не упал проверить ещё раз
+            gone_neighbors = self.get_gone_neighbors()
+
+        self._update_neighbors(new_neighbors, gone_neighbors)
+
+    def __check_neighbors_by_heartbeat(self) -> None:
+        suspected_neighbors, rescan = self._heartbeat_round()
+        if rescan:
+            new_neighbors = self._neighbors_monitor.get_neighbors(self._known_nodes())
+            alive = set()
+            if suspected_neighbors:
+                alive = self._neighbors_monitor.discovery.probe(map(self._address_plan.node_of, suspected_neighbors))
+            self._update_neighbors(new_neighbors, self._confirm_gone(suspected_neighbors, new_neighbors, alive))
+
+    def _confirm_gone(self, suspected_neighbors: tuple, new_neighbors: list, alive: set) -> tuple:
+        """Соседи из suspected_neighbors, которые не нашлись при новом поиске и не ответили
+        на проверку (alive - ответившие узлы). С остальных подозрение снимается как ложное,
+        и их история heartbeat сохраняется
+        """
+
+        gone_neighbors = []
+        for neighbour in suspected_neighbors:
+            node = self._address_plan.node_of(neighbour)
+            if node in alive or new_neighbors and neighbour in new_neighbors:
+                self.failure_detector.refute(node)
             else:
-                gone_neighbors = self.get_gone_neighbors()
-                new_neighbors = self._neighbors_monitor.get_neighbors()
+                gone_neighbors.append(neighbour)
+
+        return tuple(gone_neighbors)
+
+    def _heartbeat_round(self) -> tuple:
+        """Рассылает heartbeat соседям и по детектору отказов определяет ушедших.
+        Возвращает ушедших соседей и нужно ли искать соседей заново -
+        только если кто-то ушёл или heartbeat пришёл от нового узла
+        """
 
-                if new_neighbors != self._neighbors and not gone_neighbors:
-                    # если соседи изменились, но при прошлой проверке никто не упал проверить ещё раз
-                    gone_neighbors = self.get_gone_neighbors()
+        self.zmq_pipeline.send_heartbeats(self._neighbors)
 
-                # проверка вернувшихся соседей
-                back_neighbors = ()
-                if new_neighbors != 0 and new_neighbors != self._neighbors:
-                    back_neighbors = self.get_back_neighbors(new_neighbors)
+        suspected = set(self.failure_detector.check())
+        gone_neighbors = tuple(neighbour for neighbour in self._neighbors
+                               if self._address_plan.node_of(neighbour) in suspected)
+        neighbour_nodes = {self._address_plan.node_of(neighbour) for neighbour in self._neighbors}
+        unknown_nodes = self.failure_detector.drain_arrivals() - neighbour_nodes
+        self._unknown_nodes = unknown_nodes
 
-                if back_neighbors:
-                    self.__send_event_message(event='neighbour_back', event_neighbors=back_neighbors)
+        return gone_neighbors, bool(gone_neighbors or unknown_nodes)
 
-                self.__set_neighbors(new_neighbors, gone_neighbors, back_neighbors)
+    def _known_nodes(self) -> tuple:
+        """Узлы кольца по membership вместе с узлами, от которых пришёл heartbeat, но которых
+        ещё нет в списке, - среди них в первую очередь ищутся соседи при починке кольца
+        """
 
-                if gone_neighbors:
-                    self.__send_event_message(event='neighbour_gone', event_neighbors=gone_neighbors)
+        nodes = self.zmq_pipeline.routing_table.nodes
+        if self._unknown_nodes:
+            nodes = tuple(sorted({*nodes, *self._unknown_nodes}))
 
-            time.sleep(5)
+        return nodes
+
+    def _update_neighbors(self, new_neighbors: list, gone_neighbors: tuple) -> None:
+        # проверка вернувшихся соседей
+        back_neighbors = ()
+        if new_neighbors != 0 and new_neighbors != self._neighbors:
+            back_neighbors = self.get_back_neighbors(new_neighbors)
+
+        if back_neighbors:
+            self.__send_event_message(event='neighbour_back', event_neighbors=back_neighbors)
+
+        self.__set_neighbors(new_neighbors, gone_neighbors, back_neighbors)
+
+        if gone_neighbors:
+            self.__send_event_message(event='neighbour_gone', event_neighbors=gone_neighbors)
+
+    def _set_initial_neighbors(self, neighbors: list) -> None:
+        """Соседи, найденные при запуске, - о них не отправляется событий"""
+
+        self.__set_neighbors(neighbors, (), ())
+
+    def _gossip_round(self) -> None:
+        now = time.monotonic()
+        if now - self._last_gossip_time < self._gossip_interval:
+            return
+
+        self._last_gossip_time = now
+        if self._member_ttl is not None:
+            self._expire_members(now)
+        self.zmq_pipeline.send_gossip(self._neighbors)
+
+    def _expire_members(self, now: float) -> None:
+        """Продлевает запись о себе у других узлов и удаляет узлы, о которых дольше _member_ttl
+        ничего не слышно. Каждый узел удаляет их сам, поэтому событие публикуется только в mqtt
+        """
+
+        if now - self._last_announce_time >= self._member_ttl / 4:
+            self._last_announce_time = now
+            self.zmq_pipeline.announce_alive()
+
+        for node in self.zmq_pipeline.expire_members():
+            logger.info('Узел {} удалён из списка узлов: нет признаков жизни {} с', node, self._member_ttl)
+            self.mqtt_worker.send_message_on_mqtt({'event': 'member_expired', 'node': node})
+
+    def _log_stats(self) -> None:
+        now = time.monotonic()
+        if now - self._last_stats_time < self._stats_interval:
+            return
+
+        self._last_stats_time = now
+        # статистика собирается, только если уровень категории пропускает отладочные сообщения
+        if not is_enabled('node', 'DEBUG'):
+            return
+        lazy = logger.opt(lazy=True)
+        lazy.debug('Пул сокетов отправки: {}', self.zmq_pipeline.sender_pool.stats)
+        lazy.debug('Детектор отказов: {}', self.failure_detector.stats)
+        lazy.debug('Кэш обработанных пакетов: {}', self.zmq_pipeline.seen_cache.stats)
+        lazy.debug('Стадии конвейера: {}', self.zmq_pipeline.stage_stats)
+        lazy.debug('Очередь публикации mqtt: {}', self.mqtt_worker.publish_queue.stats)
+        lazy.debug('Команды из mqtt: {}', self.mqtt_worker.dispatcher.stats)
+
+    def _publish_metrics(self) -> None:
+        now = time.monotonic()
+        if self._metrics_interval is None or now - self._last_metrics_time < self._metrics_interval:
+            return
+
+        self._last_metrics_time = now
+        topic = self._metrics_topic.format(node=self._my_node)
+        self.mqtt_worker.publish_stats(topic, self.metrics.snapshot())
+
+    def _save_snapshot(self, force: bool = False) -> None:
+        """Раз в интервал записывает снимок, если список узлов изменился с прошлой записи. Без изменений
+        снимок переписывается раз в четверть _member_ttl, чтобы время последнего признака жизни узлов в нём
+        не устаревало
+        """
+
+        now = time.monotonic()
+        if self._snapshot is None or not force and now - self._last_snapshot_time < self._snapshot_interval:
+            return
+
+        self._last_snapshot_time = now
+        state = self.zmq_pipeline.membership.version
+        if state == self._snapshot_state and (self._member_ttl is None or
+                                              now - self._snapshot_written_time < self._member_ttl / 4):
+            return
+
+        try:
+            self._snapshot.save(self._my_node, self.zmq_pipeline.snapshot_members())
+        except OSError as error:
+            logger.warning('Не удалось записать снимок {}: {}', self._snapshot.path, error)
+            return
+        self._snapshot_state = state
+        self._snapshot_written_time = now
 
     def get_gone_neighbors(self) -> tuple:
         gone_neighbors = self._neighbors_monitor.check_gone_neighbors()
@@ -95,29 +431,37 @@ class Node:
 
         return back_neighbors
 
-    def __get_neighbors(self) -> list:
-        return self._neighbors_monitor.init_neighbors()
-
     def __set_neighbors(self, neighbors: list, gone_neighbors: tuple, back_neighbors: tuple) -> None:
+        # история heartbeat сохраняется у соседей, которые остались соседями
+        previous_neighbors = set(self._neighbors or ())
+        previous_nodes = set(map(self._address_plan.node_of, previous_neighbors))
         self._neighbors = neighbors
         self._neighbors_monitor.set_neighbors(self._neighbors)
 
         for neighbour in gone_neighbors:
-            self.zmq_pipeline.nodes_dict.pop(get_node_id_from_addr(neighbour), None)
+            self.zmq_pipeline.remove_node(self._address_plan.node_of(neighbour))
+        # сокет нужен только соседям: бывший сосед, оставшийся в кольце, тоже освобождает свой
+        for neighbour in previous_neighbors.union(gone_neighbors) - set(self._neighbors or ()):
+            self.zmq_pipeline.evict_sender(neighbour)
+        current_nodes = set(map(self._address_plan.node_of, self._neighbors or ()))
+        for node in previous_nodes - current_nodes:
+            self.failure_detector.forget(node)
+        self.failure_detector.watch(current_nodes)
 
         if back_neighbors:
-            nodes = [get_node_id_from_addr(neighbour) for neighbour in back_neighbors]
+            nodes = [self._address_plan.node_of(neighbour) for neighbour in back_neighbors]
             self.zmq_pipeline.set_nodes_dict(nodes)
 
         self.mqtt_worker.neighbors = self._neighbors
+        self.zmq_pipeline.neighbors = self._neighbors
 
     def __send_event_message(self, event: str, event_neighbors: tuple) -> None:
+        self._neighbour_events[event].inc(len(event_neighbors))
         for event_neighbor in event_neighbors:
             message = {'event': event,
                        'neighbour_ip': event_neighbor,
-                       'neighbour_node': get_node_id_from_addr(event_neighbor)}
+                       'neighbour_node': self._address_plan.node_of(event_neighbor)}
 
-            for neighbour in self._neighbors:
-                self.zmq_pipeline.start_sending_packet(neighbour, message)
+            self.zmq_pipeline.broadcast(message)
 
             self.mqtt_worker.send_message_on_mqtt(message)
@@ -1,131 +1,159 @@
-import sys
-import socket
+import time
+import asyncio
 
-from typing import Tuple
-from loguru import logger
+from bisect import bisect_left
+from typing import Sequence, Tuple
 from itertools import groupby
 
-from .utils import get_node_id_from_addr
+from .address_plan import AddressPlan, DEFAULT_ADDRESS_PLAN
+from .discovery import NeighbourDiscovery
+from .logging_config import get_logger
+from .metrics import MetricsRegistry
 from .utils import NeighbourChecker as checker
 
-logger.remove()
-logger.add(sys.stdout, format="{time:HH:mm:ss} | {level} | {message}", level="DEBUG")
+logger = get_logger('discovery')
 
 
 class NodeMonitor:
-    def __init__(self, node_id: int, ping_port: int, host_ip: str):
+    def __init__(self,
+                 node_id: int,
+                 ping_port: int,
+                 host_ip: str,
+                 probe_timeout: float = 0.15,
+                 probe_concurrency: int = 32,
+                 retry_interval: float = 1,
+                 discovery: NeighbourDiscovery = None,
+                 metrics: MetricsRegistry = None,
+                 address_plan: AddressPlan = DEFAULT_ADDRESS_PLAN,
+                 successor_list_size: int = 4):
+
         self.node_id = node_id
         self.ping_port = ping_port
         self.host_ip = host_ip
         self.neighbors: list = []
+        self.retry_interval = retry_interval
+        self.address_plan = address_plan
+        # сколько ближайших узлов кольца с каждой стороны проверяется при починке кольца
+        self.successor_list_size = successor_list_size
+        self.successors: list = []
+        self.predecessors: list = []
+        self.metrics = metrics or MetricsRegistry()
+        probe_rtt = self.metrics.histogram('discovery_probe_rtt_seconds', 'Время подключения к живому узлу, с')
+        self._search_time = self.metrics.histogram('discovery_search_seconds', 'Время поиска соседей, с')
+        self._gone_checks = self.metrics.counter('neighbour_checks_total', 'Проверки доступности соседей')
+        self._repairs = {way: self.metrics.counter(f'ring_repair_{way}_total', f'Поиски соседей: {description}')
+                         for way, description in (('successor_list', 'по списку ближайших узлов'),
+                                                  ('full_scan', 'полным перебором адресов'))}
+        # discovery можно подменить, например поиском по списку узлов симулятора
+        self.discovery = discovery or NeighbourDiscovery(node_id=node_id,
+                                                         port=ping_port,
+                                                         host_ip=host_ip,
+                                                         concurrency=probe_concurrency,
+                                                         timeout=probe_timeout,
+                                                         observe_rtt=probe_rtt.observe,
+                                                         address_of=address_plan.address_of,
+                                                         nodes=address_plan.nodes())
+        self.metrics.counter('discovery_probes_total', 'Проверочные подключения к узлам',
+                             function=lambda: self.discovery.probes_started)
 
     # --------------------поиск соседей--------------------
-    def init_neighbors(self) -> list:
+    def init_neighbors(self, known_nodes: Sequence[int] = ()) -> list:
         logger.info('Поиск соседей...')
-        neighbors = self.get_neighbors()
+        neighbors = self.get_neighbors(known_nodes)
         self.set_neighbors(neighbors)
 
         return self.neighbors
 
-    def get_neighbors(self) -> list:
-        neighbors = [el for el, _ in groupby(self.__search_neighbors())]
-
-        return neighbors
+    def get_neighbors(self, known_nodes: Sequence[int] = ()) -> list:
+        """Ищет ближайших живых соседей. known_nodes - отсортированный список узлов кольца:
+        сначала одновременно проверяются ближайшие к узлу из них, и только если с какой-то стороны
+        живых не нашлось, перебираются все адреса плана"""
 
-    def __search_neighbors(self) -> Tuple[str, str]:
-        left_neighbour, right_neighbour = False, False
-        while not left_neighbour and not right_neighbour:
-            left_neighbour, right_neighbour = self.__start_search_neighbors()
-            if not left_neighbour and not right_neighbour:
-                logger.warning('Соседи не найдены...')
+        neighbors = self.__search_successor_lists(known_nodes) if known_nodes else None
+        if neighbors is None:
+            self._repairs['full_scan'].inc()
+            neighbors = self.__search_neighbors()
+        neighbors = [el for el, _ in groupby(neighbors)]
 
-        return left_neighbour, right_neighbour
-
-    def __start_search_neighbors(self) -> Tuple[str, str]:
-        """Функция принимает номер текущей подсети node_number
-        и в зависимости от него задаёт параметры для старта поиска соседей
-        right_search_neighbour() и left_search_neighbour()
-        """
-
-        if self.node_id == 1:
-            right_neighbour = self.__right_search_neighbour(self.node_id + 1, 256)
-            left_neighbour = self.__left_search_neighbour(255, 1)
-
-        elif self.node_id == 255:
-            right_neighbour = self.__right_search_neighbour(1, 255)
-            left_neighbour = self.__left_search_neighbour(self.node_id - 1, 0)
+        return neighbors
 
-        else:
-            right_neighbour = self.__right_search_neighbour(self.node_id + 1, 256)
-            left_neighbour = self.__left_search_neighbour(self.node_id - 1, 0)
+    def __search_successor_lists(self, known_nodes: Sequence[int]) -> Tuple[str, str] or None:
+        if not self.update_successor_lists(known_nodes):
+            return None
 
-        return left_neighbour, right_neighbour
+        started = time.monotonic()
+        alive = self.discovery.probe({*self.predecessors, *self.successors})
+        self._search_time.observe(time.monotonic() - started)
 
-    def __right_search_neighbour(self, start_node: int, end_node: int, step: int = 1) -> str:
-        """Запускает поиск соседей search_neighbour() справа от подсети текущей машины.
-        Если до последней возможной подсети сосед не найден,
-        начинает новый поиск с первого возможного узла до текущего, выводит найден сосед или нет
-        """
+        return self.__nearest_from_successor_lists(alive)
 
-        neighbour_found = self.__search_neighbour(start_node, end_node, step)
+    async def __search_successor_lists_async(self, known_nodes: Sequence[int]) -> Tuple[str, str] or None:
+        if not self.update_successor_lists(known_nodes):
+            return None
 
-        if not neighbour_found:
-            neighbour_found = self.__search_neighbour(1, start_node - 1, step)
+        started = time.monotonic()
+        alive = await self.discovery.probe_async({*self.predecessors, *self.successors})
+        self._search_time.observe(time.monotonic() - started)
 
-        return neighbour_found
+        return self.__nearest_from_successor_lists(alive)
 
-    def __left_search_neighbour(self, start_node: int, end_node: int, step: int = -1) -> str:
-        """Запускает поиск соседей search_neighbour() слева от подсети текущей машины.
-        Если до последней возможной подсети сосед не найден,
-        начинает новый поиск от последнего возможного узла до текущего, выводит найден сосед или нет
-        """
+    def update_successor_lists(self, known_nodes: Sequence[int]) -> bool:
+        """Запоминает successor_list_size ближайших к узлу узлов кольца known_nodes в каждую сторону,
+        от ближнего к дальнему. Возвращает False, если других узлов в known_nodes нет"""
 
-        neighbour_found = self.__search_neighbour(start_node, end_node, step)
+        count = len(known_nodes)
+        position = bisect_left(known_nodes, self.node_id)
+        after = position + 1 if position < count and known_nodes[position] == self.node_id else position
+        size = min(self.successor_list_size, count - after + position)
 
-        if not neighbour_found:
-            neighbour_found = self.__search_neighbour(255, start_node, step)
+        self.successors = [known_nodes[(after + i) % count] for i in range(size)]
+        self.predecessors = [known_nodes[(position - 1 - i) % count] for i in range(size)]
 
-        return neighbour_found
+        return size > 0
 
-    def __search_neighbour(self, start_node: int, end_node: int, step: int) -> str:
-        """Запускает попытку подключения try_connect_to_node() к узлу node,
-        возвращает флаг-значение neighbour_found обозначающее найден сосед или нет
-        """
+    def __nearest_from_successor_lists(self, alive: set) -> Tuple[str, str] or None:
+        left = next((node for node in self.predecessors if node in alive), None)
+        right = next((node for node in self.successors if node in alive), None)
+        if left is None or right is None:
+            logger.warning('Среди ближайших узлов кольца нет живых, полный поиск соседей...')
+            return None
 
-        neighbour_found = False
-        for node in range(start_node, end_node, step):
-            neighbour_found = self.__get_address_or_false(node)
-            if neighbour_found:
-                return neighbour_found
+        self._repairs['successor_list'].inc()
+        return self.address_plan.address_of(left), self.address_plan.address_of(right)
 
-        return neighbour_found
+    def __search_neighbors(self) -> Tuple[str, str]:
+        left_neighbour, right_neighbour = False, False
+        while not left_neighbour and not right_neighbour:
+            started = time.monotonic()
+            left_neighbour, right_neighbour = self.__start_search_neighbors()
+            self._search_time.observe(time.monotonic() - started)
+            if not left_neighbour and not right_neighbour:
+                logger.warning('Соседи не найдены...')
+                time.sleep(self.retry_interval)
 
-    def __get_address_or_false(self, target_node: int) -> str or bool:
-        """Формирует целевой ip target_ip для подключения, создаёт сокет tcp_client_socket
-         и пробует подключиться connect_node(), после чего передаёт результат
-         """
+        return left_neighbour, right_neighbour
 
-        target_ip = f'10.20.{target_node}.1'
+    async def get_neighbors_async(self, known_nodes: Sequence[int] = ()) -> list:
+        neighbors = await self.__search_successor_lists_async(known_nodes) if known_nodes else None
+        if neighbors is not None:
+            return [el for el, _ in groupby(neighbors)]
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_client_socket:
-            try:
-                result = self.__connect_node(target_ip, tcp_client_socket)
-                if result == 0 and self.host_ip != target_ip:
-                    return target_ip
-                else:
-                    return False
-            except BrokenPipeError:
-                print('Node undefined')
-            except OSError:
-                print('Network not find')
+        self._repairs['full_scan'].inc()
+        left_neighbour, right_neighbour = False, False
+        while not left_neighbour and not right_neighbour:
+            started = time.monotonic()
+            left_neighbour, right_neighbour = await self.discovery.find_neighbors_async()
+            self._search_time.observe(time.monotonic() - started)
+            if not left_neighbour and not right_neighbour:
+                logger.warning('Соседи не найдены...')
+                await asyncio.sleep(self.retry_interval)
 
-    def __connect_node(self, target_ip: str, tcp_client_socket: socket) -> int:
-        """Задаёт время на попытку подключения и пробует его провести, возвращает 0 в случае успеха
-        """
+        return [el for el, _ in groupby((left_neighbour, right_neighbour))]
 
-        tcp_client_socket.settimeout(0.15)
+    def __start_search_neighbors(self) -> Tuple[str, str]:
+        """Запускает параллельный поиск ближайших соседей слева и справа от текущего узла"""
 
-        return tcp_client_socket.connect_ex((target_ip, self.ping_port))
+        return self.discovery.find_neighbors()
 
     # --------------------обработка соседей--------------------
     def set_neighbors(self, neighbors: list) -> None:
@@ -140,8 +168,21 @@ class NodeMonitor:
 
         return gone_neighbors
 
-    def __get_neighbors_status(self) -> list:
-        statuses = [self.__get_address_or_false(get_node_id_from_addr(neighbour)) for neighbour in self.neighbors]
+    async def check_gone_neighbors_async(self) -> tuple:
+        alive = await self.discovery.probe_async(map(self.address_plan.node_of, self.neighbors))
+        old_neighbors_status = self.__get_neighbors_status(alive)
+        gone_neighbors = ()
+        if False in old_neighbors_status:
+            gone_neighbors = self.__identify_gone_neighbors(old_neighbors_status)
+
+        return gone_neighbors
+
+    def __get_neighbors_status(self, alive: set = None) -> list:
+        self._gone_checks.inc()
+        if alive is None:
+            alive = self.discovery.probe(map(self.address_plan.node_of, self.neighbors))
+        node_of = self.address_plan.node_of
+        statuses = [neighbour if node_of(neighbour) in alive else False for neighbour in self.neighbors]
 
         return statuses
 
@@ -159,11 +200,11 @@ class NodeMonitor:
 
         distances_new_neighbors = []
         for neighbour in new_neighbors:
-            distances_new_neighbors.append(self.__get_distance_to_node(nodes, get_node_id_from_addr(neighbour)))
+            distances_new_neighbors.append(self.__get_distance_to_node(nodes, self.address_plan.node_of(neighbour)))
 
         distances_old_neighbors = []
         for neighbour in self.neighbors:
-            distances_old_neighbors.append(self.__get_distance_to_node(nodes, get_node_id_from_addr(neighbour)))
+            distances_old_neighbors.append(self.__get_distance_to_node(nodes, self.address_plan.node_of(neighbour)))
 
         if len(self.neighbors) == 2:
             if len(new_neighbors) == 1:
@@ -200,12 +241,12 @@ class NodeMonitor:
         nodes = set(nodes.keys())
 
         for neighbour in new_neighbors:
-            new_node = get_node_id_from_addr(neighbour)
+            new_node = self.address_plan.node_of(neighbour)
             if new_node not in nodes:
                 nodes.add(new_node)
 
         for neighbour in self.neighbors:
-            old_node = get_node_id_from_addr(neighbour)
+            old_node = self.address_plan.node_of(neighbour)
             if old_node not in nodes:
                 nodes.add(old_node)
 
@@ -0,0 +1,220 @@
+import json
+import time
+import queue
+import asyncio
+import threading
+
+from typing import Callable
+
+from .logging_config import get_logger
+
+logger = get_logger('mqtt')
+
+_STOP = object()
+
+
+class PublishQueue:
+    """Ограниченная очередь исходящих сообщений mqtt, которую разбирает отдельный поток-публикатор.
+
+    Цикл приёма zmq только кладёт сообщение в очередь и не ждёт брокер. При batch_interval > 0
+    сообщения, накопившиеся за интервал (не больше max_batch), отправляются одним сообщением
+    {'batch': [...]}. Если очередь заполнена, policy='drop' отбрасывает новое сообщение,
+    а policy='block' ждёт места не дольше block_timeout секунд (None - без ограничения).
+    observe_latency вызывается с задержкой каждого опубликованного сообщения, например для гистограммы
+    """
+
+    POLICIES = ('drop', 'block')
+
+    def __init__(self,
+                 publish: Callable[[str], object],
+                 max_size: int = 1000,
+                 policy: str = 'drop',
+                 block_timeout: float = None,
+                 batch_interval: float = 0.0,
+                 max_batch: int = 100,
+                 observe_latency: Callable[[float], object] = None):
+
+        if policy not in self.POLICIES:
+            raise ValueError(f'Неизвестная политика переполнения очереди: {policy}')
+
+        self.publish = publish
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self.observe_latency = observe_latency
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.published = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.__run, name='mqtt-publisher', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 1.0) -> None:
+        """Останавливает публикатор, дав ему отправить уже накопленные сообщения"""
+
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, message: dict) -> bool:
+        """Ставит сообщение в очередь, возвращает False, если оно отброшено из-за переполнения"""
+
+        try:
+            if self.policy == 'block':
+                self._queue.put((time.monotonic(), message), timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait((time.monotonic(), message))
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        published = self.published
+        return {'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'published': published,
+                'batches': self.batches,
+                'errors': self.errors,
+                'latency_avg_ms': round(self._latency_sum / published * 1000, 3) if published else 0.0,
+                'latency_max_ms': round(self._latency_max * 1000, 3)}
+
+    def __run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            items = [item]
+            if self.batch_interval > 0:
+                deadline = time.monotonic() + self.batch_interval
+                while len(items) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    items.append(item)
+
+            self._publish_items(items)
+
+    def _publish_items(self, items: list) -> None:
+        if self.batch_interval > 0:
+            payload = json.dumps({'batch': [message for _, message in items]})
+        else:
+            payload = json.dumps(items[0][1])
+
+        try:
+            self.publish(payload)
+        except Exception as error:
+            self.errors += 1
+            logger.warning('Не удалось опубликовать сообщение в mqtt: {}', error)
+            return
+
+        # задержка - от постановки в очередь до передачи клиенту mqtt
+        now = time.monotonic()
+        for enqueued_at, _ in items:
+            latency = now - enqueued_at
+            self._latency_sum += latency
+            if latency > self._latency_max:
+                self._latency_max = latency
+            if self.observe_latency is not None:
+                self.observe_latency(latency)
+        self.published += len(items)
+        self.batches += 1
+
+
+class AsyncPublishQueue(PublishQueue):
+    """То же, что PublishQueue, но публикатор - задача текущего event loop с очередью asyncio.
+    put вызывается из того же event loop и не может ждать места, поэтому допустима только policy='drop'
+    """
+
+    POLICIES = ('drop',)
+
+    def __init__(self,
+                 publish: Callable[[str], object],
+                 max_size: int = 1000,
+                 policy: str = 'drop',
+                 batch_interval: float = 0.0,
+                 max_batch: int = 100,
+                 observe_latency: Callable[[float], object] = None):
+
+        super().__init__(publish, max_size, policy, None, batch_interval, max_batch, observe_latency)
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.__run())
+
+    def close(self, timeout: float = None) -> None:
+        """Останавливает публикатор и сразу публикует уже накопленные сообщения"""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        step = self.max_batch if self.batch_interval > 0 else 1
+        for start in range(0, len(items), step):
+            self._publish_items(items[start:start + step])
+
+    def put(self, message: dict) -> bool:
+        try:
+            self._queue.put_nowait((time.monotonic(), message))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    async def __run(self) -> None:
+        while True:
+            items = [await self._queue.get()]
+            if self.batch_interval > 0:
+                deadline = time.monotonic() + self.batch_interval
+                while len(items) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+            self._publish_items(items)
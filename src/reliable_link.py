@@ -0,0 +1,302 @@
+import time
+import random
+import threading
+
+from collections import deque
+from dataclasses import replace
+from typing import Callable
+
+from .codec import ERAPMessage, ACK, LINK_GAP
+from .logging_config import RateLimitedLogger
+
+logger = RateLimitedLogger('zmq')
+
+
+class _Outgoing:
+    __slots__ = ('seq', 'message', 'sent_at')
+
+    def __init__(self, seq: int, message: ERAPMessage):
+        self.seq = seq
+        self.message = message
+        self.sent_at = 0.0
+
+
+class _SendState:
+    """Состояние отправки на одну линию: пакеты в пути ждут подтверждения, остальные - очереди"""
+
+    __slots__ = ('epoch', 'next_seq', 'in_flight', 'pending', 'credit', 'last_ack', 'retries', 'retransmitted_at')
+
+    def __init__(self, credit: int):
+        # эпоха меняется при создании линии, так что получатель отличает перезапущенного отправителя
+        self.epoch = random.getrandbits(32) or 1
+        self.next_seq = 1
+        self.in_flight: deque = deque()
+        self.pending: deque = deque()
+        self.credit = credit
+        self.last_ack = 0
+        self.retries = 0
+        self.retransmitted_at = 0.0
+
+
+class _ReceiveState:
+    __slots__ = ('epoch', 'expected', 'unacked', 'advertised', 'gap_reported')
+
+    def __init__(self, epoch: int, expected: int):
+        self.epoch = epoch
+        self.expected = expected
+        self.unacked = 0
+        self.advertised = None
+        self.gap_reported = False
+
+
+class ReliableLinks:
+    """Надёжная доставка пакетов данных между соседями поверх PUSH/PULL.
+
+    Каждый пакет на линии к адресату получает номер. Отправитель держит не больше
+    min(window, credit) неподтверждённых пакетов, остальные ждут в очереди не длиннее max_pending,
+    а при её переполнении новый пакет отбрасывается - память ограничена при любой нагрузке.
+    Получатель принимает пакеты строго по порядку номеров и подтверждает их накопительно,
+    сообщая в подтверждении credit - сколько пакетов он готов принять ещё. При пропуске получатель
+    сразу отправляет подтверждение с флагом LINK_GAP, и отправитель повторяет все неподтверждённые
+    пакеты (go-back-N); то же происходит, если подтверждение не пришло за retransmit_timeout.
+    После max_retransmits повторов без подтверждения пакеты в пути считаются потерянными.
+    Новый получатель (например, перезапущенный сосед) начинает с самого старого неподтверждённого
+    номера отправителя, так что пакеты, отправленные во время перезапуска, будут повторены.
+
+    send(addressee, frames) - отправка кадров соседу, encode(message, addressee) - кодирование,
+    credit_of() - сколько пакетов получатель готов принять сейчас
+    """
+
+    def __init__(self,
+                 my_node: int,
+                 send: Callable[[str, list], bool],
+                 encode: Callable[[ERAPMessage, str], list],
+                 address_of: Callable[[int], str],
+                 window: int = 128,
+                 max_pending: int = 1024,
+                 receive_window: int = 256,
+                 credit_of: Callable[[], int] = None,
+                 retransmit_timeout: float = 0.5,
+                 max_retransmits: int = 8,
+                 ack_every: int = None):
+
+        self.my_node = my_node
+        self.window = window
+        self.max_pending = max_pending
+        self.receive_window = receive_window
+        self.credit_of = credit_of or (lambda: self.receive_window)
+        self.retransmit_timeout = retransmit_timeout
+        self.max_retransmits = max_retransmits
+        # подтверждение уходит после ack_every принятых пакетов, а также когда приём простаивает
+        self.ack_every = ack_every or max(window // 4, 1)
+        self._send = send
+        self._encode = encode
+        self._address_of = address_of
+
+        self.sent = 0
+        self.retransmitted = 0
+        self.dropped = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.acks_sent = 0
+
+        self._senders: dict = {}
+        self._receivers: dict = {}
+        self._lock = threading.RLock()
+        # ожидающие места в очередях отправки, например приём команд из mqtt
+        self._credit_available = threading.Condition(self._lock)
+
+    # --------------------отправка--------------------
+    def send(self, addressee: str, message: ERAPMessage) -> bool:
+        """Отправляет пакет данных message соседу addressee или ставит его в очередь линии.
+        Возвращает False, если очередь линии заполнена и пакет отброшен
+        """
+
+        with self._lock:
+            link = self._senders.get(addressee)
+            if link is None:
+                link = self._senders[addressee] = _SendState(self.window)
+
+            if len(link.pending) >= self.max_pending:
+                self.dropped += 1
+                logger.warning('Очередь надёжной линии на {} заполнена, пакет отброшен', lambda: addressee)
+                return False
+
+            # у каждой линии свои номера, поэтому сообщение копируется - его заголовок меняется при повторах
+            outgoing = _Outgoing(link.next_seq, replace(message, link_seq=link.next_seq))
+            link.next_seq += 1
+            link.pending.append(outgoing)
+            self.__pump(addressee, link)
+
+        return True
+
+    def on_ack(self, addressee: str, ack: ERAPMessage) -> None:
+        """Учитывает подтверждение ack от соседа addressee и отправляет пакеты, которым хватает места в окне"""
+
+        with self._lock:
+            link = self._senders.get(addressee)
+            if link is None or ack.link_epoch != link.epoch:
+                return
+
+            acked = False
+            while link.in_flight and link.in_flight[0].seq <= ack.link_seq:
+                link.in_flight.popleft()
+                acked = True
+            if acked:
+                link.retries = 0
+            link.last_ack = max(link.last_ack, ack.link_seq)
+            link.credit = ack.link_info
+
+            now = time.monotonic()
+            if ack.flags & LINK_GAP and link.in_flight and \
+                    now - link.retransmitted_at >= self.retransmit_timeout / 4:
+                self.__retransmit(addressee, link, now)
+
+            self.__pump(addressee, link)
+            self._credit_available.notify_all()
+
+    def congested(self) -> bool:
+        """Хотя бы одна линия заполнила очередь наполовину - новые пакеты лучше придержать"""
+
+        with self._lock:
+            return any(len(link.pending) >= self.max_pending // 2 for link in self._senders.values())
+
+    def wait_for_credit(self, timeout: float) -> bool:
+        """Ждёт не дольше timeout секунд, пока очереди линий не освободятся, возвращает False если не дождался"""
+
+        with self._credit_available:
+            return self._credit_available.wait_for(lambda: not self.congested(), timeout)
+
+    def forget(self, addressee: str) -> None:
+        """Удаляет линию к ушедшему соседу addressee вместе с неотправленными пакетами"""
+
+        with self._lock:
+            link = self._senders.pop(addressee, None)
+            if link is not None:
+                self.lost += len(link.in_flight) + len(link.pending)
+                self._credit_available.notify_all()
+
+    # --------------------приём--------------------
+    def accept(self, message: ERAPMessage) -> bool:
+        """Проверяет номер принятого пакета данных: True - пакет следующий по порядку и его нужно
+        обработать, False - повтор или пакет после пропуска, который будет отправлен заново
+        """
+
+        source = message.sender_neighbour
+        with self._lock:
+            link = self._receivers.get(source)
+            if link is None or link.epoch != message.link_epoch:
+                # новая линия или перезапущенный отправитель: начинаем с его самого старого неподтверждённого
+                link = self._receivers[source] = _ReceiveState(message.link_epoch, message.link_info)
+
+            if message.link_seq == link.expected:
+                link.expected += 1
+                link.unacked += 1
+                link.gap_reported = False
+                if link.unacked >= self.ack_every:
+                    self.__send_ack(source, link)
+                return True
+
+            if message.link_seq < link.expected:
+                self.duplicates += 1
+                self.__send_ack(source, link)
+            else:
+                self.gaps += 1
+                if not link.gap_reported:
+                    link.gap_reported = True
+                    self.__send_ack(source, link, gap=True)
+            return False
+
+    def flush_acks(self) -> None:
+        """Подтверждает принятые пакеты и сообщает отправителям, что место для новых освободилось"""
+
+        with self._lock:
+            credit = self.credit_of()
+            for source, link in self._receivers.items():
+                if link.unacked or (link.advertised is not None and link.advertised < self.ack_every <= credit):
+                    self.__send_ack(source, link, credit=credit)
+
+    def tick(self) -> None:
+        """Повторяет пакеты, которые не подтверждены за retransmit_timeout, и отправляет отложенные подтверждения"""
+
+        now = time.monotonic()
+        with self._lock:
+            for addressee, link in tuple(self._senders.items()):
+                if link.in_flight:
+                    if now - link.in_flight[0].sent_at >= self.retransmit_timeout:
+                        if link.retries >= self.max_retransmits:
+                            self.__give_up(addressee, link)
+                        else:
+                            link.retries += 1
+                            self.__retransmit(addressee, link, now)
+                elif link.pending and not link.credit and now - link.retransmitted_at >= self.retransmit_timeout:
+                    # получатель давно не сообщал о свободном месте - один пакет уходит как проба
+                    link.retransmitted_at = now
+                    self.__transmit(addressee, link, link.pending.popleft(), now)
+            self.flush_acks()
+
+    def in_flight(self) -> int:
+        return sum(len(link.in_flight) for link in tuple(self._senders.values()))
+
+    def pending(self) -> int:
+        return sum(len(link.pending) for link in tuple(self._senders.values()))
+
+    def stats(self) -> dict:
+        return {'links': len(self._senders),
+                'in_flight': self.in_flight(),
+                'pending': self.pending(),
+                'sent': self.sent,
+                'retransmitted': self.retransmitted,
+                'dropped': self.dropped,
+                'lost': self.lost,
+                'duplicates': self.duplicates,
+                'gaps': self.gaps,
+                'acks_sent': self.acks_sent}
+
+    def __pump(self, addressee: str, link: _SendState) -> None:
+        now = time.monotonic()
+        allowed = min(self.window, link.credit)
+        while link.pending and len(link.in_flight) < allowed:
+            self.__transmit(addressee, link, link.pending.popleft(), now)
+
+    def __transmit(self, addressee: str, link: _SendState, outgoing: _Outgoing, now: float) -> None:
+        link.in_flight.append(outgoing)
+        self.__send_outgoing(addressee, link, outgoing, now)
+        self.sent += 1
+
+    def __retransmit(self, addressee: str, link: _SendState, now: float) -> None:
+        link.retransmitted_at = now
+        for outgoing in link.in_flight:
+            self.__send_outgoing(addressee, link, outgoing, now)
+            self.retransmitted += 1
+
+    def __send_outgoing(self, addressee: str, link: _SendState, outgoing: _Outgoing, now: float) -> None:
+        # неудачная отправка не страшна: пакет остаётся в пути и будет повторён по таймауту
+        outgoing.sent_at = now
+        outgoing.message.link_epoch = link.epoch
+        outgoing.message.link_info = link.in_flight[0].seq
+        self._send(addressee, self._encode(outgoing.message, addressee))
+
+    def __give_up(self, addressee: str, link: _SendState) -> None:
+        logger.warning('Сосед {} не подтверждает пакеты, {} пакетов потеряно',
+                       lambda: addressee, lambda: len(link.in_flight))
+        self.lost += len(link.in_flight)
+        link.in_flight.clear()
+        link.retries = 0
+        # получатель всё ещё ждёт потерянный номер - новая эпоха заставит его начать с текущих пакетов
+        link.epoch = random.getrandbits(32) or 1
+        link.credit = self.window
+        self.__pump(addressee, link)
+        self._credit_available.notify_all()
+
+    def __send_ack(self, source: int, link: _ReceiveState, gap: bool = False, credit: int = None) -> None:
+        credit = max(self.credit_of() if credit is None else credit, 0)
+        ack = ERAPMessage(source=self.my_node, sender_neighbour=0, addressee=0, msg_type=ACK,
+                          flags=LINK_GAP if gap else 0,
+                          link_epoch=link.epoch, link_seq=link.expected - 1, link_info=credit)
+        link.unacked = 0
+        link.advertised = credit
+        address = self._address_of(source)
+        self._send(address, self._encode(ack, address))
+        self.acks_sent += 1
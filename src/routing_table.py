@@ -0,0 +1,162 @@
+import threading
+
+from bisect import bisect_left
+from typing import Iterable, NamedTuple, Optional
+
+
+class RingRoute(NamedTuple):
+    """Снимок кольца с заранее посчитанными соседями текущего узла по обоим направлениям"""
+
+    nodes: tuple
+    members: frozenset
+    predecessor: Optional[int]
+    successor: Optional[int]
+    is_first: bool
+    is_last: bool
+    # индекс текущего узла в nodes и узлы на расстоянии 1, 2, 4, ... по часовой стрелке и против
+    index: Optional[int] = None
+    fingers: tuple = ()
+    back_fingers: tuple = ()
+
+
+class RingRoutingTable:
+    """Таблица маршрутизации двунаправленного кольца для узла my_node.
+
+    Хранит отсортированный состав кольца и предвычисленные следующие переходы.
+    Пересчитывается только при изменении состава (add/remove/rebuild),
+    выбор следующего узла для пакета - O(1).
+
+    Для адресных пакетов дополнительно хранится finger table - узлы на расстояниях 2^k
+    по кольцу в обе стороны, так что пакет доходит до любого узла за O(log n) переходов
+    """
+
+    def __init__(self, my_node: int, nodes: Iterable[int] = ()):
+        self.my_node = my_node
+        self._lock = threading.Lock()
+        self._route = self.__build_route(sorted(set(nodes)))
+
+    def __contains__(self, node: int) -> bool:
+        return node in self._route.members
+
+    def __len__(self) -> int:
+        return len(self._route.nodes)
+
+    @property
+    def nodes(self) -> tuple:
+        return self._route.nodes
+
+    def rebuild(self, nodes: Iterable[int]) -> None:
+        with self._lock:
+            self._route = self.__build_route(sorted(set(nodes)))
+
+    def add(self, nodes: Iterable[int]) -> bool:
+        """Добавляет узлы nodes в кольцо, возвращает True если состав изменился"""
+
+        with self._lock:
+            members = self._route.members
+            new_nodes = [node for node in nodes if node not in members]
+            if not new_nodes:
+                return False
+
+            sorted_nodes = list(self._route.nodes)
+            for node in set(new_nodes):
+                sorted_nodes.insert(bisect_left(sorted_nodes, node), node)
+            self._route = self.__build_route(sorted_nodes)
+
+        return True
+
+    def remove(self, node: int) -> bool:
+        """Удаляет узел node из кольца, возвращает True если состав изменился"""
+
+        with self._lock:
+            if node not in self._route.members:
+                return False
+
+            sorted_nodes = list(self._route.nodes)
+            del sorted_nodes[bisect_left(sorted_nodes, node)]
+            self._route = self.__build_route(sorted_nodes)
+
+        return True
+
+    def next_hop(self, from_node: int) -> Optional[int]:
+        """Возвращает номер узла, которому нужно передать пакет, пришедший от from_node.
+        Пакет продолжает движение по кольцу в том же направлении.
+        None - если from_node не в кольце или направление определить нельзя
+        """
+
+        route = self._route
+        if from_node not in route.members:
+            return None
+
+        count = len(route.nodes)
+        if count > 2:
+            if route.predecessor is None:
+                return None
+            if route.is_first:
+                return route.successor if from_node == route.nodes[-1] else route.predecessor
+            if route.is_last:
+                return route.predecessor if from_node == route.nodes[0] else route.successor
+            if from_node > self.my_node:
+                return route.predecessor
+            if from_node < self.my_node:
+                return route.successor
+            return None
+
+        if count == 2:
+            if self.my_node in route.members:
+                # из двух узлов пакет возвращается отправителю
+                return from_node
+            return route.nodes[0] if route.nodes[1] == from_node else route.nodes[1]
+
+        return route.nodes[0]
+
+    def unicast_hop(self, target: int, shortcuts: bool = False) -> Optional[int]:
+        """Следующий узел на пути адресного пакета к узлу target - в ту сторону кольца, где он ближе.
+        Без shortcuts - соседний узел кольца, с shortcuts - самый дальний узел finger table,
+        который не перескакивает target. None - если target это текущий узел или он неизвестен
+        """
+
+        route = self._route
+        if route.index is None or target == self.my_node or target not in route.members:
+            return None
+
+        count = len(route.nodes)
+        clockwise = (bisect_left(route.nodes, target) - route.index) % count
+        if clockwise <= count - clockwise:
+            distance, fingers = clockwise, route.fingers
+        else:
+            distance, fingers = count - clockwise, route.back_fingers
+
+        if not shortcuts:
+            return fingers[0]
+        # fingers[k] на расстоянии 2^k, а distance < 2^(k+1)
+        return fingers[distance.bit_length() - 1]
+
+    def __build_route(self, sorted_nodes: list) -> RingRoute:
+        nodes = tuple(sorted_nodes)
+        predecessor, successor = None, None
+        is_first, is_last = False, False
+        index, fingers, back_fingers = None, (), ()
+
+        position = bisect_left(nodes, self.my_node)
+        if position < len(nodes) and nodes[position] == self.my_node:
+            index = position
+            count = len(nodes)
+            predecessor = nodes[index - 1]
+            successor = nodes[(index + 1) % count]
+            is_first = index == 0
+            is_last = index == count - 1
+
+            distances = [1 << power for power in range(max(count - 1, 1).bit_length())]
+            fingers = tuple(nodes[(index + distance) % count] for distance in distances)
+            back_fingers = tuple(nodes[(index - distance) % count] for distance in distances)
+
+        return RingRoute(nodes=nodes,
+                         members=frozenset(nodes),
+                         predecessor=predecessor,
+                         successor=successor,
+                         is_first=is_first,
+                         is_last=is_last,
+                         index=index,
+                         fingers=fingers,
+                         back_fingers=back_fingers)
@@ -0,0 +1,61 @@
+import time
+import threading
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class SeenCache:
+    """Ограниченный кэш уже обработанных пакетов с вытеснением по времени жизни.
+
+    Ключи хранятся в порядке добавления, поэтому устаревшие записи всегда в начале
+    и вытесняются за O(1) на операцию. Размер ограничен max_entries
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def check_and_add(self, key: Hashable) -> bool:
+        """Возвращает True, если key уже встречался за последние ttl секунд, иначе запоминает его"""
+
+        now = self.clock()
+        with self._lock:
+            entries = self._entries
+            while entries:
+                oldest_key, added_at = next(iter(entries.items()))
+                if now - added_at < self.ttl:
+                    break
+                del entries[oldest_key]
+                self.expired += 1
+
+            if key in entries:
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            entries[key] = now
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.evicted += 1
+
+        return False
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evicted': self.evicted}
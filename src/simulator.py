@@ -0,0 +1,413 @@
+"""Симулятор кольца из многих узлов в одном процессе.
+
+Каждый узел - обычный Node со своими потоками, но вместо сети и внешних сервисов
+используются подмены из SimulatedNetwork: zmq через общий контекст и inproc://,
+поиск и проверка соседей по списку запущенных узлов, локальный брокер mqtt на каждый узел.
+Узлы можно останавливать и запускать заново, измеряя время схождения списка узлов
+и пропускную способность рассылки команд по кольцу.
+
+Запуск: python -m src.simulator --nodes 100 --kills 5 --commands 200
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+
+from itertools import groupby
+from typing import Callable, Iterable, NamedTuple, Tuple
+
+import zmq
+
+from .address_plan import AddressPlan, CidrAddressPlan, DEFAULT_ADDRESS_PLAN
+from .logging_config import configure_logging, DEFAULT_LEVELS
+from .node import Node
+from .async_node import AsyncNode
+from .node_monitor import NodeMonitor
+from .utils import NeighbourChecker as checker
+
+
+class LocalMqttMessage(NamedTuple):
+    topic: str
+    payload: bytes
+    qos: int = 0
+
+
+class LocalMqttBroker:
+    """Брокер mqtt в памяти процесса: сообщение сразу передаётся подписчикам топика в потоке публикации"""
+
+    def __init__(self):
+        self.published = 0
+        self._subscribers: dict = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic: str, callback: Callable[[LocalMqttMessage], None]) -> None:
+        with self._lock:
+            self._subscribers.setdefault(topic, []).append(callback)
+
+    def unsubscribe_all(self, callbacks: Iterable[Callable]) -> None:
+        callbacks = set(callbacks)
+        with self._lock:
+            for topic, subscribers in self._subscribers.items():
+                self._subscribers[topic] = [callback for callback in subscribers if callback not in callbacks]
+
+    def publish(self, topic: str, payload: str or bytes, qos: int = 0) -> None:
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        self.published += 1
+        message = LocalMqttMessage(topic, payload, qos)
+        for callback in tuple(self._subscribers.get(topic, ())):
+            callback(message)
+
+
+class LocalMqttClient:
+    """Клиент локального брокера с той частью интерфейса paho.mqtt.client.Client, которой пользуется MqttWorker"""
+
+    def __init__(self, broker: LocalMqttBroker):
+        self.broker = broker
+        self.on_message = None
+        self._callbacks = []
+
+    def connect(self, host: str = None, port: int = None, keepalive: int = 60) -> int:
+        return 0
+
+    def disconnect(self) -> int:
+        self.broker.unsubscribe_all(self._callbacks)
+        self._callbacks = []
+        return 0
+
+    def subscribe(self, topic: str, qos: int = 0) -> tuple:
+        def deliver(message: LocalMqttMessage) -> None:
+            if self.on_message is not None:
+                self.on_message(self, None, message)
+
+        self._callbacks.append(deliver)
+        self.broker.subscribe(topic, deliver)
+        return 0, 1
+
+    def publish(self, topic: str, payload: str or bytes = None, qos: int = 0, retain: bool = False) -> None:
+        self.broker.publish(topic, payload, qos)
+
+    def loop_start(self) -> None:
+        pass
+
+    def loop_stop(self) -> None:
+        pass
+
+    def socket(self):
+        # сокета у локального брокера нет - AsyncioMqttLoop обслуживает только loop_misc
+        return None
+
+    def loop_misc(self) -> int:
+        return 0
+
+
+class SimulatedNetwork:
+    """Общая среда узлов симулятора: контекст zmq, адреса inproc://, список живых узлов и брокеры mqtt"""
+
+    def __init__(self, address_plan: AddressPlan = DEFAULT_ADDRESS_PLAN, transport: str = 'inproc',
+                 base_port: int = 27000):
+        self.address_plan = address_plan
+        self.max_node = address_plan.max_node
+        # 'inproc' - сокеты внутри процесса, 'tcp' - настоящий tcp через loopback на base_port + номер узла
+        self.transport = transport
+        self.base_port = base_port
+        self.context = zmq.Context()
+        # все узлы делят один контекст, а по умолчанию он ограничен 1023 сокетами
+        self.context.set(zmq.MAX_SOCKETS, 16384)
+        self.brokers: dict = {}
+        self._alive: set = set()
+        self._lock = threading.Lock()
+
+    def endpoint_of(self, address: str) -> str:
+        if self.transport == 'tcp':
+            return f'tcp://127.0.0.1:{self.base_port + self.address_plan.node_of(address)}'
+        return f'inproc://{address}'
+
+    def broker_of(self, node: int) -> LocalMqttBroker:
+        with self._lock:
+            return self.brokers.setdefault(node, LocalMqttBroker())
+
+    def set_alive(self, node: int, alive: bool) -> None:
+        with self._lock:
+            if alive:
+                self._alive.add(node)
+            else:
+                self._alive.discard(node)
+
+    def alive_nodes(self) -> set:
+        with self._lock:
+            return set(self._alive)
+
+    def close(self) -> None:
+        self.context.term()
+
+
+class SimulatedDiscovery:
+    """Замена NeighbourDiscovery: соседи и их доступность определяются по списку живых узлов сети"""
+
+    def __init__(self, network: SimulatedNetwork, node_id: int):
+        self.network = network
+        self.node_id = node_id
+        self.probes_started = 0
+
+    def find_neighbors(self) -> Tuple[str or bool, str or bool]:
+        alive = self.network.alive_nodes() - {self.node_id}
+        ring_size = self.network.max_node + 1
+        left = self.__nearest(alive, lambda node: (self.node_id - node) % ring_size)
+        right = self.__nearest(alive, lambda node: (node - self.node_id) % ring_size)
+
+        address_of = self.network.address_plan.address_of
+        return (address_of(left) if left else False,
+                address_of(right) if right else False)
+
+    def probe(self, nodes: Iterable[int]) -> set:
+        nodes = set(nodes)
+        self.probes_started += len(nodes)
+        return nodes & self.network.alive_nodes()
+
+    async def find_neighbors_async(self) -> Tuple[str or bool, str or bool]:
+        return self.find_neighbors()
+
+    async def probe_async(self, nodes: Iterable[int]) -> set:
+        return self.probe(nodes)
+
+    @staticmethod
+    def __nearest(nodes: set, distance: Callable[[int], int]) -> int or None:
+        return min(nodes, key=distance) if nodes else None
+
+
+class SimulatedNode(Node):
+    """Node, настроенный на среду симулятора вместо сетевых интерфейсов, tcp и брокера на localhost"""
+
+    def __init__(self, network: SimulatedNetwork, node_id: int, **settings):
+        self.network = network
+        self.node_id = node_id
+        self.settings = settings
+        super().__init__()
+
+    def _configure(self, my_ip: str = None) -> None:
+        self._address_plan = self.network.address_plan
+        super()._configure(my_ip=self._address_plan.address_of(self.node_id))
+        self._zmq_context = self.network.context
+        self._zmq_endpoint_of = self.network.endpoint_of
+        self._mqtt_client = LocalMqttClient(self.network.broker_of(self.node_id))
+        # потоков и так по несколько на узел, поэтому пакеты обрабатываются прямо в цикле приёма
+        self._pipeline_workers = 0
+        # сотни узлов делят один GIL, поэтому heartbeat реже, а молчание до признания отказа дольше
+        self._heartbeat_interval = 0.5
+        self._heartbeat_max_silence = 3.0
+        self._stats_interval = float('inf')
+        # снимок для перезапуска включается явно, например snapshot_path='/tmp/sim-{node}.bin'
+        self._snapshot_path = None
+        for name, value in self.settings.items():
+            setattr(self, f'_{name}', value)
+
+    def _create_monitor(self) -> NodeMonitor:
+        return NodeMonitor(self.node_id, self._ping_port, self._my_ip, retry_interval=0.2,
+                           discovery=SimulatedDiscovery(self.network, self.node_id),
+                           address_plan=self._address_plan, successor_list_size=self._successor_list_size,
+                           metrics=self.metrics)
+
+
+class SimulatedAsyncNode(SimulatedNode, AsyncNode):
+    """AsyncNode в среде симулятора: запускается через run() в event loop, а не в потоке start_work"""
+
+
+class RingSimulator:
+    """Запускает, останавливает и перезапускает узлы SimulatedNode и измеряет поведение кольца"""
+
+    def __init__(self, network: SimulatedNetwork = None, **settings):
+        self.network = network or SimulatedNetwork()
+        self.settings = settings
+        self.nodes: dict = {}
+        self._threads: dict = {}
+        self._delivered: dict = {}
+        self._command_ids = itertools.count()
+        self._delivered_lock = threading.Lock()
+
+    # --------------------управление узлами--------------------
+    def start(self, node_ids: Iterable[int]) -> None:
+        for node_id in node_ids:
+            self.start_node(node_id)
+
+    def start_node(self, node_id: int) -> None:
+        self.network.set_alive(node_id, True)
+        self.network.broker_of(node_id).subscribe('/leader/core', self.__on_core_message(node_id))
+
+        def run():
+            node = SimulatedNode(self.network, node_id, **self.settings)
+            self.nodes[node_id] = node
+            node.start_work()
+
+        thread = threading.Thread(target=run, name=f'sim-node-{node_id}', daemon=True)
+        self._threads[node_id] = thread
+        thread.start()
+
+    def kill(self, node_id: int) -> None:
+        self.network.set_alive(node_id, False)
+        node = self.nodes.pop(node_id, None)
+        if node is not None:
+            node.stop()
+        thread = self._threads.pop(node_id, None)
+        if thread is not None:
+            thread.join(5)
+        self.network.brokers.pop(node_id, None)
+
+    def rejoin(self, node_id: int) -> None:
+        self.start_node(node_id)
+
+    def stop(self) -> None:
+        for node_id in tuple(self._threads):
+            self.kill(node_id)
+
+    # --------------------измерения--------------------
+    def converged(self) -> bool:
+        """Все запущенные узлы нашли своих соседей по кольцу и знают ровно список живых узлов"""
+
+        alive = self.network.alive_nodes()
+        if set(self.nodes) != alive:
+            return False
+        for node_id, node in tuple(self.nodes.items()):
+            pipeline = getattr(node, 'zmq_pipeline', None)
+            if pipeline is None or set(pipeline.get_all_node()) != alive:
+                return False
+            left, right = SimulatedDiscovery(self.network, node_id).find_neighbors()
+            expected = checker.clear_neighbors(*[address for address, _ in groupby((left, right))])
+            if node._neighbors != expected:
+                return False
+        return True
+
+    def wait_converged(self, timeout: float = 60.0, poll: float = 0.05) -> float or None:
+        """Ждёт схождения списка узлов, возвращает время ожидания или None, если не дождался"""
+
+        started = time.monotonic()
+        while time.monotonic() - started < timeout:
+            if self.converged():
+                return time.monotonic() - started
+            time.sleep(poll)
+        return None
+
+    def broadcast_commands(self, origin: int, count: int, timeout: float = 60.0) -> dict:
+        """Публикует count команд в брокер узла origin и ждёт, пока каждую получат все остальные узлы.
+        Возвращает число доставленных всем команд, охват - долю полученных копий от всех нужных,
+        время и пропускную способность
+        """
+
+        # номера команд не повторяются между вызовами, чтобы опоздавшие копии прошлых команд не засчитывались
+        command_ids = [next(self._command_ids) for _ in range(count)]
+        with self._delivered_lock:
+            self._delivered = {command_id: set() for command_id in command_ids}
+        receivers = self.network.alive_nodes() - {origin}
+        broker = self.network.broker_of(origin)
+
+        started = time.monotonic()
+        for command_id in command_ids:
+            broker.publish('/leader/network', json.dumps({'command': 'simulate', 'message': {'id': command_id}}))
+
+        delivered = 0
+        while time.monotonic() - started < timeout:
+            with self._delivered_lock:
+                delivered = sum(1 for nodes in self._delivered.values() if receivers <= nodes)
+            if delivered == count:
+                break
+            time.sleep(0.0005)
+
+        elapsed = time.monotonic() - started
+        with self._delivered_lock:
+            reached = sum(len(nodes & receivers) for nodes in self._delivered.values())
+        return {'commands': count,
+                'delivered': delivered,
+                'coverage': round(reached / (count * len(receivers)), 4) if count and receivers else 1.0,
+                'seconds': round(elapsed, 6),
+                'commands_per_second': round(delivered / elapsed, 1) if elapsed else 0.0,
+                'deliveries_per_second': round(delivered * len(receivers) / elapsed, 1) if elapsed else 0.0}
+
+    def broadcast_latency(self, origin: int, count: int, timeout: float = 10.0) -> list:
+        """Публикует count команд по одной, каждый раз дожидаясь доставки всем узлам.
+        Возвращает задержки доставки в секундах
+        """
+
+        latencies = []
+        for _ in range(count):
+            result = self.broadcast_commands(origin, 1, timeout=timeout)
+            if result['delivered'] == 1:
+                latencies.append(result['seconds'])
+        return latencies
+
+    def __on_core_message(self, node_id: int) -> Callable[[LocalMqttMessage], None]:
+        def on_message(message: LocalMqttMessage) -> None:
+            payload = json.loads(message.payload)
+            if payload.get('command') != 'simulate':
+                return
+            with self._delivered_lock:
+                nodes = self._delivered.get(payload['message']['id'])
+                if nodes is not None:
+                    nodes.add(node_id)
+
+        return on_message
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=50)
+    parser.add_argument('--kills', type=int, default=3, help='сколько узлов остановить и запустить заново')
+    parser.add_argument('--commands', type=int, default=100)
+    parser.add_argument('--heartbeat-interval', type=float, default=0.5)
+    parser.add_argument('--max-silence', type=float, default=3.0, help='молчание соседа до признания отказа, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--transport', choices=('inproc', 'tcp'), default='inproc')
+    parser.add_argument('--network', default='10.20.0.0/16', help='сеть плана адресов узлов')
+    parser.add_argument('--stride', type=int, default=256, help='шаг адресов соседних номеров узлов в сети')
+    parser.add_argument('--broadcast-mode', choices=('ring', 'fanout'), default='ring')
+    parser.add_argument('--fanout', type=int, default=3, help='сколько узлов получают пакет от каждого в режиме fanout')
+    parser.add_argument('--fanout-peers', choices=('structured', 'random'), default='structured')
+    parser.add_argument('--json', action='store_true', help='вывести результат одной строкой json')
+    args = parser.parse_args()
+
+    configure_logging(default_level='WARNING', levels={category: 'WARNING' for category in DEFAULT_LEVELS},
+                      sink=sys.stderr)
+
+    rng = random.Random(args.seed)
+    address_plan = CidrAddressPlan(args.network, stride=args.stride)
+    node_ids = sorted(rng.sample(address_plan.nodes(), args.nodes))
+    simulator = RingSimulator(SimulatedNetwork(address_plan, transport=args.transport),
+                              heartbeat_interval=args.heartbeat_interval, heartbeat_max_silence=args.max_silence,
+                              broadcast_mode=args.broadcast_mode, fanout=args.fanout, fanout_peers=args.fanout_peers)
+    results = {'nodes': args.nodes}
+    try:
+        started = time.monotonic()
+        simulator.start(node_ids)
+        converged = simulator.wait_converged(timeout=120)
+        results['start_converged_s'] = round(time.monotonic() - started, 3) if converged is not None else None
+
+        results['broadcast'] = simulator.broadcast_commands(node_ids[0], args.commands)
+
+        killed = rng.sample(node_ids[1:], args.kills)
+        started = time.monotonic()
+        for node_id in killed:
+            simulator.kill(node_id)
+        converged = simulator.wait_converged(timeout=60)
+        results['kill_converged_s'] = round(time.monotonic() - started, 3) if converged is not None else None
+
+        started = time.monotonic()
+        for node_id in killed:
+            simulator.rejoin(node_id)
+        converged = simulator.wait_converged(timeout=60)
+        results['rejoin_converged_s'] = round(time.monotonic() - started, 3) if converged is not None else None
+    finally:
+        simulator.stop()
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for key, value in results.items():
+            print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
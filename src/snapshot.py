@@ -0,0 +1,81 @@
+import os
+import time
+import struct
+import tempfile
+
+from typing import Iterable, NamedTuple
+
+from .membership import Member
+
+MAGIC = b'RSNP'
+SNAPSHOT_VERSION = 2
+
+# magic, версия формата, номер узла, время записи, число записей списка узлов
+HEADER = struct.Struct('!4sBHdI')
+# номер узла, воплощение, жив ли узел, когда узел последний раз был замечен (unix-время)
+ENTRY = struct.Struct('!HQBI')
+
+
+class SnapshotState(NamedTuple):
+    saved_at: float
+    members: list
+    # {номер узла: unix-время, когда узел последний раз подавал признаки жизни}, у ушедших - 0
+    seen_at: dict
+
+
+class RingSnapshot:
+    """Снимок списка узлов кольца в локальном файле для быстрого перезапуска узла.
+
+    Файл двоичный: заголовок и записи списка узлов фиксированной длины. Соседи в снимок не входят -
+    после перезапуска они ищутся среди ближайших узлов восстановленного списка.
+    Запись атомарна - снимок пишется во временный файл рядом и заменяет старый через os.replace,
+    так что после падения на диске остаётся либо старый, либо новый снимок целиком.
+    fsync не вызывается: снимок, потерянный при отключении питания, стоит только полного поиска соседей
+    """
+
+    def __init__(self, path: str, max_age: float = 3600.0):
+        self.path = path
+        # более старый снимок не используется - кольцо за это время могло измениться целиком
+        self.max_age = max_age
+        self.saved = 0
+
+    def save(self, my_node: int, members: Iterable[tuple]) -> None:
+        """Записывает снимок: записи members вида (node, incarnation, alive, seen_at)"""
+
+        members = list(members)
+
+        data = b''.join((HEADER.pack(MAGIC, SNAPSHOT_VERSION, my_node, time.time(), len(members)),
+                         *(ENTRY.pack(node, incarnation, alive, int(seen_at))
+                           for node, incarnation, alive, seen_at in members)))
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temporary = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                output.write(data)
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self.saved += 1
+
+    def load(self, my_node: int) -> SnapshotState or None:
+        """Читает снимок узла my_node. None - если снимка нет, он повреждён, устарел или записан другим узлом"""
+
+        try:
+            with open(self.path, 'rb') as snapshot_file:
+                data = snapshot_file.read()
+            magic, version, node, saved_at, members_count = HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+
+        if magic != MAGIC or version != SNAPSHOT_VERSION or node != my_node or \
+                len(data) != HEADER.size + members_count * ENTRY.size or \
+                not 0 <= time.time() - saved_at <= self.max_age:
+            return None
+
+        entries = list(ENTRY.iter_unpack(data[HEADER.size:]))
+        members = [Member(node, incarnation, bool(alive)) for node, incarnation, alive, _ in entries]
+        seen_at = {node: seen for node, _, _, seen in entries}
+
+        return SnapshotState(saved_at=saved_at, members=members, seen_at=seen_at)
@@ -0,0 +1,107 @@
+import threading
+
+import zmq
+from zmq import Socket, Context
+from typing import Callable
+
+from .logging_config import RateLimitedLogger
+
+# ошибки отправки повторяются на каждом пакете к недоступному соседу
+logger = RateLimitedLogger('zmq')
+
+
+class SenderSocketPool:
+    """Пул долгоживущих PUSH-сокетов для отправки пакетов, ключ - адрес получателя.
+
+    Сокет создаётся лениво при первой отправке адресату и дальше переиспользуется.
+    Если очередь к адресату переполнена, отбрасывается только текущий пакет, а сокет остаётся:
+    zmq сам переподключается и доставит очередь, когда адресат снова начнёт принимать.
+    При других ошибках отправки сокет закрывается и будет переподключён при следующей отправке.
+    Сокеты ушедших соседей закрываются через evict()
+    """
+
+    def __init__(self,
+                 context: Context,
+                 zmq_port: int,
+                 send_hwm: int = 1000,
+                 linger: int = 0,
+                 endpoint_of: Callable[[str], str] = None):
+
+        self.context = context
+        self.zmq_port = zmq_port
+        # адрес узла -> адрес zmq, по умолчанию tcp на zmq_port; симулятор подставляет inproc://
+        self.endpoint_of = endpoint_of or (lambda addressee: f'tcp://{addressee}:{self.zmq_port}')
+        self.send_hwm = send_hwm
+        self.linger = linger
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dropped = 0
+
+        self._sockets: dict = {}
+        # сокеты zmq не потокобезопасны, а отправка идёт из потоков приёма, mqtt и мониторинга
+        self._lock = threading.Lock()
+
+    def send(self, addressee: str, frames: list) -> bool:
+        """Отправляет кадры закодированного пакета frames адресату addressee через сокет из пула,
+        возвращает False если пакет не удалось поставить в очередь.
+        Принятые кадры zmq отправляются без копирования
+        """
+
+        with self._lock:
+            socket = self.__get_socket(addressee)
+            try:
+                socket.send_multipart(frames, flags=zmq.NOBLOCK, copy=False)
+            except zmq.error.Again:
+                self.dropped += 1
+                logger.warning('Очередь отправки на {} переполнена, пакет отброшен', lambda: addressee)
+                return False
+            except zmq.error.ZMQError as error:
+                logger.warning('Ошибка отправки на {}: {}', lambda: addressee, lambda: error)
+                self.__close_socket(addressee)
+                return False
+
+        return True
+
+    def evict(self, addressee: str) -> None:
+        """Закрывает и удаляет из пула сокет адресата addressee, если он есть"""
+
+        with self._lock:
+            if self.__close_socket(addressee):
+                self.evictions += 1
+
+    def close(self) -> None:
+        with self._lock:
+            for addressee in tuple(self._sockets):
+                self.__close_socket(addressee)
+
+    def stats(self) -> dict:
+        return {'size': len(self._sockets),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'dropped': self.dropped}
+
+    def __get_socket(self, addressee: str) -> Socket:
+        socket = self._sockets.get(addressee)
+        if socket is not None:
+            self.hits += 1
+            return socket
+
+        self.misses += 1
+        socket = self.context.socket(zmq.PUSH)
+        socket.setsockopt(zmq.LINGER, self.linger)
+        socket.setsockopt(zmq.SNDHWM, self.send_hwm)
+        socket.connect(self.endpoint_of(addressee))
+        self._sockets[addressee] = socket
+
+        return socket
+
+    def __close_socket(self, addressee: str) -> bool:
+        socket = self._sockets.pop(addressee, None)
+        if socket is None:
+            return False
+
+        socket.close()
+        return True
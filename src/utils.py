@@ -1,54 +1,104 @@
-import sys
 import time
+import select
 import socket
 import psutil
 
-from loguru import logger
 from socket import AddressFamily
+from typing import Callable
 
-logger.remove()
-logger.add(sys.stdout, format="{time:HH:mm:ss} | {level} | {message}", level="DEBUG")
+from .address_plan import DEFAULT_ADDRESS_PLAN, AddressPlan
+from .logging_config import get_logger
 
+logger = get_logger('node')
 
-def exploded_part(string: str, index: int, delimiter: str = ".") -> int:
-    """Разделяет строку string по разделителю delimiter и
-    возвращает часть строки из списка splited по индексу index в виде целого числа
-    """
-    splited = string.split(delimiter)
-    return int(splited[index])
+# группы рассылки netlink route: изменения интерфейсов и адресов IPv4
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
 
 
-def get_ip_addresses(family: AddressFamily = socket.AF_INET, network='10.20') -> str:
-    """Получает список ip адресов текущей машины и возвращает строку адреса если она начинается с префикса network"""
+def sleeping(switch: bool, seconds: int = 3) -> None:
+    if switch:
+        time.sleep(seconds)
+
+
+def find_plan_address(address_plan: AddressPlan, family: AddressFamily = socket.AF_INET) -> str or None:
+    """Первый адрес текущей машины, входящий в план адресов address_plan"""
 
     for interface, snics in psutil.net_if_addrs().items():
         for snic in snics:
-            if snic.family == family and snic.address.startswith(network):
+            if snic.family == family and address_plan.contains(snic.address):
                 return snic.address
 
 
-def get_node_id_from_addr(addr: str = get_ip_addresses()) -> int:
-    return exploded_part(string=addr, index=2)
-
-
-def sleeping(switch: bool, seconds: int = 3) -> None:
-    if switch:
-        time.sleep(seconds)
+def get_my_ip(address_plan: AddressPlan = DEFAULT_ADDRESS_PLAN) -> str:
+    logger.info('Ожидание адреса узла...')
+    my_ip = wait_for_address(lambda: find_plan_address(address_plan))
+    logger.info('Адрес узла: {}', my_ip)
 
+    return my_ip
 
-def get_unix_time() -> int:
-    return int(time.time())
 
+def wait_for_address(lookup: Callable[[], str or None],
+                     poll_interval: float = 1.0,
+                     recheck_interval: float = 5.0,
+                     timeout: float = None) -> str or None:
+    """Ждёт, пока lookup вернёт адрес, и возвращает его, или None по истечении timeout секунд.
 
-def get_my_ip() -> str:
-    my_ip = None
-    print('Wait ip')
-    while my_ip is None:
-        my_ip = get_ip_addresses()
-        time.sleep(1)
+    На Linux адреса перепроверяются по событиям netlink о появлении адресов и интерфейсов,
+    а раз в recheck_interval - на случай пропущенного события. Если netlink недоступен,
+    адреса проверяются раз в poll_interval секунд
+    """
 
-    print(my_ip)
-    return my_ip
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    watcher = _open_address_watcher()
+    interval = recheck_interval if watcher is not None else poll_interval
+    try:
+        while True:
+            # подписка открыта до проверки, так что адрес, появившийся между ними, не пропустится
+            address = lookup()
+            if address:
+                return address
+
+            wait = interval if deadline is None else min(interval, deadline - time.monotonic())
+            if wait <= 0:
+                return None
+            if watcher is None:
+                time.sleep(wait)
+                continue
+
+            readable, _, _ = select.select([watcher], [], [], wait)
+            if readable:
+                _drain(watcher)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+def _open_address_watcher() -> socket.socket or None:
+    """Сокет netlink, подписанный на изменения интерфейсов и адресов IPv4, или None вне Linux"""
+
+    if not hasattr(socket, 'AF_NETLINK'):
+        return None
+    try:
+        watcher = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    except OSError:
+        return None
+    try:
+        watcher.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        watcher.setblocking(False)
+    except OSError:
+        watcher.close()
+        return None
+    return watcher
+
+
+def _drain(watcher: socket.socket) -> None:
+    # содержимое событий не разбирается - по любому из них адреса перечитываются целиком
+    try:
+        while watcher.recv(65536):
+            pass
+    except (BlockingIOError, InterruptedError):
+        pass
 
 
 class NeighbourChecker:
@@ -0,0 +1,140 @@
+import queue
+import asyncio
+import threading
+
+from typing import Callable, Hashable
+
+from .logging_config import get_logger
+
+logger = get_logger('node')
+
+_STOP = object()
+
+
+class ShardedWorkerPool:
+    """Пул потоков обработки с ограниченной очередью у каждого потока.
+
+    Элемент с ключом key всегда попадает в очередь одного и того же потока, поэтому элементы
+    с одинаковым ключом (например, пакеты одного источника) обрабатываются строго по порядку,
+    а элементы с разными ключами - параллельно. Если очередь потока заполнена, submit ждёт
+    освобождения места не дольше timeout секунд и возвращает False, если не дождался
+    """
+
+    def __init__(self,
+                 handler: Callable[[object], None],
+                 workers: int = 4,
+                 queue_size: int = 1024,
+                 name: str = 'worker'):
+
+        self.handler = handler
+        self.name = name
+        self.processed = 0
+        self.errors = 0
+        self.rejected = 0
+        self.max_depth = 0
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+
+        for index, worker_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self.__run, args=(worker_queue,),
+                                      name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self, timeout: float = 1.0) -> None:
+        """Останавливает потоки после обработки уже поставленных в очередь элементов"""
+
+        for worker_queue in self._queues:
+            worker_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, key: Hashable, item, timeout: float = None) -> bool:
+        worker_queue = self._queues[hash(key) % len(self._queues)]
+        try:
+            worker_queue.put(item, timeout=timeout)
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+        depth = worker_queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def depths(self) -> list:
+        return [worker_queue.qsize() for worker_queue in self._queues]
+
+    def stats(self) -> dict:
+        return {'workers': len(self._queues),
+                'depths': self.depths(),
+                'max_depth': self.max_depth,
+                'processed': self.processed,
+                'errors': self.errors,
+                'rejected': self.rejected}
+
+    def __run(self, worker_queue: queue.Queue) -> None:
+        while True:
+            item = worker_queue.get()
+            if item is _STOP:
+                return
+            self._handle(item)
+
+    def _handle(self, item) -> None:
+        try:
+            self.handler(item)
+        except Exception as error:
+            # ошибка одного пакета не должна останавливать поток обработки
+            self.errors += 1
+            logger.exception('Ошибка обработки в {}: {}', self.name, error)
+        else:
+            self.processed += 1
+
+
+class AsyncShardedWorkerPool(ShardedWorkerPool):
+    """То же, что ShardedWorkerPool, но обработчики - задачи текущего event loop с очередями asyncio"""
+
+    def __init__(self,
+                 handler: Callable[[object], None],
+                 workers: int = 4,
+                 queue_size: int = 1024,
+                 name: str = 'worker'):
+
+        super().__init__(handler, workers, queue_size, name)
+        self._queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks = []
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self.__run(worker_queue)) for worker_queue in self._queues]
+
+    def close(self, timeout: float = None) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def submit(self, key: Hashable, item, timeout: float = None) -> bool:
+        worker_queue = self._queues[hash(key) % len(self._queues)]
+        try:
+            await asyncio.wait_for(worker_queue.put(item), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+
+        depth = worker_queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    async def __run(self, worker_queue: asyncio.Queue) -> None:
+        while True:
+            item = await worker_queue.get()
+            self._handle(item)
+            # даём приёму и другим обработчикам выполниться между пакетами
+            await asyncio.sleep(0)
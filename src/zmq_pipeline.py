@@ -1,178 +1,833 @@
-import sys
+import math
+import time
+import random
+import asyncio
+import itertools
+import threading
 
 import zmq
+import zmq.asyncio
 from zmq import Socket
-from loguru import logger
-from typing import NamedTuple
-# from dataclasses import dataclass
-
-from .utils import NeighbourChecker as checker
-from .utils import get_node_id_from_addr, sleeping, get_unix_time
+from bisect import bisect_left, bisect_right
+from typing import Callable, NamedTuple
+
+from .address_plan import AddressPlan, DEFAULT_ADDRESS_PLAN
+from .codec import PacketCodec, ERAPMessage, CodecError, WIRE_VERSION, DATA, HEARTBEAT, GOSSIP, ACK, \
+    ACCEPTS_COMPRESSED, HAS_FANOUT, CAPABILITY_FANOUT, CAPABILITY_LINK
+from .failure_detector import PhiAccrualFailureDetector
+from .logging_config import get_logger, RateLimitedLogger
+from .member_store import MemberStore
+from .membership import Membership
+from .metrics import MetricsRegistry
+from .reliable_link import ReliableLinks
+from .routing_table import RingRoutingTable
+from .seen_cache import SeenCache
+from .socket_pool import SenderSocketPool
+from .worker_pool import ShardedWorkerPool, AsyncShardedWorkerPool
+from .utils import sleeping
 
 waiting = False
 
-logger.remove()
-logger.add(sys.stdout, format="{time:HH:mm:ss} | {level} | {message}", level="INFO")
+logger = get_logger('zmq')
+# сообщения о каждом пакете - с отложенным форматированием и ограничением частоты
+packet_logger = RateLimitedLogger('packets')
 
 
 class ZmqPipelineNode:
     def __init__(self,
                  zmq_port: int,
                  host_ip: str,
-                 neighbors: list
+                 neighbors: list,
+                 failure_detector: PhiAccrualFailureDetector = None,
+                 wire_format: str = 'auto',
+                 seen_cache_size: int = 4096,
+                 seen_cache_ttl: float = 30.0,
+                 workers: int = 0,
+                 worker_queue_size: int = 1024,
+                 routing_mode: str = 'ring',
+                 context: zmq.Context = None,
+                 endpoint_of: Callable[[str], str] = None,
+                 metrics: MetricsRegistry = None,
+                 address_plan: AddressPlan = DEFAULT_ADDRESS_PLAN,
+                 link_mode: str = 'plain',
+                 link_window: int = 128,
+                 link_max_pending: int = 1024,
+                 link_retransmit_timeout: float = 0.5,
+                 send_hwm: int = 1000,
+                 receive_hwm: int = 1000,
+                 member_ttl: float = None,
+                 compression: str = 'off',
+                 compression_threshold: int = 512,
+                 broadcast_mode: str = 'ring',
+                 fanout: int = 3,
+                 fanout_peers: str = 'structured',
+                 fanout_rounds: int = None
                  ):
 
         self.zmq_port = zmq_port
         self.host_ip = host_ip
-        self.context = zmq.Context()
+        self.context = context or zmq.Context()
+        # адрес узла -> адрес zmq; несколько узлов в одном процессе используют общий контекст и inproc://
+        self.endpoint_of = endpoint_of or (lambda address: f'tcp://{address}:{self.zmq_port}')
         self.consumer_receiver_socket = None
-        self.nodes_dict: dict = {}
+        # 'plain' - пакеты данных уходят без подтверждений, 'reliable' - с номерами на линии,
+        # подтверждениями, повторами и ограничением числа пакетов в пути (ReliableLinks)
+        self.link_mode = link_mode
+        # очередь libzmq к соседу не должна быть меньше окна линии, иначе пакеты окна отбрасывались бы в ней
+        if link_mode == 'reliable':
+            send_hwm = max(send_hwm, link_window)
+        self.receive_hwm = receive_hwm
+        self.sender_pool = SenderSocketPool(self.context, self.zmq_port, send_hwm=send_hwm,
+                                            endpoint_of=self.endpoint_of)
+        self._running = True
+        # номера узлов <-> адреса; внутри кольца всё работает с номерами
+        self.address_plan = address_plan
+        self.my_node = address_plan.node_of(self.host_ip)
+        self.routing_table = RingRoutingTable(self.my_node)
+        # список узлов кольца распространяется между соседями изменениями (gossip),
+        # живые узлы (members) и таблица маршрутизации - производные от него.
+        # member_ttl - живой узел, о котором столько секунд ничего не слышно, удаляется в expire_members()
+        self.members = MemberStore(self.my_node, ttl=member_ttl)
+        # возможности узла расходятся вместе с его записью: любой узел этой версии пересылает
+        # пакеты fanout-рассылки, а подтверждает пакеты надёжной линии только узел в режиме 'reliable'
+        self.membership = Membership(self.my_node, capabilities=CAPABILITY_FANOUT |
+                                     (CAPABILITY_LINK if link_mode == 'reliable' else 0))
+        self.membership_synced = threading.Event()
+        # изменения списка узлов приходят из потоков приёма, обработчиков и мониторинга; под одной
+        # блокировкой живые узлы и таблица маршрутизации меняются в том же порядке, что и сам список
+        self._membership_lock = threading.RLock()
+        self._gossip_sent: dict = {}
+        self._gossip_mismatches: dict = {}
         self.neighbors = neighbors
-
-    # @dataclass(frozen=True)
-    # class ERAPMessage:
-    #     """Extended Ring Applied Protocol Message - класс для задания структуры сообщений"""
-    #     source: str
-    #     sender_neighbour: str
-    #     addressee: str
-    #     command: str
-    #     message: NamedTuple
+        self.failure_detector = failure_detector
+        # 'auto' - бинарный формат для соседей, объявивших его поддержку, 'json' - только json
+        self.wire_format = wire_format
+        # 'zlib' - payload от compression_threshold байт сжимается для соседей, которые тоже его
+        # принимают, 'off' - пакеты не сжимаются
+        if compression not in ('zlib', 'off'):
+            raise ValueError(f'Неизвестный режим сжатия: {compression}')
+        self.compression = compression
+        self.codec = PacketCodec(address_of=address_plan.address_of, node_of=address_plan.node_of,
+                                 compression_threshold=compression_threshold if compression == 'zlib' else None)
+        self._peer_wire: dict = {}
+        self._peer_compression: set = set()
+        # уже обработанные пакеты (источник, номер) - повторные копии отбрасываются сразу после приёма
+        self.seen_cache = SeenCache(max_entries=seen_cache_size, ttl=seen_cache_ttl)
+        # номера начинаются со случайного значения, чтобы после перезапуска узла
+        # его новые пакеты не совпали с ещё не вытесненными старыми
+        self._sequence = itertools.count(random.getrandbits(31) + 1)
+        self.duplicates_dropped = 0
+        # 0 - пакеты обрабатываются прямо в цикле приёма, иначе приём только раскладывает их
+        # по очередям обработчиков (пакеты одного источника - всегда одному обработчику)
+        self.workers = workers
+        self.worker_queue_size = worker_queue_size
+        # 'ring' - адресные пакеты идут по соседям кольца, 'finger' - через finger table за O(log n) переходов
+        self.routing_mode = routing_mode
+        self.shortcut_fallbacks = 0
+        # 'ring' - рассылка всем узлам идёт по кольцу через соседей за O(n) переходов,
+        # 'fanout' - каждый узел пересылает пакет fanout узлам кольца, и рассылка занимает O(log n) раундов.
+        # fanout_peers: 'structured' - кольцо делится на fanout участков, и пакет получает первый узел
+        # каждого участка с границей участка (дерево без повторов), 'random' - случайные узлы (epidemic),
+        # повторные копии отбрасываются. fanout_rounds - сколько раз пакет может быть переслан, None - по размеру кольца
+        if broadcast_mode not in ('ring', 'fanout'):
+            raise ValueError(f'Неизвестный режим рассылки: {broadcast_mode}')
+        if fanout_peers not in ('structured', 'random'):
+            raise ValueError(f'Неизвестный выбор узлов рассылки: {fanout_peers}')
+        self.broadcast_mode = broadcast_mode
+        self.fanout = max(fanout, 1)
+        self.fanout_peers = fanout_peers
+        self.fanout_rounds = fanout_rounds
+        self.fanout_sent = 0
+        self.fanout_delivered = 0
+        self.fanout_exhausted = 0
+        self.fanout_fallbacks = 0
+        self._fanout_supported = (-1, False)
+        self.worker_pool = None
+        self.received = 0
+        # пакеты, которые не удалось разобрать или обработать из-за повреждённых данных
+        self.malformed = 0
+        self.links = None
+        if link_mode == 'reliable':
+            self.links = ReliableLinks(self.my_node, send=self.sender_pool.send,
+                                       encode=self.__encode,
+                                       address_of=self.codec.address,
+                                       window=link_window, max_pending=link_max_pending,
+                                       receive_window=worker_queue_size, credit_of=self.__receive_credit,
+                                       retransmit_timeout=link_retransmit_timeout)
+        elif link_mode != 'plain':
+            raise ValueError(f'Неизвестный режим линий: {link_mode}')
+        self._last_link_tick = 0.0
+        self.metrics = metrics or MetricsRegistry()
+        self.__register_metrics()
+        self.__update_membership(lambda: [self.membership.get(self.my_node)])
 
     class SenderNode(NamedTuple):
         address: str
         live_time: int
 
+    def bind(self) -> None:
+        """Открывает сокет приёма заранее, до запуска цикла приёма, - пакеты соседей копятся в нём"""
+
+        if self.consumer_receiver_socket is None:
+            self.consumer_receiver_socket = self.__create_receiver_socket(self.context)
+
     def handle_received_packet(self, mqtt) -> None:
-        self.consumer_receiver_socket = self.__create_receiver_socket()
-        while True:
+        self.bind()
+        # приём периодически просыпается, чтобы заметить stop() и повторить неподтверждённые пакеты
+        self.consumer_receiver_socket.setsockopt(zmq.RCVTIMEO, 200 if self.links is None else 50)
+        if self.workers:
+            self.worker_pool = ShardedWorkerPool(lambda message: self.handle_message(message, mqtt),
+                                                 workers=self.workers, queue_size=self.worker_queue_size,
+                                                 name='zmq-worker')
+            self.worker_pool.start()
+
+        while self._running:
+            if self.links is not None:
+                self.__service_links()
             try:
-                packet = self.__receive_response(self.consumer_receiver_socket)
+                message = self.read_message(self.consumer_receiver_socket.recv_multipart(copy=False))
             except zmq.error.ZMQError:
                 pass
+            except (CodecError, ValueError) as error:
+                self.malformed += 1
+                packet_logger.warning('Не удалось разобрать пакет: {}', lambda: error)
             else:
-                my_node = get_node_id_from_addr(self.host_ip)
-                if packet.get('sender_node') != my_node:
-                    # если передаём список своих адресов друг другу
-                    nodes = packet.get('nodes_in_network')
-                    if nodes:
-                        if my_node not in nodes:
-                            nodes.append(my_node)
-                        packet.update({'nodes_in_network': nodes})
-                        self.set_nodes_dict(nodes)
-
-                    addressee = self.__identify_addressee(packet, my_node)
-                    consumer_sender_socket = self.__create_sender_sockets(addressee)
-
-                    sleeping(waiting)
-                    if packet.get('command'):
-                        mqtt.send_message_on_mqtt(packet)
-                    self.__send_packet(consumer_sender_socket, addressee, packet)
+                if self.links is not None and not self.__accept_link(message):
+                    continue
+                if self.worker_pool is None or message.msg_type != DATA:
+                    self.handle_message(message, mqtt)
+                else:
+                    # очередь обработчика заполнена - приём ждёт, и дальше срабатывает HWM сокета
+                    self.worker_pool.submit(message.source, message)
+
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+        self.close_sockets()
+
+    def stop(self) -> None:
+        """Останавливает цикл приёма, после чего он закрывает сокеты"""
+
+        self._running = False
+
+    async def handle_received_packet_async(self, mqtt) -> None:
+        """То же, что handle_received_packet, но приём идёт через zmq.asyncio в текущем event loop"""
+
+        context = zmq.asyncio.Context.shadow(self.context)
+        self.consumer_receiver_socket = self.__create_receiver_socket(context)
+        # приём просыпается так же, как синхронный: замечает stop() и завершение контекста - о нём
+        # zmq.asyncio не сообщает ожидающему приёму
+        self.consumer_receiver_socket.setsockopt(zmq.RCVTIMEO, 200)
+        link_ticks = asyncio.ensure_future(self.__tick_links_async()) if self.links is not None else None
+        if self.workers:
+            self.worker_pool = AsyncShardedWorkerPool(lambda message: self.handle_message(message, mqtt),
+                                                      workers=self.workers, queue_size=self.worker_queue_size,
+                                                      name='zmq-worker')
+            self.worker_pool.start()
+
+        try:
+            while self._running:
+                try:
+                    message = self.read_message(await self.consumer_receiver_socket.recv_multipart(copy=False))
+                except zmq.error.ZMQError as error:
+                    # контекст завершён или сокет закрыт - принимать больше нечего, а повтор приёма
+                    # сразу вернул бы ту же ошибку
+                    if error.errno == zmq.ETERM or self.consumer_receiver_socket.closed:
+                        break
+                except (CodecError, ValueError) as error:
+                    self.malformed += 1
+                    packet_logger.warning('Не удалось разобрать пакет: {}', lambda: error)
                 else:
-                    nodes = packet.get('nodes_in_network')
-                    if nodes:
-                        self.set_nodes_dict(nodes)
-                    sleeping(waiting)
-                    logger.info(f'Получил:\n{packet}\n')
+                    if self.links is not None and not self.__accept_link(message):
+                        continue
+                    if self.worker_pool is None or message.msg_type != DATA:
+                        self.handle_message(message, mqtt)
+                    else:
+                        await self.worker_pool.submit(message.source, message)
+                    if self.links is not None and not self.__has_input():
+                        self.links.flush_acks()
+        finally:
+            if link_ticks is not None:
+                link_ticks.cancel()
+            if self.worker_pool is not None:
+                self.worker_pool.close()
+            self.close_sockets()
+
+    async def __tick_links_async(self) -> None:
+        while True:
+            await asyncio.sleep(self.links.retransmit_timeout / 4)
+            self.links.tick()
+
+    def stage_stats(self) -> dict:
+        """Состояние стадий конвейера: число принятых пакетов и глубина очередей обработчиков"""
+
+        stats = {'received': self.received, 'malformed': self.malformed,
+                 'duplicates_dropped': self.duplicates_dropped, 'shortcut_fallbacks': self.shortcut_fallbacks}
+        if self.worker_pool is not None:
+            stats['workers'] = self.worker_pool.stats()
+        if self.links is not None:
+            stats['links'] = self.links.stats()
+        return stats
+
+    def wait_for_credit(self, timeout: float) -> bool:
+        """Ждёт не дольше timeout секунд, пока у надёжных линий не освободится место для новых пакетов.
+        Без надёжных линий места всегда достаточно
+        """
+
+        return self.links is None or self.links.wait_for_credit(timeout)
+
+    def read_message(self, frames: list) -> ERAPMessage:
+        """Декодирует принятые кадры и запоминает, какой формат понимает приславший пакет сосед"""
+
+        # заголовок маленький и нужен целиком, а payload остаётся кадром zmq без копирования
+        message, wire_version = self.codec.decode([frames[0].bytes, *frames[1:]])
+        self.received += 1
+
+        if message.msg_type != DATA:
+            neighbour = self.codec.address(message.source)
+        elif message.sender_neighbour:
+            neighbour = self.codec.address(message.sender_neighbour)
+        else:
+            return message
+        self._peer_wire[neighbour] = wire_version
+        if message.flags & ACCEPTS_COMPRESSED:
+            self._peer_compression.add(neighbour)
+        else:
+            self._peer_compression.discard(neighbour)
+
+        return message
+
+    def handle_message(self, message: ERAPMessage, mqtt) -> None:
+        """Обрабатывает принятое сообщение. Пакет с повреждёнными данными - payload не json-объект,
+        не разжимается или с полями не того типа - отбрасывается и учитывается в malformed,
+        не останавливая цикл приёма
+        """
+
+        try:
+            self.__handle_message(message, mqtt)
+        except (CodecError, ValueError, TypeError) as error:
+            self.malformed += 1
+            packet_logger.warning('Пакет от узла {} с повреждёнными данными отброшен: {}',
+                                  lambda: message.source, lambda: error)
+
+    def __handle_message(self, message: ERAPMessage, mqtt) -> None:
+        # любой пакет - признак жизни и его источника, и соседа, от которого он пришёл
+        self.members.refresh(message.source)
+        self.members.refresh(message.sender_neighbour)
+        if message.msg_type == HEARTBEAT:
+            # heartbeat не пересылается дальше, а только учитывается детектором отказов
+            if self.failure_detector is not None:
+                self.failure_detector.heartbeat(message.source)
+            return
+        if message.msg_type == GOSSIP:
+            self.__handle_gossip(message)
+            return
+
+        started = time.perf_counter()
+        self.__handle_data(message, mqtt)
+        self._processing_time.observe(time.perf_counter() - started)
+
+    def __handle_data(self, message: ERAPMessage, mqtt) -> None:
+        my_node = self.my_node
+        if message.source != my_node and message.seq and \
+                self.seen_cache.check_and_add((message.source, message.seq)):
+            # копия уже обработанного пакета - например, при перестроении кольца
+            self.duplicates_dropped += 1
+            return
+
+        if message.target:
+            self.__route_unicast(message, mqtt)
+            return
+
+        if message.flags & HAS_FANOUT:
+            self.__handle_fanout(message, mqtt)
+            return
+
+        if message.source != my_node:
+            # если передаём список своих адресов друг другу
+            nodes = message.nodes
+            if nodes:
+                if my_node not in nodes:
+                    nodes.append(my_node)
+                self.set_nodes_dict(nodes)
+
+            addressee = self.__identify_addressee(message)
+
+            if message.has_command:
+                # payload декодируется только для пакетов, которые нужно опубликовать в mqtt
+                mqtt.send_message_on_mqtt(self.codec.to_packet(message))
+            if addressee is None:
+                packet_logger.warning('Не удалось определить получателя пакета от узла {}',
+                                      lambda: message.sender_neighbour)
+                return
+            self.__send_packet(addressee, message)
+        else:
+            nodes = message.nodes
+            if nodes:
+                self.set_nodes_dict(nodes)
+            packet_logger.info('Получил:\n{}\n', lambda: self.codec.to_packet(message))
 
     def start_sending_packet(self, addressee: str, packet: dict):
-        consumer_sender_socket = self.__create_sender_sockets(addressee)
-        packet.update({'sender_node': get_node_id_from_addr(self.host_ip)})
+        # каждая отправка - отдельный пакет со своим номером, копии в разные стороны кольца не склеиваются
+        message = self.codec.data_message(packet, self.my_node, self.__next_seq())
 
         sleeping(waiting)
-        self.__send_packet(consumer_sender_socket, addressee, packet)
-
-        logger.info(f'Отправлено:\n{packet}\n')
-        consumer_sender_socket.close()
+        self.__send_packet(addressee, message)
+
+        packet_logger.info('Отправлено:\n{}\n', lambda: self.codec.to_packet(message))
+
+    def broadcast(self, packet: dict) -> None:
+        """Рассылает пакет packet всем узлам кольца в режиме broadcast_mode"""
+
+        if self.broadcast_mode == 'fanout':
+            if self.__fanout_supported():
+                self.__broadcast_fanout(packet)
+                return
+            # в кольце есть узлы, которые не пересылают fanout-рассылку, - их участки остались бы без пакета
+            self.fanout_fallbacks += 1
+
+        for neighbour in self.neighbors:
+            self.start_sending_packet(neighbour, packet)
+
+    def __broadcast_fanout(self, packet: dict) -> None:
+        # у всех копий один номер - повторы отбрасываются кэшем обработанных пакетов
+        message = self.codec.data_message(packet, self.my_node, self.__next_seq())
+        message.flags |= HAS_FANOUT
+        message.rounds = self.__fanout_rounds()
+        message.fanout_limit = self.my_node
+        self.__forward_fanout(message)
+
+        packet_logger.info('Разослано:\n{}\n', lambda: self.codec.to_packet(message))
+
+    def send_unicast(self, target: int, packet: dict) -> bool:
+        """Отправляет пакет packet одному узлу кольца target, а не по всему кольцу.
+        Возвращает False, если узел target неизвестен
+        """
+
+        message = self.codec.data_message(packet, self.my_node, self.__next_seq(), target)
+        if target == self.my_node or target not in self.routing_table:
+            logger.warning('Узел назначения {} не найден в кольце', target)
+            return False
+
+        self.__forward_unicast(message)
+        packet_logger.info('Отправлено узлу {}:\n{}\n', lambda: target, lambda: self.codec.to_packet(message))
+        return True
+
+    def send_heartbeats(self, neighbors: list) -> None:
+        """Отправляет соседям neighbors heartbeat по уже установленным соединениям"""
+
+        message = ERAPMessage(source=self.my_node, sender_neighbour=0, addressee=0,
+                              msg_type=HEARTBEAT)
+        for neighbour in neighbors:
+            self.sender_pool.send(neighbour, self.__encode(message, neighbour))
+
+    def send_gossip(self, neighbors: list, full: int = 0) -> None:
+        """Отправляет соседям изменения списка узлов, которые они ещё не получали, и digest
+        своего состояния. Если изменений нет, пакет содержит только digest.
+        full=1 - отправить состояние целиком с просьбой ответить тем же при расхождении,
+        full=2 - полное состояние в ответ, на которое не отвечают
+        """
+
+        version = self.membership.version
+        for neighbour in neighbors:
+            members = self.membership.snapshot() if full else \
+                self.membership.delta_since(self._gossip_sent.get(neighbour, 0))
+            body = {'d': self.membership.digest()}
+            if members:
+                body['m'] = members
+                # отдельным списком, чтобы узлы старых версий разбирали записи как раньше
+                body['c'] = self.membership.capabilities_of(members)
+            if full:
+                body['full'] = full
+
+            message = ERAPMessage(source=self.my_node, sender_neighbour=0, addressee=0,
+                                  msg_type=GOSSIP, _body=body)
+            if self.sender_pool.send(neighbour, self.__encode(message, neighbour)):
+                self._gossip_sent[neighbour] = version
+
+    def evict_sender(self, addressee: str) -> None:
+        """Закрывает сокет отправки к ушедшему узлу addressee"""
+
+        self.sender_pool.evict(addressee)
+        if self.links is not None:
+            self.links.forget(addressee)
+        self._gossip_sent.pop(addressee, None)
+        self._peer_compression.discard(addressee)
+        self._gossip_mismatches.pop(addressee, None)
 
     def close_sockets(self):
         self.consumer_receiver_socket.close()
+        self.sender_pool.close()
 
-    def __create_receiver_socket(self) -> Socket:
+    def __create_receiver_socket(self, context: zmq.Context) -> Socket:
         # для получения
-        consumer_receiver_socket = self.context.socket(zmq.PULL)
-        consumer_receiver_socket.bind(f'tcp://{self.host_ip}:{self.zmq_port}')
+        consumer_receiver_socket = context.socket(zmq.PULL)
+        consumer_receiver_socket.setsockopt(zmq.RCVHWM, self.receive_hwm)
+        consumer_receiver_socket.bind(self.endpoint_of(self.host_ip))
 
         return consumer_receiver_socket
 
-    def __create_sender_sockets(self, addressee: str) -> Socket:
-        # для отправления
-        consumer_sender_socket = self.context.socket(zmq.PUSH)
-        consumer_sender_socket.connect(f'tcp://{addressee}:{self.zmq_port}')
-
-        return consumer_sender_socket
-
-    def __send_packet(self, socket: Socket, neighbour: str, packet) -> None:
-        self.__change_packet(neighbour, packet)
-        if packet.get('sender_node') != get_node_id_from_addr(self.host_ip):
-            logger.debug(f'Получил и отправил дальше:\n{packet}\n')
-        socket.send_json(packet)
-
-    @staticmethod
-    def __receive_response(socket: Socket) -> dict:
-        return socket.recv_json()
-
-    def __identify_addressee(self, packet: dict, my_node: int) -> str:
-        from_node = get_node_id_from_addr(packet.get('from'))
-        addressed_node = None
-        self.nodes_dict = self.__sorted_dict(self.nodes_dict)
-        nodes = tuple(self.nodes_dict.keys())
-
-        if from_node in nodes:
-            if len(nodes) > 2:
-                if not checker.is_node_outermost(node_id=my_node, nodes=nodes):
-                    if from_node > my_node:
-                        addressed_node = nodes[nodes.index(my_node) - 1]
-                    elif from_node < my_node:
-                        addressed_node = nodes[nodes.index(my_node) + 1]
-                else:
-                    if checker.is_node_first(node_id=my_node, nodes=nodes):
-
-                        if from_node == nodes[-1]:
-                            addressed_node = nodes[1]
-                        else:
-                            addressed_node = nodes[-1]
-                    elif checker.is_node_last(node_id=my_node, nodes=nodes):
-                        if from_node == nodes[0]:
-                            addressed_node = nodes[-2]
-                        else:
-                            addressed_node = nodes[0]
-            elif len(nodes) == 2:
-                if my_node in nodes:
-                    return packet.get('from')
-                else:
-                    for node in nodes:
-                        if node != from_node:
-                            addressed_node = node
-            else:
-                addressed_node = nodes[0]
-
-            return f'10.20.{addressed_node}.1'
-
-        elif packet.get('from') in self.neighbors:
+    def __send_packet(self, neighbour: str, message: ERAPMessage) -> bool:
+        """Переписывает в заголовке сообщения from и to и отправляет его соседу neighbour.
+        Кадр payload полученного пакета уходит дальше как есть, без декодирования и копирования
+        """
+
+        message.sender_neighbour = self.my_node
+        message.addressee = self.codec.node_or_zero(neighbour)
+        forwarded = message.source != self.my_node
+        if forwarded:
+            packet_logger.debug('Получил и отправил дальше:\n{}\n', lambda: self.codec.to_packet(message))
+        # сокеты к соседям долгоживущие и берутся из пула
+        if self.links is not None and self.__accepts_link(neighbour):
+            sent = self.links.send(neighbour, message)
+        else:
+            sent = self.sender_pool.send(neighbour, self.__encode(message, neighbour))
+        if not sent:
+            self._send_failures.inc()
+            return False
+        if forwarded:
+            self._packets_forwarded.inc()
+        return True
+
+    def __handle_fanout(self, message: ERAPMessage, mqtt) -> None:
+        if message.source == self.my_node:
+            # случайные узлы могут вернуть пакет источнику
+            return
+
+        self.fanout_delivered += 1
+        if message.has_command:
+            mqtt.send_message_on_mqtt(self.codec.to_packet(message))
+        if message.rounds:
+            self.__forward_fanout(message)
+        elif self.fanout_peers == 'random' or self.__fanout_branches(self.routing_table.nodes, message.fanout_limit):
+            # раунды кончились раньше, чем пакет дошёл до всех узлов участка
+            self.fanout_exhausted += 1
+
+    def __fanout_supported(self) -> bool:
+        """Все живые узлы кольца объявили CAPABILITY_FANOUT. Проверка повторяется только после
+        изменения списка узлов
+        """
+
+        version = self.membership.version
+        if self._fanout_supported[0] != version:
+            membership = self.membership
+            supported = all(membership.get(node).capabilities & CAPABILITY_FANOUT
+                            for node in self.routing_table.nodes)
+            self._fanout_supported = (version, supported)
+        return self._fanout_supported[1]
+
+    def __forward_fanout(self, message: ERAPMessage) -> None:
+        """Пересылает пакет fanout-рассылки следующим узлам, уменьшая число оставшихся раундов"""
+
+        nodes = self.routing_table.nodes
+        message.rounds -= 1
+        if self.fanout_peers == 'random':
+            excluded = (self.my_node, message.source, message.sender_neighbour)
+            candidates = [node for node in random.sample(nodes, min(self.fanout + 3, len(nodes)))
+                          if node not in excluded]
+            branches = [((node,), 0) for node in candidates[:self.fanout]]
+        else:
+            branches = self.__fanout_branches(nodes, message.fanout_limit)
+
+        for branch, limit in branches:
+            message.fanout_limit = limit
+            # если первый узел участка недоступен, участок достаётся следующему
+            for node in branch:
+                if self.__send_packet(self.codec.address(node), message):
+                    self.fanout_sent += 1
+                    break
+
+    def __fanout_branches(self, nodes: tuple, limit: int) -> list:
+        """Делит узлы кольца после этого узла и до limit (не включая, limit равен этому узлу - всё кольцо)
+        на fanout участков подряд. Возвращает участки с границами - границей каждого служит начало следующего
+        """
+
+        start = bisect_right(nodes, self.my_node)
+        end = bisect_left(nodes, limit)
+        covered = nodes[start:end] if start <= end else nodes[start:] + nodes[:end]
+        if not covered:
+            return []
+
+        count = min(self.fanout, len(covered))
+        bounds = [len(covered) * index // count for index in range(count + 1)]
+        return [(covered[bounds[index]:bounds[index + 1]],
+                 covered[bounds[index + 1]] if index + 1 < count else limit)
+                for index in range(count)]
+
+    def __fanout_rounds(self) -> int:
+        if self.fanout_rounds is not None:
+            return min(self.fanout_rounds, 255)
+        ring_size = max(len(self.routing_table), 2)
+        if self.fanout < 2:
+            return min(ring_size, 255)
+        # запас вдвое: у участков разной длины и у случайных узлов путь длиннее log(n)
+        return min(2 * math.ceil(math.log(ring_size, self.fanout)) + 1, 255)
+
+    def __route_unicast(self, message: ERAPMessage, mqtt) -> None:
+        if message.target == self.my_node:
+            if message.has_command:
+                mqtt.send_message_on_mqtt(self.codec.to_packet(message))
+            packet_logger.info('Получил от узла {}:\n{}\n',
+                               lambda: message.source, lambda: self.codec.to_packet(message))
+            return
+
+        if not self.__forward_unicast(message):
+            packet_logger.warning('Не удалось переслать пакет узлу {}', lambda: message.target)
+
+    def __forward_unicast(self, message: ERAPMessage) -> bool:
+        """Пересылает адресный пакет на шаг ближе к узлу назначения.
+        Если переход по finger table не удался, пакет идёт соседу кольца в ту же сторону
+        """
+
+        if self.routing_mode == 'finger':
+            hop = self.routing_table.unicast_hop(message.target, shortcuts=True)
+            if hop is not None and self.__send_packet(self.codec.address(hop), message):
+                return True
+            self.shortcut_fallbacks += 1
+
+        hop = self.routing_table.unicast_hop(message.target)
+        if hop is None:
+            return False
+        return self.__send_packet(self.codec.address(hop), message)
+
+    def __handle_gossip(self, message: ERAPMessage) -> None:
+        if message.source == self.my_node:
+            return
+
+        body = message.body()
+        changes = self.__update_membership(self.membership.merge, body.get('m', ()), body.get('c'))
+
+        neighbour = self.codec.address(message.source)
+        if changes:
+            # новые изменения сразу уходят дальше по кольцу, не дожидаясь очередного раунда gossip
+            self.send_gossip([address for address in self.neighbors if address != neighbour])
+
+        digest = body.get('d')
+        if digest is None:
+            return
+
+        if digest == self.membership.digest():
+            self._gossip_mismatches[neighbour] = 0
+            self.membership_synced.set()
+            if body.get('full') == 1:
+                # сосед ждёт подтверждения, что состояния совпали, - например, восстановив список узлов из снимка
+                self.send_gossip([neighbour])
+            return
+
+        # одно расхождение - обычно изменения, которые сосед ещё не получил от нас;
+        # если оно повторяется, состояниями обмениваются целиком
+        mismatches = self._gossip_mismatches.get(neighbour, 0) + 1
+        self._gossip_mismatches[neighbour] = mismatches
+        if body.get('full') == 1:
+            self.send_gossip([neighbour], full=2)
+        elif mismatches >= 2 and not body.get('full'):
+            self._gossip_mismatches[neighbour] = 0
+            self.send_gossip([neighbour], full=1)
+
+    def __register_metrics(self) -> None:
+        # счётчики, которые и так ведутся компонентами, читаются только при снятии метрик
+        metrics = self.metrics
+        metrics.counter('zmq_packets_received_total', 'Принятые пакеты', function=lambda: self.received)
+        metrics.counter('zmq_packets_malformed_total', 'Пакеты, отброшенные из-за повреждённых данных',
+                        function=lambda: self.malformed)
+        metrics.counter('zmq_duplicates_dropped_total', 'Отброшенные копии уже обработанных пакетов',
+                        function=lambda: self.duplicates_dropped)
+        metrics.counter('zmq_shortcut_fallbacks_total', 'Адресные пакеты, ушедшие соседу вместо finger',
+                        function=lambda: self.shortcut_fallbacks)
+        metrics.counter('zmq_sockets_created_total', 'Созданные сокеты отправки',
+                        function=lambda: self.sender_pool.misses)
+        metrics.counter('zmq_sockets_evicted_total', 'Закрытые сокеты ушедших соседей',
+                        function=lambda: self.sender_pool.evictions)
+        metrics.counter('zmq_send_queue_full_total', 'Пакеты, отброшенные из-за переполненной очереди к соседу',
+                        function=lambda: self.sender_pool.dropped)
+        metrics.gauge('ring_size', 'Число узлов в кольце', function=lambda: len(self.routing_table))
+        metrics.counter('ring_members_expired_total', 'Узлы, удалённые из-за отсутствия признаков жизни',
+                        function=lambda: self.members.expired)
+        metrics.gauge('ring_neighbours', 'Число соседей узла', function=lambda: len(self.neighbors))
+        metrics.counter('zmq_fanout_sent_total', 'Копии пакетов fanout-рассылки, отправленные узлом',
+                        function=lambda: self.fanout_sent)
+        metrics.counter('zmq_fanout_delivered_total', 'Пакеты fanout-рассылки, впервые полученные узлом',
+                        function=lambda: self.fanout_delivered)
+        metrics.counter('zmq_fanout_exhausted_total', 'Пакеты fanout-рассылки, полученные без оставшихся раундов',
+                        function=lambda: self.fanout_exhausted)
+        metrics.counter('zmq_fanout_fallbacks_total', 'Рассылки по кольцу вместо fanout из-за узлов без её поддержки',
+                        function=lambda: self.fanout_fallbacks)
+        metrics.counter('zmq_payloads_compressed_total', 'Сжатые при отправке payload',
+                        function=lambda: self.codec.compressed)
+        metrics.counter('zmq_compression_saved_bytes_total', 'Байты, сэкономленные сжатием payload',
+                        function=lambda: self.codec.bytes_saved)
+        self._packets_forwarded = metrics.counter('zmq_packets_forwarded_total',
+                                                  'Пакеты, пересланные дальше по кольцу')
+        self._send_failures = metrics.counter('zmq_send_failures_total', 'Пакеты, которые не удалось отправить')
+        self._processing_time = metrics.histogram('zmq_packet_processing_seconds',
+                                                  'Время обработки пакета данных узлом, с')
+
+        links = self.links
+        if links is not None:
+            metrics.counter('zmq_link_retransmits_total', 'Повторно отправленные пакеты надёжных линий',
+                            function=lambda: links.retransmitted)
+            metrics.counter('zmq_link_dropped_total', 'Пакеты, отброшенные при заполненной очереди линии',
+                            function=lambda: links.dropped)
+            metrics.counter('zmq_link_lost_total', 'Пакеты, так и не подтверждённые соседом',
+                            function=lambda: links.lost)
+            metrics.counter('zmq_link_gaps_total', 'Пакеты, принятые после пропуска и отброшенные',
+                            function=lambda: links.gaps)
+            metrics.gauge('zmq_link_in_flight', 'Неподтверждённые пакеты надёжных линий', function=links.in_flight)
+            metrics.gauge('zmq_link_pending', 'Пакеты в очередях надёжных линий', function=links.pending)
+
+    def __accept_link(self, message: ERAPMessage) -> bool:
+        """Подтверждения учитываются линиями, пакеты данных проверяются по номеру на линии.
+        Возвращает True, если пакет нужно обработать дальше
+        """
+
+        if message.msg_type == ACK:
+            self.links.on_ack(self.codec.address(message.source), message)
+            return False
+        if message.msg_type == DATA and message.link_epoch:
+            return self.links.accept(message)
+        return True
+
+    def __accepts_link(self, neighbour: str) -> bool:
+        """Сосед подтверждает пакеты надёжной линии; остальным пакеты отправляются без линии"""
+
+        member = self.membership.get(self.codec.node_or_zero(neighbour))
+        return member is not None and bool(member.capabilities & CAPABILITY_LINK)
+
+    def __service_links(self) -> None:
+        # подтверждения уходят, как только принятые пакеты разобраны, а не после каждого пакета
+        if not self.__has_input():
+            self.links.flush_acks()
+        now = time.monotonic()
+        if now - self._last_link_tick >= self.links.retransmit_timeout / 4:
+            self._last_link_tick = now
+            self.links.tick()
+
+    def __has_input(self) -> bool:
+        return bool(self.consumer_receiver_socket.getsockopt(zmq.EVENTS) & zmq.POLLIN)
+
+    def __receive_credit(self) -> int:
+        """Сколько пакетов можно принять ещё: размер очереди обработчика за вычетом самой длинной очереди"""
+
+        if self.worker_pool is None:
+            return self.worker_queue_size
+        return self.worker_queue_size - max(self.worker_pool.depths())
+
+    def __update_membership(self, update: Callable[..., list], *args) -> list:
+        """Меняет список узлов вызовом update(*args) и переносит изменения в список живых узлов
+        и таблицу маршрутизации, не отпуская блокировку между ними. Возвращает изменения
+        """
+
+        with self._membership_lock:
+            changes = update(*args)
+            self.__apply_membership(changes)
+        return changes
+
+    def __apply_membership(self, changes: list) -> None:
+        """Переносит изменения списка узлов в список живых узлов и таблицу маршрутизации"""
+
+        if not changes:
+            return
+
+        alive = [member.node for member in changes if member.alive]
+        gone = [member.node for member in changes if not member.alive]
+        self.members.add(alive, self.codec.address)
+        for node in gone:
+            self.members.remove(node)
+        if alive:
+            self.routing_table.add(alive)
+        for node in gone:
+            self.routing_table.remove(node)
+
+    def __next_seq(self) -> int:
+        return next(self._sequence) % 0xFFFFFFFF + 1
+
+    def __is_binary(self, neighbour: str) -> bool:
+        return self.wire_format == 'auto' and self._peer_wire.get(neighbour) == WIRE_VERSION
+
+    def __encode(self, message: ERAPMessage, neighbour: str) -> list:
+        return self.codec.encode(message, self.__is_binary(neighbour), neighbour in self._peer_compression)
+
+    def __identify_addressee(self, message: ERAPMessage) -> str or None:
+        from_node = message.sender_neighbour
+
+        if from_node in self.routing_table:
+            addressed_node = self.routing_table.next_hop(from_node)
+            if addressed_node is None:
+                return None
+
+            return self.codec.address(addressed_node)
+
+        from_address = self.codec.address(from_node) if from_node else None
+        if from_address in self.neighbors:
             for neighbour in self.neighbors:
-                if neighbour != packet.get('from'):
-                    return packet.get('from')
-
-    def __change_packet(self, addressee: str, packet: dict):
-        return packet.update({'from': self.host_ip, 'to': addressee})
+                if neighbour != from_address:
+                    return from_address
 
     # --------------------получение всех узлов--------------------
     def get_all_node(self) -> dict:
-        self.nodes_dict = self.__sorted_dict(self.nodes_dict)
-
-        return self.nodes_dict
+        """Живые узлы кольца {номер: SenderNode} по возрастанию номеров"""
 
-    @staticmethod
-    def __sorted_dict(unsorted_dict: dict) -> dict:
-        return dict(sorted(unsorted_dict.items(), key=lambda x: x[0]))
+        return self.members.as_dict(self.SenderNode)
 
     def set_nodes_dict(self, nodes: list):
-        """Проходим по пакету и если там есть ключ sender_address, то добавляем номер узла и значение sender_address в очередь"""
-
-        for node in nodes:
-            self.nodes_dict.update({
-                node: self.SenderNode(
-                    address=f'10.20.{node}.1',
-                    live_time=get_unix_time()
-                )
-            })
+        """Добавляет в список узлов кольца узлы nodes, о которых узнали из пакета или от соседей.
+        Изменения записываются только для новых узлов и дальше расходятся по кольцу через gossip
+        """
+
+        self.__update_membership(self.membership.observe, nodes)
+
+    def snapshot_members(self) -> list:
+        """Записи списка узлов (node, incarnation, alive, seen_at) для снимка, seen_at - unix-время, когда узел
+        последний раз подавал признаки жизни, у ушедших - 0
+        """
+
+        offset = time.time() - self.members.clock()
+        entries = []
+        for node, incarnation, alive in self.membership.snapshot():
+            record = self.members.get(node)
+            entries.append((node, incarnation, alive, record.refreshed_at + offset if record is not None else 0))
+        return entries
+
+    def restore_members(self, members: list, seen_at: dict = None) -> None:
+        """Сливает записи списка узлов из снимка. Запись о самом узле пропускается - после перезапуска
+        у него новое воплощение, а устаревшие записи других узлов вытеснит gossip с более новыми.
+        seen_at - {узел: unix-время последнего признака жизни} из снимка: живые узлы, о которых дольше
+        member_ttl ничего не слышно, не восстанавливаются, а срок остальных отсчитывается от seen_at,
+        так что не ответивший после перезапуска узел истечёт сам, если его не продлит gossip
+        """
+
+        seen_at = seen_at or {}
+        ttl = self.members.ttl
+        now = time.time()
+        if ttl is not None:
+            members = [member for member in members
+                       if not member.alive or member.node not in seen_at or now - seen_at[member.node] <= ttl]
+
+        offset = self.members.clock() - now
+        with self._membership_lock:
+            changes = self.__update_membership(self.membership.merge, [(member.node, member.incarnation, member.alive)
+                                                                       for member in members
+                                                                       if member.node != self.my_node])
+            for member in changes:
+                if member.alive and seen_at.get(member.node):
+                    self.members.backdate(member.node, seen_at[member.node] + offset)
+
+    def remove_node(self, node: int) -> None:
+        """Отмечает ушедший узел node в списке узлов, удаляя его из живых узлов и таблицы маршрутизации"""
+
+        self.__update_membership(self.membership.declare_dead, node)
+
+    def expire_members(self) -> list:
+        """Отмечает ушедшими узлы, от которых дольше member_ttl не было ни пакетов, ни записей gossip,
+        и возвращает их номера
+        """
+
+        with self._membership_lock:
+            expired = self.members.expire()
+            for node in expired:
+                self.__update_membership(self.membership.declare_dead, node)
+        return expired
+
+    def announce_alive(self) -> None:
+        """Объявляет себя живым новым воплощением, чтобы записи о себе у других узлов не истекли"""
+
+        self.__update_membership(self.membership.refresh)
@@ -0,0 +1,63 @@
+import pytest
+
+from src.address_plan import AddressPlan, CidrAddressPlan, TableAddressPlan, DEFAULT_ADDRESS_PLAN
+from src.discovery import NeighbourDiscovery
+
+
+class TestAddressPlan:
+
+    def test_plan_must_implement_both_directions(self):
+        class AddressesOnly(AddressPlan):
+            def address_of(self, node: int) -> str:
+                return f'10.0.0.{node}'
+
+        with pytest.raises(TypeError):
+            AddressesOnly()
+
+
+class TestCidrAddressPlan:
+
+    def test_default_plan_keeps_legacy_addresses(self):
+        assert DEFAULT_ADDRESS_PLAN.address_of(17) == '10.20.17.1'
+        assert DEFAULT_ADDRESS_PLAN.node_of('10.20.17.1') == 17
+        assert DEFAULT_ADDRESS_PLAN.max_node == 255
+
+    def test_dense_plan_has_more_than_255_nodes(self):
+        plan = CidrAddressPlan('10.0.0.0/16', stride=1, offset=0)
+
+        assert plan.max_node == 65534
+        assert plan.address_of(300) == '10.0.1.44'
+        assert all(plan.node_of(plan.address_of(node)) == node for node in (1, 255, 256, 4097, 65534))
+
+    @pytest.mark.parametrize('address', ['10.20.17.2', '10.21.1.1', '10.20.0.1', 'not an address'])
+    def test_address_outside_plan_is_rejected(self, address):
+        assert not DEFAULT_ADDRESS_PLAN.contains(address)
+        with pytest.raises(ValueError):
+            DEFAULT_ADDRESS_PLAN.node_of(address)
+
+    def test_node_outside_plan_is_rejected(self):
+        with pytest.raises(ValueError):
+            DEFAULT_ADDRESS_PLAN.address_of(256)
+
+
+class TestTableAddressPlan:
+
+    def test_table_maps_both_ways_in_ring_order(self):
+        plan = TableAddressPlan({'700': '192.168.1.7', 3: '192.168.1.3', 1000: '172.16.0.1'})
+
+        assert plan.nodes() == (3, 700, 1000)
+        assert plan.node_of('172.16.0.1') == 1000
+        assert plan.address_of(700) == '192.168.1.7'
+        with pytest.raises(ValueError):
+            plan.node_of('192.168.1.8')
+
+    def test_duplicate_addresses_are_rejected(self):
+        with pytest.raises(ValueError):
+            TableAddressPlan({1: '192.168.1.1', 2: '192.168.1.1'})
+
+    def test_discovery_walks_table_nodes_in_ring_order(self):
+        plan = TableAddressPlan({node: f'127.0.{node // 256}.{node % 256}' for node in (3, 700, 1000, 4000)})
+        discovery = NeighbourDiscovery(node_id=1000, port=1, address_of=plan.address_of, nodes=plan.nodes())
+
+        assert discovery._NeighbourDiscovery__ring_order(step=1) == [4000, 3, 700]
+        assert discovery._NeighbourDiscovery__ring_order(step=-1) == [700, 3, 4000]
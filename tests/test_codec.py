@@ -0,0 +1,221 @@
+import json
+import hashlib
+
+import zmq
+import pytest
+
+from src.compression import dictionary
+from src.codec import PacketCodec, ERAPMessage, CodecError, HEADER, WIRE_VERSION, DATA, HEARTBEAT, GOSSIP, ACK, LINK_GAP, \
+    COMPRESSED, ACCEPTS_COMPRESSED, HAS_FANOUT
+
+
+class TestPacketCodec:
+
+    def test_binary_roundtrip_keeps_packet(self):
+        codec = PacketCodec()
+        packet = {'command': 'reboot', 'message': {'delay': 5}, 'sender_node': 3,
+                  'from': '10.20.3.1', 'to': '10.20.4.1', 'nodes_in_network': [3, 4, 250]}
+
+        frames = codec.encode(codec.to_message(packet), binary=True)
+        assert len(frames) == 2
+        assert frames[0][0] == 0xEA
+
+        message, wire_version = codec.decode(frames)
+        assert wire_version == WIRE_VERSION
+        assert message.has_command
+        assert codec.to_packet(message) == packet
+
+    def test_header_carries_integer_node_ids(self):
+        codec = PacketCodec()
+        message = codec.to_message({'sender_node': 7, 'from': '10.20.7.1', 'to': '10.20.9.1', 'seq': 42})
+        frames = codec.encode(message, binary=True)
+
+        assert frames == [HEADER.pack(0xEA, WIRE_VERSION, 0, 0, 7, 7, 9, 0, 42)]
+        assert codec.unpack(frames) == ERAPMessage(source=7, sender_neighbour=7, addressee=9, seq=42)
+
+    def test_heartbeat_roundtrip(self):
+        codec = PacketCodec()
+        heartbeat = ERAPMessage(source=12, sender_neighbour=0, addressee=0, msg_type=HEARTBEAT)
+
+        for binary in (True, False):
+            message, wire_version = codec.decode(codec.encode(heartbeat, binary=binary))
+            assert (message.msg_type, message.source, wire_version) == (HEARTBEAT, 12, WIRE_VERSION)
+
+    def test_forwarding_rewrites_header_and_passes_payload_frame_through(self):
+        codec = PacketCodec()
+        context = zmq.Context()
+        receiver = context.socket(zmq.PULL)
+        port = receiver.bind_to_random_port('tcp://127.0.0.1')
+        sender = context.socket(zmq.PUSH)
+        sender.connect(f'tcp://127.0.0.1:{port}')
+
+        packet = {'command': 'telemetry', 'message': 'x' * 100000, 'sender_node': 3, 'from': '10.20.3.1'}
+        sender.send_multipart(codec.encode(codec.to_message(packet), binary=True))
+        frames = receiver.recv_multipart(copy=False)
+        message, _ = codec.decode([frames[0].bytes, *frames[1:]])
+
+        message.sender_neighbour, message.addressee = 4, 5
+        forwarded = codec.encode(message, binary=True)
+        assert forwarded[1] is frames[1]
+        assert message._body is None
+
+        sender.send_multipart(forwarded, copy=False)
+        message, _ = codec.decode(receiver.recv_multipart())
+        assert codec.to_packet(message) == dict(packet, **{'from': '10.20.4.1', 'to': '10.20.5.1'})
+
+        sender.close()
+        receiver.close()
+        context.term()
+
+    def test_json_packet_advertises_version_of_sending_neighbour(self):
+        codec = PacketCodec()
+        packet = {'event': 'neighbour_gone', 'from': '10.20.5.1', 'to': '10.20.6.1'}
+        message, wire_version = codec.decode(codec.encode(codec.to_message(packet), binary=False))
+
+        assert wire_version == WIRE_VERSION
+        assert codec.to_packet(message) == packet
+
+    def test_advertisement_forwarded_by_old_node_is_ignored(self):
+        codec = PacketCodec()
+        frames = codec.encode(codec.to_message({'command': 'x', 'from': '10.20.5.1', 'to': '10.20.6.1'}),
+                              binary=False)
+
+        # старый узел 6 переслал пакет дальше, поменяв только from и to
+        forwarded = json.loads(frames[0])
+        forwarded.update({'from': '10.20.6.1', 'to': '10.20.7.1'})
+        message, wire_version = codec.decode([json.dumps(forwarded).encode()])
+
+        assert wire_version == 0
+        assert 'wire' not in codec.to_packet(message)
+
+    def test_plain_json_from_old_node(self):
+        codec = PacketCodec()
+        packet = {'nodes_in_network': [1, 2], 'sender_node': 1, 'from': '10.20.1.1', 'to': '10.20.2.1'}
+        message, wire_version = codec.decode([json.dumps(packet).encode()])
+
+        assert wire_version == 0
+        assert codec.to_packet(message) == packet
+
+    def test_gossip_roundtrip(self):
+        codec = PacketCodec()
+        gossip = ERAPMessage(source=12, sender_neighbour=0, addressee=0, msg_type=GOSSIP,
+                             _body={'d': 2 ** 63 + 5, 'm': [[12, 1700000000, 1], [13, 0, 0]]})
+
+        for binary in (True, False):
+            message, _ = codec.decode(codec.encode(gossip, binary=binary))
+            assert (message.msg_type, message.source) == (GOSSIP, 12)
+            assert message.body() == gossip.body()
+
+    def test_target_survives_binary_and_json(self):
+        codec = PacketCodec()
+        packet = {'command': 'reboot', 'message': {}, 'sender_node': 3, 'target': 77,
+                  'from': '10.20.3.1', 'to': '10.20.4.1', 'nodes_in_network': [3, 4]}
+
+        for binary in (True, False):
+            message, _ = codec.decode(codec.encode(codec.to_message(packet), binary=binary))
+            assert message.target == 77
+            assert codec.to_packet(message) == packet
+
+    def test_mixed_version_peers_fall_back_to_json(self):
+        codec = PacketCodec()
+        old_binary = [HEADER.pack(0xEA, WIRE_VERSION - 1, 0, 0, 3, 3, 4, 0, 42)]
+        with pytest.raises(CodecError):
+            codec.decode(old_binary)
+
+        # json от соседа предыдущей версии разбирается, и версия соседа запоминается, чтобы отвечать ему json
+        packet = {'command': 'x', 'message': 1, 'sender_node': 3, 'from': '10.20.3.1', 'to': '10.20.4.1',
+                  'seq': 42, 'fanout': [2, 9]}
+        message, wire_version = codec.decode([json.dumps(dict(packet, wire=[WIRE_VERSION - 1, 3])).encode()])
+        assert wire_version == WIRE_VERSION - 1
+        assert (message.seq, message.rounds, message.fanout_limit) == (42, 2, 9)
+        assert codec.to_packet(message) == packet
+
+    def test_mqtt_payload_with_reserved_keys_stays_data(self):
+        codec = PacketCodec()
+        payload = {'command': 'x', 'message': 1, 'gossip': {'d': 1}, 'heartbeat': 5, 'ack': 'yes',
+                   'link': 'eth0', 'fanout': None, 'seq': 'abc', 'target': 'all', 'sender_node': 'me',
+                   'from': 'mqtt', 'to': 'ring', 'nodes_in_network': 3, 'wire': 1, 'body': []}
+        message = codec.data_message(payload, source=3, seq=42, target=9)
+
+        for binary in (True, False):
+            received, _ = codec.decode(codec.encode(message, binary=binary))
+            assert received.msg_type == DATA
+            assert (received.source, received.seq, received.target) == (3, 42, 9)
+            assert received.has_command
+            assert received.body() == payload
+
+    def test_link_fields_and_ack_roundtrip(self):
+        codec = PacketCodec()
+        packet = {'command': 'x', 'message': 1, 'sender_node': 3, 'from': '10.20.3.1', 'target': 9,
+                  'link': [77, 5, 4]}
+        ack = ERAPMessage(source=4, sender_neighbour=0, addressee=0, msg_type=ACK, flags=LINK_GAP,
+                          link_epoch=77, link_seq=4, link_info=100)
+
+        for binary in (True, False):
+            assert codec.to_packet(codec.decode(codec.encode(codec.to_message(packet), binary=binary))[0]) == packet
+            message = codec.decode(codec.encode(ack, binary=binary))[0]
+            assert (message.msg_type, message.flags & LINK_GAP, message.link_epoch, message.link_seq,
+                    message.link_info) == (ACK, LINK_GAP, 77, 4, 100)
+
+    def test_compressed_payload_is_forwarded_as_is_and_decompressed_for_plain_neighbour(self):
+        codec = PacketCodec(compression_threshold=256)
+        packet = {'command': 'telemetry', 'message': {'nodes': list(range(1, 200))}, 'sender_node': 3,
+                  'from': '10.20.3.1'}
+        frames = codec.encode(codec.to_message(packet), binary=True, compress_payload=True)
+        header = HEADER.unpack_from(frames[0])
+        assert header[3] & COMPRESSED and header[3] & ACCEPTS_COMPRESSED
+        assert len(frames[1]) < len(json.dumps(packet['message']))
+
+        message, _ = codec.decode(frames)
+        assert codec.to_packet(message) == packet
+        message.sender_neighbour, message.addressee = 4, 5
+        assert codec.encode(message, binary=True, compress_payload=True)[1] is frames[1]
+
+        plain = codec.encode(message, binary=True)
+        assert not HEADER.unpack_from(plain[0])[3] & COMPRESSED
+        assert codec.to_packet(codec.decode(plain)[0]) == dict(packet, **{'from': '10.20.4.1', 'to': '10.20.5.1'})
+
+    def test_small_payload_and_codec_without_compression_stay_plain(self):
+        packet = {'command': 'update', 'message': {}, 'sender_node': 3, 'from': '10.20.3.1'}
+        frames = PacketCodec(compression_threshold=256).encode(PacketCodec().to_message(packet), binary=True,
+                                                               compress_payload=True)
+        assert HEADER.unpack_from(frames[0])[3] & (COMPRESSED | ACCEPTS_COMPRESSED) == ACCEPTS_COMPRESSED
+
+        frames = PacketCodec().encode(PacketCodec().to_message(dict(packet, message='x' * 1000)), binary=True,
+                                      compress_payload=True)
+        assert not HEADER.unpack_from(frames[0])[3] & (COMPRESSED | ACCEPTS_COMPRESSED)
+
+    def test_compression_dictionary_is_pinned(self):
+        # словарь - часть формата пакета: новый словарь требует новой версии WIRE_VERSION и этого хэша
+        assert hashlib.sha256(dictionary()).hexdigest() == \
+            '9910bf1ce8641820cefd5373c903ffe7f97f596e5497d999e82e56d49a69ea28'
+
+    def test_damaged_compressed_payload_raises_codec_error(self):
+        message = PacketCodec().unpack([HEADER.pack(0xEA, WIRE_VERSION, 0, COMPRESSED | 0x01, 3, 0, 0, 0, 1),
+                                        b'\xff\x00garbage'])
+        with pytest.raises(CodecError):
+            message.body()
+
+    @pytest.mark.parametrize('payload', [b'not json', b'[1, 2]'])
+    def test_payload_that_is_not_json_object_raises_codec_error(self, payload):
+        message = PacketCodec().unpack([HEADER.pack(0xEA, WIRE_VERSION, GOSSIP, 0x01, 3, 0, 0, 0, 0), payload])
+        with pytest.raises(CodecError):
+            message.body()
+
+    @pytest.mark.parametrize('packet', [b'{"ack": 5, "sender_node": 3}', b'{"ack": [1, 2], "sender_node": 3}',
+                                        b'{"gossip": [1], "sender_node": 3}', b'{"body": 7, "sender_node": 3}',
+                                        b'{"command": "x", "link": 1}', b'{"command": "x", "wire": 5}',
+                                        b'{"heartbeat": 3', b'[1, 2]'])
+    def test_malformed_json_packet_raises_codec_error(self, packet):
+        with pytest.raises(CodecError):
+            PacketCodec().decode([packet])
+
+    def test_fanout_fields_survive_binary_and_json(self):
+        codec = PacketCodec()
+        packet = {'command': 'x', 'message': 1, 'sender_node': 3, 'from': '10.20.3.1', 'seq': 8,
+                  'link': [77, 5, 4], 'fanout': [0, 120]}
+
+        for binary in (True, False):
+            message = codec.decode(codec.encode(codec.to_message(packet), binary=binary))[0]
+            assert message.flags & HAS_FANOUT and (message.rounds, message.fanout_limit) == (0, 120)
+            assert codec.to_packet(message) == packet
@@ -0,0 +1,65 @@
+import asyncio
+import socket
+
+from src.discovery import NeighbourDiscovery
+
+
+def loopback_address(node: int) -> str:
+    return f'127.0.{node}.1'
+
+
+def start_listeners(nodes: list) -> tuple:
+    listeners = []
+    port = 0
+    for node in nodes:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((loopback_address(node), port))
+        listener.listen(16)
+        port = listener.getsockname()[1]
+        listeners.append(listener)
+
+    return port, listeners
+
+
+class TestNeighbourDiscovery:
+
+    def test_finds_nearest_neighbours_in_both_directions(self):
+        port, listeners = start_listeners([3, 10, 200])
+        try:
+            discovery = NeighbourDiscovery(node_id=5, port=port, address_of=loopback_address)
+            assert discovery.find_neighbors() == ('127.0.3.1', '127.0.10.1')
+
+            discovery = NeighbourDiscovery(node_id=201, port=port, address_of=loopback_address)
+            assert discovery.find_neighbors() == ('127.0.200.1', '127.0.3.1')
+        finally:
+            for listener in listeners:
+                listener.close()
+
+    def test_single_other_node_is_both_neighbours(self):
+        port, listeners = start_listeners([7])
+        try:
+            discovery = NeighbourDiscovery(node_id=1, port=port, address_of=loopback_address)
+            assert discovery.find_neighbors() == ('127.0.7.1', '127.0.7.1')
+        finally:
+            for listener in listeners:
+                listener.close()
+
+    def test_probe_returns_alive_nodes(self):
+        port, listeners = start_listeners([4, 6])
+        try:
+            discovery = NeighbourDiscovery(node_id=5, port=port, address_of=loopback_address)
+            assert discovery.probe([4, 5, 6, 8]) == {4, 6}
+        finally:
+            for listener in listeners:
+                listener.close()
+
+    def test_async_search_matches_sync_search(self):
+        port, listeners = start_listeners([3, 10, 200])
+        try:
+            discovery = NeighbourDiscovery(node_id=5, port=port, address_of=loopback_address)
+            assert asyncio.run(discovery.find_neighbors_async()) == ('127.0.3.1', '127.0.10.1')
+            assert asyncio.run(discovery.probe_async([3, 4, 5, 10])) == {3, 10}
+        finally:
+            for listener in listeners:
+                listener.close()
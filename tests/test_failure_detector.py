@@ -0,0 +1,86 @@
+from src.failure_detector import PhiAccrualFailureDetector
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def regular_heartbeats(detector: PhiAccrualFailureDetector, clock: FakeClock, node: int, count: int) -> None:
+    for _ in range(count):
+        clock.now += 0.1
+        detector.heartbeat(node)
+
+
+class TestPhiAccrualFailureDetector:
+
+    def test_regular_heartbeats_are_not_suspected(self):
+        clock = FakeClock()
+        detector = PhiAccrualFailureDetector(heartbeat_interval=0.1, clock=clock)
+        detector.watch([2])
+        regular_heartbeats(detector, clock, 2, 50)
+
+        assert detector.check() == ()
+        assert detector.phi(2) < 1
+
+    def test_silent_node_is_suspected_within_bound(self):
+        clock = FakeClock()
+        detector = PhiAccrualFailureDetector(heartbeat_interval=0.1, max_silence=1.0, clock=clock)
+        detector.watch([2])
+        regular_heartbeats(detector, clock, 2, 50)
+
+        suspected_at = None
+        while suspected_at is None:
+            clock.now += 0.01
+            if detector.check() == (2,):
+                suspected_at = clock.now
+
+        assert detector.stats()['detection_latency_max'] < 1.0
+        assert detector.check() == ()
+
+    def test_max_silence_bounds_detection_for_never_heard_node(self):
+        clock = FakeClock()
+        detector = PhiAccrualFailureDetector(heartbeat_interval=0.1, threshold=1000, max_silence=0.5, clock=clock)
+        detector.watch([3])
+
+        clock.now = 0.49
+        assert detector.check() == ()
+        clock.now = 0.5
+        assert detector.check() == (3,)
+
+    def test_refuted_suspicion_counts_as_false_positive(self):
+        clock = FakeClock()
+        detector = PhiAccrualFailureDetector(heartbeat_interval=0.1, max_silence=0.5, clock=clock)
+        detector.watch([2])
+        clock.now = 0.6
+        assert detector.check() == (2,)
+
+        detector.heartbeat(2)
+        assert detector.drain_arrivals() == {2}
+        assert detector.drain_arrivals() == set()
+        assert detector.stats()['false_positive_rate'] == 1.0
+
+    def test_refute_clears_suspicion_and_restarts_silence(self):
+        clock = FakeClock()
+        detector = PhiAccrualFailureDetector(heartbeat_interval=0.1, threshold=1000, max_silence=0.5, clock=clock)
+        detector.watch([2, 3])
+        clock.now = 0.6
+        assert detector.check() == (2, 3)
+
+        detector.refute(2)
+        detector.refute(4)
+        assert detector.stats()['false_positives'] == 1
+        clock.now = 1.0
+        assert detector.check() == ()
+        clock.now = 1.1
+        assert detector.check() == (2,)
+
+    def test_unknown_node_heartbeat_is_reported_as_arrival(self):
+        detector = PhiAccrualFailureDetector(clock=FakeClock())
+        detector.heartbeat(7)
+        detector.heartbeat(7)
+
+        assert detector.drain_arrivals() == {7}
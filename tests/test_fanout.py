@@ -0,0 +1,150 @@
+import random
+
+from collections import Counter, deque
+
+from src.codec import PacketCodec, HAS_FANOUT, CAPABILITY_FANOUT, CAPABILITY_LINK
+from src.zmq_pipeline import ZmqPipelineNode
+
+
+class RecordingMqtt:
+
+    def __init__(self):
+        self.published = []
+
+    def send_message_on_mqtt(self, message: dict) -> bool:
+        self.published.append(message)
+        return True
+
+
+class InMemoryRing:
+    """Конвейеры узлов без сокетов: отправленные кадры складываются в очередь и доставляются по одному"""
+
+    def __init__(self, node_ids: list, **settings):
+        self.pipelines = {}
+        self.mqtt = {}
+        self.queue = deque()
+        for node in node_ids:
+            pipeline = ZmqPipelineNode(zmq_port=5555, host_ip=f'10.20.{node}.1', neighbors=[], **settings)
+            pipeline.set_nodes_dict(node_ids)
+            pipeline.sender_pool.send = lambda addressee, frames: self.queue.append((addressee, frames)) or True
+            if pipeline.links is not None:
+                pipeline.links._send = pipeline.sender_pool.send
+            self.pipelines[node] = pipeline
+            self.mqtt[node] = RecordingMqtt()
+        # записи узлов с их возможностями - то, что иначе разнёс бы по кольцу gossip
+        records = [pipeline.membership.get(node) for node, pipeline in self.pipelines.items()]
+        for pipeline in self.pipelines.values():
+            pipeline.membership.merge([record[:3] for record in records], [record.capabilities for record in records])
+
+    def deliver(self) -> Counter:
+        """Доставляет все пакеты и возвращает, сколько копий получил каждый узел"""
+
+        copies = Counter()
+        while self.queue:
+            addressee, frames = self.queue.popleft()
+            node = int(addressee.split('.')[2])
+            pipeline = self.pipelines[node]
+            pipeline.handle_message(pipeline.read_message([FrameStub(frames[0]), *frames[1:]]), self.mqtt[node])
+            copies[node] += 1
+        return copies
+
+    def reached(self, command: str) -> set:
+        return {node for node, mqtt in self.mqtt.items()
+                if any(message.get('command') == command for message in mqtt.published)}
+
+
+class FrameStub(bytes):
+
+    @property
+    def bytes(self) -> bytes:
+        return self
+
+
+class TestFanoutBroadcast:
+
+    def test_structured_fanout_reaches_every_node_once_in_logarithmic_rounds(self):
+        node_ids = sorted(random.Random(3).sample(range(1, 255), 100))
+        ring = InMemoryRing(node_ids, broadcast_mode='fanout', fanout=3)
+        origin = ring.pipelines[node_ids[10]]
+        origin.broadcast({'command': 'update', 'message': {}})
+
+        copies = ring.deliver()
+        assert ring.reached('update') == set(node_ids) - {node_ids[10]}
+        assert set(copies.values()) == {1}
+        assert sum(pipeline.fanout_exhausted for pipeline in ring.pipelines.values()) == 0
+
+    def test_mqtt_payload_with_reserved_keys_is_delivered_as_data(self):
+        ring = InMemoryRing([1, 2, 3], broadcast_mode='fanout', fanout=2)
+        payload = {'command': 'update', 'message': {}, 'gossip': 1, 'heartbeat': 2, 'ack': 3, 'link': 4,
+                   'fanout': 5, 'seq': 6, 'target': 7}
+        ring.pipelines[1].broadcast(dict(payload))
+        ring.deliver()
+
+        for node in (2, 3):
+            [published] = ring.mqtt[node].published
+            assert published['body'] == payload
+            assert published['sender_node'] == 1
+
+    def test_too_few_rounds_are_counted_as_exhausted(self):
+        node_ids = list(range(1, 41))
+        ring = InMemoryRing(node_ids, broadcast_mode='fanout', fanout=2, fanout_rounds=2)
+        ring.pipelines[1].broadcast({'command': 'update', 'message': {}})
+        ring.deliver()
+
+        assert len(ring.reached('update')) == 6
+        assert sum(pipeline.fanout_exhausted for pipeline in ring.pipelines.values()) == 4
+
+    def test_random_fanout_drops_repeated_copies(self):
+        random.seed(5)
+        node_ids = list(range(1, 61))
+        ring = InMemoryRing(node_ids, broadcast_mode='fanout', fanout_peers='random', fanout=6)
+        ring.pipelines[1].broadcast({'command': 'update', 'message': {}})
+        ring.deliver()
+
+        published = Counter(node for node, mqtt in ring.mqtt.items() for _ in mqtt.published)
+        assert len(ring.reached('update')) >= 55
+        assert set(published.values()) == {1}
+        assert sum(pipeline.duplicates_dropped for pipeline in ring.pipelines.values()) > 0
+
+    def test_ring_mode_still_sends_to_neighbours(self):
+        ring = InMemoryRing([1, 2, 3])
+        ring.pipelines[2].neighbors = ['10.20.1.1', '10.20.3.1']
+        ring.pipelines[2].broadcast({'command': 'update', 'message': {}})
+
+        assert [addressee for addressee, _ in ring.queue] == ['10.20.1.1', '10.20.3.1']
+
+
+class TestMixedVersionRing:
+
+    def test_broadcast_falls_back_to_ring_while_a_member_lacks_fanout(self):
+        ring = InMemoryRing([1, 2, 3], broadcast_mode='fanout', fanout=2)
+        origin = ring.pipelines[2]
+        origin.neighbors = ['10.20.1.1', '10.20.3.1']
+        # узел 3 перезапустился старой версией и прислал запись без возможностей
+        restarted = [[3, origin.membership.get(3).incarnation + 1, 1]]
+        origin.membership.merge(restarted)
+        origin.broadcast({'command': 'update', 'message': {}})
+
+        assert origin.fanout_fallbacks == 1
+        frames = [frames for _, frames in ring.queue]
+        assert not any(PacketCodec().decode(frame)[0].flags & HAS_FANOUT for frame in frames)
+
+        ring.queue.clear()
+        origin.membership.merge(restarted, [CAPABILITY_FANOUT])
+        origin.broadcast({'command': 'update', 'message': {}})
+        assert origin.fanout_fallbacks == 1
+        assert all(PacketCodec().decode(frames)[0].flags & HAS_FANOUT for _, frames in ring.queue)
+
+    def test_reliable_link_only_to_neighbour_that_acknowledges(self):
+        ring = InMemoryRing([1, 2], link_mode='reliable')
+        origin = ring.pipelines[1]
+        origin.neighbors = ['10.20.2.1']
+        # пока о возможностях соседа ничего не известно, пакеты идут ему без линии
+        restarted = [[2, origin.membership.get(2).incarnation + 1, 1]]
+        origin.membership.merge(restarted)
+        origin.broadcast({'command': 'update', 'message': {}})
+        assert PacketCodec().decode(ring.queue.popleft()[1])[0].link_epoch == 0
+
+        origin.membership.merge(restarted, [CAPABILITY_FANOUT | CAPABILITY_LINK])
+        origin.broadcast({'command': 'update', 'message': {}})
+        assert PacketCodec().decode(ring.queue.popleft()[1])[0].link_epoch != 0
@@ -0,0 +1,78 @@
+import sys
+import time
+
+import pytest
+from loguru import logger
+
+from src import logging_config
+from src.logging_config import configure_logging, get_logger, is_enabled, parse_levels, QueuedSink, RateLimitedLogger
+
+
+@pytest.fixture
+def messages():
+    written = []
+    yield written
+    logging_config.shutdown_logging()
+    logger.remove()
+    logger.add(sys.stderr)
+    logging_config.settings.__init__()
+
+
+class TestLoggingConfig:
+
+    def test_category_levels_filter_messages(self, messages):
+        configure_logging(levels={'mqtt': 'WARNING'}, sink=messages.append, log_format='{message}')
+
+        get_logger('mqtt').info('скрыто')
+        get_logger('mqtt').warning('видно')
+        get_logger('node').debug('тоже видно')
+
+        assert [message.strip() for message in messages] == ['видно', 'тоже видно']
+
+    def test_packet_arguments_are_not_evaluated_when_level_disabled(self, messages):
+        configure_logging(levels={'packets': 'WARNING'}, sink=messages.append, log_format='{message}')
+        calls = []
+
+        RateLimitedLogger('packets').info('Получил: {}', lambda: calls.append(1))
+
+        assert calls == [] and messages == []
+
+    def test_is_enabled_follows_category_level(self, messages):
+        configure_logging(levels={'node': 'INFO', 'packets': 'DEBUG'}, sink=messages.append, log_format='{message}')
+
+        assert not is_enabled('node', 'DEBUG')
+        assert is_enabled('node', 'INFO')
+        assert is_enabled('packets', 'DEBUG')
+
+    def test_packet_logging_is_rate_limited_and_reports_suppressed(self, messages):
+        configure_logging(sink=messages.append, log_format='{message}', packet_rate=2)
+        packet_logger = RateLimitedLogger('packets')
+
+        for number in range(10):
+            packet_logger.info('пакет {}', lambda: number)
+        time.sleep(0.6)
+        packet_logger.info('пакет {}', lambda: 'последний')
+
+        assert [message.strip() for message in messages] == ['пакет 0', 'пакет 1', 'пакет последний [пропущено 8]']
+
+    def test_sampling_keeps_every_nth_message(self, messages):
+        configure_logging(sink=messages.append, log_format='{message}', packet_rate=0, packet_sample_every=3)
+        packet_logger = RateLimitedLogger('packets')
+
+        for number in range(1, 7):
+            packet_logger.info('пакет {}', lambda: number)
+
+        assert [message.strip().split(' [')[0] for message in messages] == ['пакет 3', 'пакет 6']
+
+    def test_queued_sink_drops_instead_of_blocking(self):
+        sink = QueuedSink(stream=sys.stderr, max_size=2)
+
+        for number in range(5):
+            sink(f'{number}\n')
+
+        assert sink.dropped == 3
+
+    def test_parse_levels(self):
+        assert parse_levels('packets=debug, mqtt=WARNING') == {'packets': 'DEBUG', 'mqtt': 'WARNING'}
+        with pytest.raises(ValueError):
+            parse_levels('packets=LOUD')
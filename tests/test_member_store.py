@@ -0,0 +1,145 @@
+import threading
+
+from src.membership import Member
+from src.member_store import MemberStore, TimingWheel
+from src.zmq_pipeline import ZmqPipelineNode
+
+
+class FakeClock:
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def address_of(node: int) -> str:
+    return f'10.20.{node}.1'
+
+
+class TestMemberStore:
+
+    def test_nodes_stay_sorted_on_insert_and_remove(self):
+        store = MemberStore(my_node=5)
+        store.add([40, 5, 17, 200, 3], address_of)
+        store.add([17, 1], address_of)
+        assert list(store.nodes()) == [1, 3, 5, 17, 40, 200]
+
+        assert store.remove(17)
+        assert not store.remove(17)
+        assert list(store.nodes()) == [1, 3, 5, 40, 200]
+        assert 17 not in store and 40 in store
+        assert store.get(40).address == '10.20.40.1'
+
+    def test_record_expires_after_ttl_unless_refreshed(self):
+        clock = FakeClock()
+        store = MemberStore(my_node=5, ttl=10, wheel_slots=16, clock=clock)
+        store.add([5, 17, 40], address_of)
+
+        clock.now += 6
+        store.refresh(17)
+        assert store.expire() == []
+
+        clock.now += 6
+        assert store.expire() == [40]
+        assert list(store.nodes()) == [5, 17]
+
+        clock.now += 6
+        assert store.expire() == [17]
+        # запись о самом узле не истекает
+        clock.now += 1000
+        assert store.expire() == []
+        assert list(store.nodes()) == [5]
+        assert store.stats() == {'size': 1, 'expired': 2, 'wheel': 0}
+
+    def test_node_removed_and_added_again_expires_once_by_new_deadline(self):
+        clock = FakeClock()
+        store = MemberStore(my_node=5, ttl=10, wheel_slots=16, clock=clock)
+        store.add([40], address_of)
+
+        clock.now += 5
+        store.remove(40)
+        store.add([40], address_of)
+        assert store.stats()['wheel'] == 2
+
+        clock.now += 6
+        assert store.expire() == []
+        assert 40 in store
+        store.remove(40)
+        store.add([40], address_of)
+        # все три записи колеса разбираются в одном продвижении, но узел истекает один раз
+        clock.now += 20
+        assert store.expire() == [40]
+        assert store.stats() == {'size': 0, 'expired': 1, 'wheel': 0}
+
+    def test_dict_view_is_rebuilt_only_after_membership_changes(self):
+        store = MemberStore(my_node=5)
+        store.add([17, 5], address_of)
+        view = store.as_dict(ZmqPipelineNode.SenderNode)
+        assert list(view) == [5, 17]
+        assert view[17].address == '10.20.17.1'
+
+        store.add([17], address_of)
+        assert store.as_dict(ZmqPipelineNode.SenderNode) is view
+        store.remove(17)
+        assert list(store.as_dict(ZmqPipelineNode.SenderNode)) == [5]
+
+
+class TestTimingWheel:
+
+    def test_deadline_beyond_one_turn_is_rescheduled(self):
+        wheel = TimingWheel(tick=1, slots=4, start=0)
+        deadlines = {'a': 2.5, 'b': 9.5}
+        wheel.schedule('a', deadlines['a'])
+        wheel.schedule('b', deadlines['b'])
+
+        assert wheel.advance(3, deadlines.get) == ['a']
+        assert wheel.advance(6, deadlines.get) == []
+        assert wheel.advance(10, deadlines.get) == ['b']
+        assert len(wheel) == 0
+
+
+class TestPipelineMemberExpiry:
+
+    def test_silent_node_is_declared_dead_and_leaves_routing_table(self):
+        pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.5.1', neighbors=[], member_ttl=10)
+        clock = FakeClock()
+        pipeline.members.clock = clock
+        pipeline.members._wheel = TimingWheel(tick=1, slots=16, start=clock.now)
+        pipeline.set_nodes_dict([17, 40])
+        assert list(pipeline.get_all_node()) == [5, 17, 40]
+
+        clock.now += 11
+        pipeline.members.refresh(17)
+        assert pipeline.expire_members() == [40]
+        assert list(pipeline.get_all_node()) == [5, 17]
+        assert 40 not in pipeline.routing_table.nodes
+        assert not pipeline.membership.get(40).alive
+
+    def test_announce_alive_bumps_own_incarnation(self):
+        pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.5.1', neighbors=[])
+        incarnation = pipeline.membership.get(5).incarnation
+        pipeline.announce_alive()
+        assert pipeline.membership.get(5).incarnation == incarnation + 1
+
+    def test_concurrent_updates_keep_store_and_routing_table_in_step(self):
+        pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.5.1', neighbors=[])
+
+        def revive():
+            for incarnation in range(1, 2000):
+                pipeline.restore_members([Member(40, incarnation, True)])
+
+        def kill():
+            for _ in range(2000):
+                pipeline.remove_node(40)
+
+        threads = [threading.Thread(target=revive), threading.Thread(target=kill)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        alive = pipeline.membership.get(40).alive
+        assert (40 in pipeline.members) == alive
+        assert (40 in pipeline.routing_table.nodes) == alive
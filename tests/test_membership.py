@@ -0,0 +1,99 @@
+import random
+
+from src.membership import Membership, Member
+
+
+def exchange(first: Membership, second: Membership) -> None:
+    first.merge(second.snapshot())
+    second.merge(first.snapshot())
+
+
+class TestMembership:
+
+    def test_newer_incarnation_wins_and_dead_wins_on_tie(self):
+        membership = Membership(1, incarnation=10)
+        membership.merge([[2, 5, 1]])
+        membership.merge([[2, 4, 0]])
+        assert 2 in membership
+
+        membership.merge([[2, 5, 0]])
+        assert 2 not in membership
+        membership.merge([[2, 5, 1]])
+        assert 2 not in membership
+
+        membership.merge([[2, 6, 1]])
+        assert membership.get(2) == Member(2, 6, True)
+
+    def test_capabilities_travel_with_entries_and_fill_in_later(self):
+        first = Membership(1, incarnation=10, capabilities=3)
+        second = Membership(2, incarnation=20)
+        # узел старой версии присылает записи без возможностей
+        second.merge(first.snapshot())
+        assert second.get(1) == Member(1, 10, True, 0)
+        digest = second.digest()
+
+        entries = first.snapshot()
+        assert second.merge(entries, first.capabilities_of(entries)) == [Member(1, 10, True, 3)]
+        assert second.digest() == digest
+        assert second.merge(entries, first.capabilities_of(entries)) == []
+        assert first.refresh() == [Member(1, 11, True, 3)]
+
+    def test_node_refutes_its_own_death(self):
+        membership = Membership(1, incarnation=10)
+        changes = membership.merge([[1, 10, 0]])
+
+        assert changes == [Member(1, 11, True)]
+        assert 1 in membership
+        assert membership.merge([[1, 9, 0]]) == []
+
+    def test_delta_contains_only_changes_after_version(self):
+        membership = Membership(1, incarnation=1)
+        membership.observe([2, 3])
+        version = membership.version
+
+        assert membership.delta_since(version) == []
+        membership.declare_dead(2)
+        membership.observe([3, 4])
+        assert sorted(membership.delta_since(version)) == [[2, 0, 0], [4, 0, 1]]
+
+    def test_merge_order_does_not_matter(self):
+        updates = [[2, 1, 1], [3, 1, 1], [2, 1, 0], [4, 2, 1], [3, 2, 1], [4, 1, 0]]
+        digests = set()
+        for _ in range(20):
+            random.shuffle(updates)
+            membership = Membership(1, incarnation=1)
+            for update in updates:
+                membership.merge([update])
+            digests.add(membership.digest())
+            assert membership.alive_nodes() == [1, 3, 4]
+
+        assert len(digests) == 1
+
+    def test_ring_converges_by_neighbour_deltas(self):
+        ring = [Membership(node, incarnation=1) for node in range(1, 21)]
+        sent = {}
+
+        for _ in range(len(ring)):
+            for index, membership in enumerate(ring):
+                for neighbour in (ring[index - 1], ring[(index + 1) % len(ring)]):
+                    key = (membership.my_node, neighbour.my_node)
+                    version = membership.version
+                    neighbour.merge(membership.delta_since(sent.get(key, 0)))
+                    sent[key] = version
+
+        assert len({membership.digest() for membership in ring}) == 1
+        assert ring[0].alive_nodes() == list(range(1, 21))
+
+        # в синхронном кольце соседу уходят только digest, изменений нет
+        assert ring[0].delta_since(sent[(1, 2)]) == []
+
+    def test_full_exchange_repairs_lost_deltas(self):
+        first, second = Membership(1, incarnation=1), Membership(2, incarnation=1)
+        first.observe([3, 4])
+        second.observe([5])
+        second.declare_dead(5)
+        assert first.digest() != second.digest()
+
+        exchange(first, second)
+        assert first.digest() == second.digest()
+        assert first.alive_nodes() == second.alive_nodes() == [1, 2, 3, 4]
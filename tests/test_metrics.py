@@ -0,0 +1,72 @@
+import urllib.request
+
+import pytest
+
+from src.metrics import MetricsRegistry, MetricsHttpServer
+from src.zmq_pipeline import ZmqPipelineNode
+
+
+class TestMetricsRegistry:
+
+    def test_counter_gauge_and_histogram_snapshot(self):
+        registry = MetricsRegistry()
+        registry.counter('packets_total').inc(3)
+        registry.gauge('ring_size', function=lambda: 7)
+        latency = registry.histogram('latency_seconds', buckets=(0.001, 0.01, 0.1))
+        for value in (0.0005, 0.005, 0.005, 0.05):
+            latency.observe(value)
+
+        snapshot = registry.snapshot()
+
+        assert snapshot['packets_total'] == 3
+        assert snapshot['ring_size'] == 7
+        assert snapshot['latency_seconds']['count'] == 4
+        assert snapshot['latency_seconds']['p50'] == 0.01
+        assert snapshot['latency_seconds']['p99'] == 0.1
+
+    def test_same_name_returns_same_metric_and_type_conflict_raises(self):
+        registry = MetricsRegistry()
+
+        assert registry.counter('events_total') is registry.counter('events_total')
+        with pytest.raises(ValueError):
+            registry.gauge('events_total')
+
+    def test_prometheus_text_has_cumulative_buckets(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram('latency_seconds', 'Задержка', buckets=(0.1, 1.0))
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        lines = registry.prometheus_text().splitlines()
+
+        assert '# TYPE latency_seconds histogram' in lines
+        assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+        assert 'latency_seconds_count 3' in lines
+
+    def test_http_endpoint_serves_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.counter('packets_total').inc()
+        server = MetricsHttpServer(registry, port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics', timeout=2) as response:
+                body = response.read().decode('utf-8')
+        finally:
+            server.close()
+
+        assert 'packets_total 1' in body.splitlines()
+
+    def test_pipeline_exports_ring_size_and_received_packets(self):
+        registry = MetricsRegistry()
+        pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.5.1', neighbors=[], metrics=registry)
+        pipeline.set_nodes_dict([1, 2, 3])
+        pipeline.received = 4
+
+        snapshot = registry.snapshot()
+        pipeline.context.term()
+
+        assert snapshot['ring_size'] == 4
+        assert snapshot['zmq_packets_received_total'] == 4
@@ -0,0 +1,123 @@
+import json
+import time
+import threading
+
+import pytest
+
+from src.mqtt_dispatcher import TopicTrie, CommandDispatcher
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class TestTopicTrie:
+
+    def test_wildcards_match_levels(self):
+        trie = TopicTrie()
+        for pattern in ('/leader/network', '/leader/+', '/leader/#', '#', 'a/+/c', 'a/b'):
+            trie.add(pattern, pattern)
+
+        assert trie.match('/leader/network') == ['#', '/leader/#', '/leader/network', '/leader/+']
+        assert trie.match('/leader') == ['#', '/leader/#']
+        assert trie.match('a/x/c') == ['#', 'a/+/c']
+        assert trie.match('a/b/c/d') == ['#']
+        assert trie.match('$SYS/x') == []
+
+    def test_invalid_pattern_is_rejected(self):
+        trie = TopicTrie()
+        for pattern in ('a/#/b', 'a/b+', 'a#'):
+            with pytest.raises(ValueError):
+                trie.add(pattern, None)
+
+    def test_cache_is_reset_by_new_subscription(self):
+        trie = TopicTrie()
+        trie.add('a/b', 1)
+        assert trie.match('a/b') == [1]
+        trie.add('a/+', 2)
+        assert trie.match('a/b') == [1, 2]
+
+
+class TestCommandDispatcher:
+
+    def test_commands_go_to_registered_handlers_off_the_calling_thread(self):
+        handled = []
+        dispatcher = CommandDispatcher(workers=2)
+        dispatcher.subscribe('/leader/#')
+        dispatcher.register('ping', lambda payload, topic: handled.append(('ping', topic, threading.current_thread())))
+        dispatcher.register(None, lambda payload, topic: handled.append(('default', topic, payload['command'])))
+        dispatcher.start()
+
+        assert dispatcher.dispatch('/leader/network', json.dumps({'command': 'ping'}).encode())
+        assert dispatcher.dispatch('/leader/x', json.dumps({'command': 'update'}).encode())
+        assert not dispatcher.dispatch('/other', b'{}')
+        assert dispatcher.dispatch('/leader/network', b'not json')
+        assert wait_for(lambda: len(handled) == 2)
+        dispatcher.close()
+
+        ping = next(item for item in handled if item[0] == 'ping')
+        assert ping[2] is not threading.current_thread()
+        assert ('default', '/leader/x', 'update') in handled
+        assert dispatcher.stats()['unmatched'] == 1
+        assert dispatcher.stats()['malformed'] == 1
+
+    def test_commands_of_one_topic_keep_order(self):
+        handled = []
+        dispatcher = CommandDispatcher(workers=4)
+        dispatcher.subscribe('+')
+        dispatcher.register(None, lambda payload, topic: handled.append((topic, payload['n'])))
+        dispatcher.start()
+        for number in range(300):
+            dispatcher.dispatch(f't{number % 3}', json.dumps({'command': 'x', 'n': number}).encode())
+        dispatcher.close()
+
+        for topic in ('t0', 't1', 't2'):
+            numbers = [number for handled_topic, number in handled if handled_topic == topic]
+            assert numbers == sorted(numbers) and len(numbers) == 100
+
+    def test_rate_limit_is_per_subscription(self):
+        handled = []
+        dispatcher = CommandDispatcher(workers=0)
+        dispatcher.subscribe('/limited', rate_limit=1, burst=3)
+        dispatcher.subscribe('/free')
+        dispatcher.register(None, lambda payload, topic: handled.append(topic))
+
+        accepted = [dispatcher.dispatch('/limited', b'{"command": "x"}') for _ in range(10)]
+        for _ in range(10):
+            dispatcher.dispatch('/free', b'{"command": "x"}')
+
+        assert accepted.count(True) == 3
+        assert dispatcher.rate_limited == 7
+        assert handled.count('/free') == 10
+
+    def test_topics_of_one_pattern_have_separate_buckets_in_bounded_lru(self):
+        dispatcher = CommandDispatcher(workers=0, rate_limit_topics=2)
+        dispatcher.subscribe('/node/+', rate_limit=1, burst=1)
+
+        assert dispatcher.dispatch('/node/1', b'{}')
+        # шумный топик не расходует частоту соседнего топика той же подписки
+        assert not dispatcher.dispatch('/node/1', b'{}')
+        assert dispatcher.dispatch('/node/2', b'{}')
+        assert dispatcher.dispatch('/node/3', b'{}')
+        # ведро /node/1 вытеснено двумя более свежими топиками
+        assert dispatcher.dispatch('/node/1', b'{}')
+        assert dispatcher.rate_limited == 1
+
+    def test_full_queue_drops_without_blocking(self):
+        release = threading.Event()
+        dispatcher = CommandDispatcher(workers=1, queue_size=1)
+        dispatcher.subscribe('#')
+        dispatcher.register(None, lambda payload, topic: release.wait(2))
+        dispatcher.start()
+
+        started = time.monotonic()
+        results = [dispatcher.dispatch('t', b'{}') for _ in range(5)]
+        assert time.monotonic() - started < 0.5
+        release.set()
+        dispatcher.close()
+
+        assert not all(results)
+        assert dispatcher.stats()['dropped'] == results.count(False)
@@ -4,7 +4,66 @@ from src.node_monitor import NodeMonitor
 class TestNodeMonitor:
 
     def test_set_closest_neighbors(self):
-        assert NodeMonitor(node_number=1,
+        assert NodeMonitor(node_id=1,
                            ping_port=80,
                            host_ip='10.20.1.1'
-                           )._NodeMonitor__set_closest_neighbors() == ['10.20.255.1', '10.20.2.1']
+                           ).discovery.closest_candidates() == ['10.20.255.1', '10.20.2.1']
+
+    def test_check_back_neighbors_reports_closer_returning_node(self):
+        monitor = NodeMonitor(node_id=10, ping_port=80, host_ip='10.20.10.1')
+        monitor.set_neighbors(['10.20.5.1', '10.20.20.1'])
+        nodes = {node: None for node in (5, 10, 20, 30)}
+
+        assert monitor.check_back_neighbors(['10.20.7.1', '10.20.20.1'], nodes) == ('10.20.7.1',)
+        assert monitor.check_back_neighbors(['10.20.5.1', '10.20.20.1'], nodes) == ()
+
+
+class RecordingDiscovery:
+    def __init__(self, alive: set):
+        self.alive = alive
+        self.probes = []
+        self.scans = 0
+        self.probes_started = 0
+
+    def probe(self, nodes) -> set:
+        nodes = set(nodes)
+        self.probes.append(nodes)
+        return nodes & self.alive
+
+    def find_neighbors(self) -> tuple:
+        self.scans += 1
+        return '10.20.2.1', '10.20.250.1'
+
+
+class TestSuccessorLists:
+
+    def test_successor_lists_wrap_around_the_ring(self):
+        monitor = NodeMonitor(node_id=9, ping_port=80, host_ip='10.20.9.1', successor_list_size=2)
+
+        assert monitor.update_successor_lists((1, 5, 9, 13, 17))
+        assert monitor.successors == [13, 17]
+        assert monitor.predecessors == [5, 1]
+
+        assert monitor.update_successor_lists((5, 13))
+        assert monitor.successors == [13, 5]
+        assert monitor.predecessors == [5, 13]
+
+        assert not monitor.update_successor_lists((9,))
+
+    def test_repair_probes_nearest_known_nodes_in_one_round(self):
+        discovery = RecordingDiscovery(alive={1, 17, 21})
+        monitor = NodeMonitor(node_id=9, ping_port=80, host_ip='10.20.9.1', discovery=discovery,
+                              successor_list_size=2)
+
+        assert monitor.get_neighbors((1, 5, 9, 13, 17, 21)) == ['10.20.1.1', '10.20.17.1']
+        assert discovery.probes == [{1, 5, 13, 17}]
+        assert discovery.scans == 0
+
+    def test_full_scan_when_no_known_node_answers(self):
+        discovery = RecordingDiscovery(alive={21})
+        monitor = NodeMonitor(node_id=9, ping_port=80, host_ip='10.20.9.1', discovery=discovery,
+                              successor_list_size=2)
+
+        assert monitor.get_neighbors((1, 5, 9, 13, 17, 21)) == ['10.20.2.1', '10.20.250.1']
+        assert discovery.scans == 1
+        assert monitor.metrics.get('ring_repair_full_scan_total').get() == 1
@@ -0,0 +1,106 @@
+import json
+import time
+import asyncio
+import threading
+
+import pytest
+
+from src.publish_queue import PublishQueue, AsyncPublishQueue
+
+
+def wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+class TestPublishQueue:
+
+    def test_messages_are_published_in_order(self):
+        published = []
+        publish_queue = PublishQueue(publish=published.append)
+        publish_queue.start()
+        for number in range(5):
+            assert publish_queue.put({'event': number})
+        publish_queue.close()
+
+        assert [json.loads(payload) for payload in published] == [{'event': number} for number in range(5)]
+        assert publish_queue.stats()['published'] == 5
+
+    def test_batching_coalesces_messages_within_interval(self):
+        published = []
+        publish_queue = PublishQueue(publish=published.append, batch_interval=0.2, max_batch=3)
+        publish_queue.start()
+        for number in range(4):
+            publish_queue.put({'event': number})
+        publish_queue.close()
+
+        assert [json.loads(payload) for payload in published] == [
+            {'batch': [{'event': 0}, {'event': 1}, {'event': 2}]},
+            {'batch': [{'event': 3}]},
+        ]
+        assert publish_queue.stats()['batches'] == 2
+
+    def test_drop_policy_does_not_wait_for_slow_broker(self):
+        release = threading.Event()
+        publish_queue = PublishQueue(publish=lambda payload: release.wait(), max_size=2)
+        publish_queue.start()
+
+        publish_queue.put({'event': 0})
+        wait_for(lambda: publish_queue.depth() == 0)
+        started = time.monotonic()
+        results = [publish_queue.put({'event': number}) for number in range(1, 5)]
+        assert time.monotonic() - started < 0.1
+        assert results == [True, True, False, False]
+        assert publish_queue.stats()['dropped'] == 2
+
+        release.set()
+        publish_queue.close()
+
+    def test_block_policy_waits_for_free_space(self):
+        release = threading.Event()
+        publish_queue = PublishQueue(publish=lambda payload: release.wait(), max_size=1,
+                                     policy='block', block_timeout=0.05)
+        publish_queue.start()
+
+        publish_queue.put({'event': 0})
+        wait_for(lambda: publish_queue.depth() == 0)
+        assert publish_queue.put({'event': 1})
+        started = time.monotonic()
+        assert not publish_queue.put({'event': 2})
+        assert time.monotonic() - started >= 0.05
+
+        release.set()
+        publish_queue.close()
+
+    def test_unknown_policy_is_rejected(self):
+        with pytest.raises(ValueError):
+            PublishQueue(publish=print, policy='spill')
+
+
+class TestAsyncPublishQueue:
+
+    def test_publishes_batches_in_loop_and_flushes_on_close(self):
+        published = []
+
+        async def run():
+            publish_queue = AsyncPublishQueue(publish=published.append, max_size=4, batch_interval=0.05, max_batch=2)
+            publish_queue.start()
+            for number in range(3):
+                assert publish_queue.put({'event': number})
+            await asyncio.sleep(0.2)
+            for number in range(3, 8):
+                publish_queue.put({'event': number})
+            publish_queue.close()
+            return publish_queue.stats()
+
+        stats = asyncio.run(run())
+        # очередь на 4 сообщения: восьмое отброшено, остальные опубликованы при закрытии
+        assert [json.loads(payload) for payload in published] == [
+            {'batch': [{'event': 0}, {'event': 1}]}, {'batch': [{'event': 2}]},
+            {'batch': [{'event': 3}, {'event': 4}]}, {'batch': [{'event': 5}, {'event': 6}]}]
+        assert stats['published'] == 7 and stats['dropped'] == 1
+
+    def test_blocking_policy_is_rejected(self):
+        with pytest.raises(ValueError):
+            AsyncPublishQueue(publish=print, policy='block')
@@ -0,0 +1,123 @@
+from dataclasses import replace
+
+from src.codec import PacketCodec, ERAPMessage, ACK, LINK_GAP
+from src.reliable_link import ReliableLinks
+
+
+def make_links(sent: list, my_node: int = 1, **settings) -> ReliableLinks:
+    """Линии, которые вместо отправки складывают пары (адресат, сообщение) в sent"""
+
+    return ReliableLinks(my_node, send=lambda addressee, frames: sent.append((addressee, frames)) or True,
+                         encode=lambda message, addressee: replace(message),
+                         address_of=lambda node: f'10.20.{node}.1', **settings)
+
+
+def data(number: int) -> ERAPMessage:
+    return ERAPMessage(source=1, sender_neighbour=1, addressee=2, seq=number)
+
+
+def ack(links: ReliableLinks, addressee: str, number: int, credit: int, gap: bool = False) -> None:
+    epoch = links._senders[addressee].epoch
+    links.on_ack(addressee, ERAPMessage(source=2, sender_neighbour=0, addressee=0, msg_type=ACK,
+                                        flags=LINK_GAP if gap else 0,
+                                        link_epoch=epoch, link_seq=number, link_info=credit))
+
+
+class TestReliableLinks:
+
+    def test_window_limits_packets_in_flight_and_queue_is_bounded(self):
+        sent = []
+        links = make_links(sent, window=2, max_pending=3)
+
+        results = [links.send('10.20.2.1', data(number)) for number in range(6)]
+
+        assert results == [True] * 5 + [False]
+        assert [message.link_seq for _, message in sent] == [1, 2]
+        assert (links.in_flight(), links.pending(), links.dropped) == (2, 3, 1)
+
+        ack(links, '10.20.2.1', 2, credit=10)
+        assert [message.link_seq for _, message in sent[2:]] == [3, 4]
+        assert (links.in_flight(), links.pending()) == (2, 1)
+
+    def test_credit_of_receiver_limits_window(self):
+        sent = []
+        links = make_links(sent, window=8)
+        links.send('10.20.2.1', data(0))
+        ack(links, '10.20.2.1', 1, credit=1)
+
+        for number in range(1, 4):
+            links.send('10.20.2.1', data(number))
+
+        assert len(sent) == 2
+        assert links.pending() == 2
+
+    def test_receiver_accepts_in_order_and_reports_gap_once(self):
+        sent = []
+        links = make_links(sent, my_node=2, ack_every=100)
+
+        def packet(number: int, base: int = 1) -> ERAPMessage:
+            return ERAPMessage(source=1, sender_neighbour=1, addressee=2, link_epoch=7, link_seq=number, link_info=base)
+
+        assert links.accept(packet(1))
+        assert not links.accept(packet(3))
+        assert not links.accept(packet(4))
+        assert not links.accept(packet(1))
+
+        acks = [message for _, message in sent]
+        assert [(message.link_seq, bool(message.flags & LINK_GAP)) for message in acks] == [(1, True), (1, False)]
+        assert (links.gaps, links.duplicates) == (2, 1)
+
+        # перезапущенный отправитель - новая эпоха, приём с его самого старого неподтверждённого номера
+        restarted = ERAPMessage(source=1, sender_neighbour=1, addressee=2, link_epoch=8, link_seq=6, link_info=5)
+        assert not links.accept(restarted)
+        assert sent[-1][1].link_seq == 4
+
+    def test_unacknowledged_packets_are_retransmitted_then_given_up(self):
+        sent = []
+        links = make_links(sent, retransmit_timeout=0, max_retransmits=2)
+        links.send('10.20.2.1', data(0))
+        links.send('10.20.2.1', data(1))
+        epoch = links._senders['10.20.2.1'].epoch
+
+        links.tick()
+        links.tick()
+        assert links.retransmitted == 4
+        assert [message.link_seq for _, message in sent] == [1, 2, 1, 2, 1, 2]
+
+        links.tick()
+        assert (links.lost, links.in_flight()) == (2, 0)
+        assert links._senders['10.20.2.1'].epoch != epoch
+
+    def test_lossy_link_delivers_every_packet_once_in_order(self):
+        delivered, dropped = [], [0]
+        sender = receiver = None
+
+        def to_receiver(addressee, frames):
+            message, _ = codec.decode(frames)
+            # теряется каждый седьмой пакет данных
+            dropped[0] += 1
+            if dropped[0] % 7 and receiver.accept(message):
+                delivered.append(message.seq)
+
+        def to_sender(addressee, frames):
+            sender.on_ack('10.20.2.1', codec.decode(frames)[0])
+
+        codec = PacketCodec()
+        encode = lambda message, addressee: codec.encode(message, binary=True)
+        sender = ReliableLinks(1, send=to_receiver, encode=encode, address_of=codec.address, window=16,
+                               retransmit_timeout=0)
+        receiver = ReliableLinks(2, send=to_sender, encode=encode, address_of=codec.address, ack_every=4)
+
+        for number in range(1, 201):
+            sender.send('10.20.2.1', data(number))
+            if number % 10 == 0:
+                receiver.flush_acks()
+        for _ in range(50):
+            if not sender.in_flight() and not sender.pending():
+                break
+            sender.tick()
+            receiver.flush_acks()
+
+        assert delivered == list(range(1, 201))
+        assert sender.retransmitted > 0
+        assert sender.lost == 0
@@ -0,0 +1,106 @@
+import random
+
+from src.routing_table import RingRoutingTable
+from src.utils import NeighbourChecker as checker
+
+
+def legacy_next_hop(nodes: tuple, my_node: int, from_node: int):
+    """Выбор следующего узла в том виде, в каком его делал ZmqPipelineNode.__identify_addressee"""
+
+    addressed_node = None
+    if len(nodes) > 2:
+        if not checker.is_node_outermost(node_id=my_node, nodes=nodes):
+            if from_node > my_node:
+                addressed_node = nodes[nodes.index(my_node) - 1]
+            elif from_node < my_node:
+                addressed_node = nodes[nodes.index(my_node) + 1]
+        else:
+            if checker.is_node_first(node_id=my_node, nodes=nodes):
+                if from_node == nodes[-1]:
+                    addressed_node = nodes[1]
+                else:
+                    addressed_node = nodes[-1]
+            elif checker.is_node_last(node_id=my_node, nodes=nodes):
+                if from_node == nodes[0]:
+                    addressed_node = nodes[-2]
+                else:
+                    addressed_node = nodes[0]
+    elif len(nodes) == 2:
+        if my_node in nodes:
+            return from_node
+        for node in nodes:
+            if node != from_node:
+                addressed_node = node
+    else:
+        addressed_node = nodes[0]
+
+    return addressed_node
+
+
+class TestRingRoutingTable:
+
+    def test_matches_legacy_routing_on_random_rings(self):
+        rand = random.Random(42)
+        for _ in range(200):
+            nodes = tuple(sorted(rand.sample(range(1, 256), rand.randint(1, 12))))
+            my_node = rand.choice(nodes)
+            table = RingRoutingTable(my_node, nodes)
+            for from_node in nodes:
+                assert table.next_hop(from_node) == legacy_next_hop(nodes, my_node, from_node)
+
+    def test_incremental_updates_match_rebuild(self):
+        rand = random.Random(7)
+        table = RingRoutingTable(100, [100])
+        members = {100}
+        for _ in range(300):
+            node = rand.randint(1, 255)
+            if node == 100:
+                continue
+            if node in members and rand.random() < 0.5:
+                assert table.remove(node)
+                members.remove(node)
+            else:
+                assert table.add([node]) == (node not in members)
+                members.add(node)
+
+            assert table.nodes == tuple(sorted(members))
+            for from_node in members:
+                assert table.next_hop(from_node) == legacy_next_hop(table.nodes, 100, from_node)
+
+    def test_ring_wraps_at_outermost_nodes(self):
+        table = RingRoutingTable(1, [1, 5, 9])
+        assert table.next_hop(9) == 5
+        assert table.next_hop(5) == 9
+
+        table = RingRoutingTable(9, [1, 5, 9])
+        assert table.next_hop(1) == 5
+        assert table.next_hop(5) == 1
+
+    def test_unknown_sender_has_no_route(self):
+        table = RingRoutingTable(5, [1, 5, 9])
+        assert 3 not in table
+        assert table.next_hop(3) is None
+        assert not table.remove(3)
+
+    def test_unicast_reaches_any_node_in_logarithmic_hops(self):
+        nodes = sorted(random.Random(12).sample(range(1, 255), 200))
+        tables = {node: RingRoutingTable(node, nodes) for node in nodes}
+
+        for shortcuts, limit in ((True, 8), (False, 100)):
+            for source in nodes[::7]:
+                for target in nodes[::5]:
+                    current, hops = source, 0
+                    while current != target:
+                        current = tables[current].unicast_hop(target, shortcuts=shortcuts)
+                        hops += 1
+                    assert hops <= limit
+
+    def test_unicast_goes_the_shorter_way_around(self):
+        table = RingRoutingTable(1, range(1, 11))
+
+        assert table.unicast_hop(4) == 2
+        assert table.unicast_hop(8) == 10
+        assert table.unicast_hop(4, shortcuts=True) == 3
+        assert table.unicast_hop(7, shortcuts=True) == 7
+        assert table.unicast_hop(1) is None
+        assert table.unicast_hop(42) is None
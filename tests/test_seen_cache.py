@@ -0,0 +1,42 @@
+from src.seen_cache import SeenCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestSeenCache:
+
+    def test_duplicate_is_reported(self):
+        cache = SeenCache(clock=FakeClock())
+
+        assert not cache.check_and_add((3, 1))
+        assert cache.check_and_add((3, 1))
+        assert not cache.check_and_add((3, 2))
+        assert not cache.check_and_add((4, 1))
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = SeenCache(ttl=10, clock=clock)
+        cache.check_and_add((3, 1))
+
+        clock.now = 9.9
+        assert cache.check_and_add((3, 1))
+        clock.now = 10.0
+        assert not cache.check_and_add((3, 1))
+        assert cache.expired == 1
+
+    def test_size_is_bounded(self):
+        cache = SeenCache(max_entries=100, clock=FakeClock())
+        for seq in range(1000):
+            cache.check_and_add((1, seq))
+
+        assert len(cache) == 100
+        assert cache.evicted == 900
+        assert cache.check_and_add((1, 999))
+        assert not cache.check_and_add((1, 0))
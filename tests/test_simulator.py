@@ -0,0 +1,224 @@
+import json
+import time
+import asyncio
+import threading
+
+from src.address_plan import CidrAddressPlan
+from src.simulator import (RingSimulator, SimulatedNetwork, SimulatedNode, SimulatedAsyncNode, LocalMqttBroker,
+                           LocalMqttClient)
+
+
+class TestLocalMqtt:
+
+    def test_client_receives_messages_of_subscribed_topic(self):
+        broker = LocalMqttBroker()
+        client = LocalMqttClient(broker)
+        received = []
+        client.on_message = lambda client, userdata, message: received.append((message.topic, message.payload))
+        client.subscribe('/leader/network')
+
+        broker.publish('/leader/network', json.dumps({'command': 'x'}))
+        broker.publish('/leader/core', 'ignored')
+        client.disconnect()
+        broker.publish('/leader/network', 'after disconnect')
+
+        assert received == [('/leader/network', b'{"command": "x"}')]
+
+
+class TestNeighbourSuspicion:
+
+    def test_suspected_neighbour_found_alive_is_not_reported_gone(self):
+        network = SimulatedNetwork()
+        node_ids = [5, 17, 42]
+        for node_id in node_ids:
+            network.set_alive(node_id, True)
+        nodes = [SimulatedNode(network, node_id) for node_id in node_ids]
+        try:
+            node = nodes[1]
+            neighbors = list(node._neighbors)
+            members = set(node.zmq_pipeline.get_all_node())
+            assert len(neighbors) == 2
+            # соседи молчат дольше max_silence, но по-прежнему отвечают на проверку
+            node.failure_detector.clock = lambda: time.monotonic() + 10
+            node._Node__check_neighbors_by_heartbeat()
+
+            assert node._neighbors == neighbors
+            assert node.metrics.get('neighbour_gone_total').get() == 0
+            assert node.failure_detector.stats()['false_positives'] == 2
+            assert node.metrics.get('failure_detector_false_positives_total').get() == 2
+            assert 'failure_detector_false_positive_rate 1' in node.metrics.prometheus_text()
+            assert node.failure_detector.check() == ()
+            assert set(node.zmq_pipeline.get_all_node()) == members
+        finally:
+            for node in nodes:
+                node.stop()
+            # цикл приёма не запускался, поэтому сокеты узлов закрываются вместе с контекстом
+            network.context.destroy(linger=0)
+
+
+class TestNeighbourChange:
+
+    def test_replaced_neighbour_releases_sender_socket(self):
+        network = SimulatedNetwork()
+        node_ids = [5, 17, 42]
+        for node_id in node_ids:
+            network.set_alive(node_id, True)
+        nodes = [SimulatedNode(network, node_id) for node_id in node_ids]
+        try:
+            node = nodes[1]
+            address_of = network.address_plan.address_of
+            assert sorted(node._neighbors) == sorted([address_of(5), address_of(42)])
+            node.zmq_pipeline.send_heartbeats(node._neighbors)
+            assert node.zmq_pipeline.sender_pool.stats()['size'] == 2
+
+            # между узлами 17 и 42 появился узел 30: узел 42 жив, но больше не сосед
+            network.set_alive(30, True)
+            node._update_neighbors([address_of(5), address_of(30)], gone_neighbors=())
+
+            pool = node.zmq_pipeline.sender_pool.stats()
+            assert pool['size'] == 1
+            assert pool['evictions'] == 1
+        finally:
+            for node in nodes:
+                node.stop()
+            network.context.destroy(linger=0)
+
+
+class TestAsyncNodeStop:
+
+    @staticmethod
+    def run_and_stop(running: list, alive: list, stop_after: float) -> list:
+        """Запускает AsyncNode узлов running среди живых alive, через stop_after секунд вызывает stop()
+        и ждёт, что run() каждого узла завершится сам
+        """
+
+        network = SimulatedNetwork()
+        for node_id in alive:
+            network.set_alive(node_id, True)
+        nodes = [SimulatedAsyncNode(network, node_id, heartbeat_interval=0.1) for node_id in running]
+
+        async def run():
+            threads = set(threading.enumerate())
+            tasks = [asyncio.ensure_future(node.run()) for node in nodes]
+            await asyncio.sleep(stop_after)
+            # mqtt обслуживается в том же event loop: ни публикатора, ни обработчиков команд в потоках
+            assert not [thread.name for thread in set(threading.enumerate()) - threads
+                        if thread.name.startswith('mqtt-')]
+            for node in nodes:
+                node.stop()
+            await asyncio.wait_for(asyncio.gather(*tasks), timeout=3)
+
+        try:
+            asyncio.run(run())
+        finally:
+            network.context.destroy(linger=0)
+        return nodes
+
+    def test_stop_ends_run_while_waiting_for_membership_sync(self):
+        # сосед 17 отвечает на проверку, но не запущен - gossip никогда не подтвердится
+        node, = self.run_and_stop(running=[5], alive=[5, 17], stop_after=0.5)
+        assert node.metrics.get('startup_ready_seconds') is None
+
+    def test_stop_ends_run_of_working_nodes(self):
+        nodes = self.run_and_stop(running=[5, 17], alive=[5, 17], stop_after=1.5)
+        assert all(node.metrics.get('startup_ready_seconds') is not None for node in nodes)
+
+
+class TestRingSimulator:
+
+    def test_ring_converges_after_start_kill_and_rejoin(self):
+        simulator = RingSimulator(heartbeat_interval=0.1, heartbeat_max_silence=1.0)
+        node_ids = [5, 17, 42, 77, 130, 201]
+        try:
+            simulator.start(node_ids)
+            assert simulator.wait_converged(timeout=30) is not None
+
+            result = simulator.broadcast_commands(origin=5, count=10, timeout=10)
+            assert result['delivered'] == 10
+
+            full_scans = simulator.nodes[42].metrics.get('ring_repair_full_scan_total').get()
+            simulator.kill(77)
+            assert simulator.wait_converged(timeout=30) is not None
+            # соседи ушедшего узла нашлись по списку ближайших узлов кольца, без полного поиска
+            assert simulator.nodes[42].metrics.get('ring_repair_successor_list_total').get() >= 1
+            assert simulator.nodes[42].metrics.get('ring_repair_full_scan_total').get() == full_scans
+            assert set(simulator.nodes[42].zmq_pipeline.get_all_node()) == {5, 17, 42, 130, 201}
+
+            simulator.rejoin(77)
+            assert simulator.wait_converged(timeout=30) is not None
+            assert set(simulator.nodes[201].zmq_pipeline.get_all_node()) == set(node_ids)
+        finally:
+            simulator.stop()
+
+    def test_ring_with_node_ids_above_255(self):
+        network = SimulatedNetwork(CidrAddressPlan('10.0.0.0/16', stride=1, offset=0))
+        simulator = RingSimulator(network, heartbeat_interval=0.1, heartbeat_max_silence=1.0)
+        node_ids = [7, 300, 4097, 65000]
+        try:
+            simulator.start(node_ids)
+            assert simulator.wait_converged(timeout=30) is not None
+            assert simulator.broadcast_commands(origin=300, count=5, timeout=10)['delivered'] == 5
+        finally:
+            simulator.stop()
+
+    def test_reliable_links_deliver_broadcast_after_restart(self):
+        simulator = RingSimulator(link_mode='reliable', heartbeat_interval=0.1, heartbeat_max_silence=1.0)
+        node_ids = [5, 17, 42, 77, 130]
+        try:
+            simulator.start(node_ids)
+            assert simulator.wait_converged(timeout=30) is not None
+            simulator.kill(77)
+            assert simulator.wait_converged(timeout=30) is not None
+            simulator.rejoin(77)
+            assert simulator.wait_converged(timeout=30) is not None
+            # кадры, ушедшие к 77 до того, как его признали мёртвым, законно теряются при смене соседа
+            lost = simulator.nodes[42].zmq_pipeline.links.stats()['lost']
+
+            assert simulator.broadcast_commands(origin=5, count=50, timeout=10)['delivered'] == 50
+            assert simulator.nodes[42].zmq_pipeline.links.stats()['lost'] == lost
+        finally:
+            simulator.stop()
+
+    def test_compressed_links_deliver_broadcast(self):
+        simulator = RingSimulator(compression='zlib', compression_threshold=1)
+        node_ids = [5, 17, 42, 77]
+        try:
+            simulator.start(node_ids)
+            assert simulator.wait_converged(timeout=30) is not None
+
+            assert simulator.broadcast_commands(origin=5, count=20, timeout=10)['delivered'] == 20
+            assert simulator.nodes[42].metrics.get('zmq_payloads_compressed_total').get() > 0
+        finally:
+            simulator.stop()
+
+    def test_fanout_broadcast_covers_ring(self):
+        simulator = RingSimulator(broadcast_mode='fanout', fanout=2)
+        node_ids = [5, 17, 42, 77, 130, 200]
+        try:
+            simulator.start(node_ids)
+            assert simulator.wait_converged(timeout=30) is not None
+
+            result = simulator.broadcast_commands(origin=17, count=20, timeout=10)
+            assert result['delivered'] == 20 and result['coverage'] == 1.0
+            assert sum(simulator.nodes[node].zmq_pipeline.duplicates_dropped for node in node_ids) == 0
+        finally:
+            simulator.stop()
+
+    def test_restart_from_snapshot_skips_full_scan(self, tmp_path):
+        simulator = RingSimulator(snapshot_path=str(tmp_path / 'node-{node}.bin'), snapshot_interval=0.1,
+                                  heartbeat_interval=0.1, heartbeat_max_silence=1.0)
+        node_ids = [5, 17, 42, 77, 130]
+        try:
+            simulator.start(node_ids)
+            assert simulator.wait_converged(timeout=30) is not None
+            simulator.kill(77)
+            assert simulator.wait_converged(timeout=30) is not None
+            simulator.rejoin(77)
+            assert simulator.wait_converged(timeout=30) is not None
+
+            metrics = simulator.nodes[77].metrics
+            assert metrics.get('startup_snapshot_members').get() == len(node_ids)
+            assert metrics.get('ring_repair_successor_list_total').get() == 1
+            assert metrics.get('ring_repair_full_scan_total').get() == 0
+        finally:
+            simulator.stop()
@@ -0,0 +1,56 @@
+import os
+import time
+
+from src.membership import Member
+from src.member_store import TimingWheel
+from src.snapshot import RingSnapshot
+from src.zmq_pipeline import ZmqPipelineNode
+
+
+class TestRingSnapshot:
+
+    def test_roundtrip_keeps_members_and_seen_time(self, tmp_path):
+        snapshot = RingSnapshot(str(tmp_path / 'ring.bin'))
+        seen = int(time.time())
+        snapshot.save(42, [(17, 5, True, seen), (42, 9, True, seen), (60, 3, False, 0)])
+
+        state = snapshot.load(42)
+        assert state.members == [Member(17, 5, True), Member(42, 9, True), Member(60, 3, False)]
+        assert state.seen_at == {17: seen, 42: seen, 60: 0}
+        assert os.listdir(tmp_path) == ['ring.bin']
+
+    def test_snapshot_of_other_node_stale_or_damaged_is_ignored(self, tmp_path):
+        path = str(tmp_path / 'ring.bin')
+        snapshot = RingSnapshot(path, max_age=60)
+        assert snapshot.load(42) is None
+
+        snapshot.save(42, [(17, 5, True, 0)])
+        assert snapshot.load(43) is None
+        assert RingSnapshot(path, max_age=-1).load(42) is None
+
+        with open(path, 'r+b') as snapshot_file:
+            snapshot_file.truncate(os.path.getsize(path) - 1)
+        assert snapshot.load(42) is None
+
+
+class TestRestoreMembers:
+
+    def test_long_silent_members_are_dropped_and_others_expire_from_seen_time(self):
+        pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.5.1', neighbors=[], member_ttl=10)
+        clock = [1000.0]
+        pipeline.members.clock = lambda: clock[0]
+        pipeline.members._wheel = TimingWheel(tick=1, slots=16, start=clock[0])
+        now = time.time()
+        pipeline.restore_members([Member(17, 3, True), Member(40, 2, True), Member(60, 4, False)],
+                                 {17: now - 8, 40: now - 30, 60: 0})
+
+        assert list(pipeline.get_all_node()) == [5, 17]
+        assert pipeline.membership.get(40) is None
+        assert not pipeline.membership.get(60).alive
+
+        # узел 17 молчал 8 с до перезапуска - его запись истекает через 2 с, а не через member_ttl
+        clock[0] += 1
+        assert pipeline.expire_members() == []
+        clock[0] += 2
+        assert pipeline.expire_members() == [17]
+        assert not pipeline.membership.get(17).alive
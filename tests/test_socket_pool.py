@@ -0,0 +1,53 @@
+import zmq
+
+from src.socket_pool import SenderSocketPool
+
+
+class TestSenderSocketPool:
+
+    def test_reuses_socket_for_same_addressee(self):
+        context = zmq.Context()
+        receiver = context.socket(zmq.PULL)
+        port = receiver.bind_to_random_port('tcp://127.0.0.1')
+        pool = SenderSocketPool(context, port)
+
+        for i in range(3):
+            assert pool.send('127.0.0.1', [bytes([i])])
+        assert [receiver.recv() for _ in range(3)] == [b'\x00', b'\x01', b'\x02']
+        assert pool.stats() == {'size': 1, 'hits': 2, 'misses': 1, 'evictions': 0, 'dropped': 0}
+
+        pool.close()
+        receiver.close()
+        context.term()
+
+    def test_evict_closes_socket_and_reconnects_lazily(self):
+        context = zmq.Context()
+        receiver = context.socket(zmq.PULL)
+        port = receiver.bind_to_random_port('tcp://127.0.0.1')
+        pool = SenderSocketPool(context, port)
+
+        pool.send('127.0.0.1', [b'1'])
+        pool.evict('127.0.0.1')
+        pool.evict('127.0.0.1')
+        assert pool.stats()['size'] == 0
+        assert pool.evictions == 1
+
+        pool.send('127.0.0.1', [b'2'])
+        assert pool.misses == 2
+
+        pool.close()
+        receiver.close()
+        context.term()
+
+    def test_full_queue_drops_packet_but_keeps_socket(self):
+        context = zmq.Context()
+        # получателя нет, поэтому очередь заполняется первым же пакетом
+        pool = SenderSocketPool(context, 1, send_hwm=1, endpoint_of=lambda addressee: 'inproc://nobody')
+
+        assert pool.send('127.0.0.1', [b'1'])
+        assert not pool.send('127.0.0.1', [b'2'])
+        assert not pool.send('127.0.0.1', [b'3'])
+        assert pool.stats() == {'size': 1, 'hits': 2, 'misses': 1, 'evictions': 0, 'dropped': 2}
+
+        pool.close()
+        context.term()
@@ -0,0 +1,32 @@
+import os
+import sys
+import time
+import subprocess
+
+from src.utils import wait_for_address
+
+
+class TestUtils:
+
+    def test_import_does_not_enumerate_interfaces(self):
+        code = ('import psutil\n'
+                'def fail(*args, **kwargs):\n'
+                '    raise SystemExit("interfaces enumerated at import")\n'
+                'psutil.net_if_addrs = fail\n'
+                'import src.node, src.async_node, src.simulator\n')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, timeout=30)
+
+        assert result.returncode == 0, result.stderr
+
+    def test_wait_for_address_returns_once_lookup_succeeds(self):
+        answers = iter([None, None, '10.20.5.1'])
+
+        started = time.monotonic()
+        address = wait_for_address(lambda: next(answers), poll_interval=0.01, recheck_interval=0.01)
+
+        assert address == '10.20.5.1'
+        assert time.monotonic() - started < 1
+
+    def test_wait_for_address_times_out(self):
+        assert wait_for_address(lambda: None, poll_interval=0.01, recheck_interval=0.01, timeout=0.05) is None
@@ -0,0 +1,95 @@
+import time
+import asyncio
+import threading
+
+from src.worker_pool import ShardedWorkerPool, AsyncShardedWorkerPool
+
+
+class TestShardedWorkerPool:
+
+    def test_items_with_same_key_keep_order(self):
+        handled = []
+        pool = ShardedWorkerPool(handled.append, workers=4)
+        pool.start()
+        for number in range(200):
+            pool.submit(number % 7, (number % 7, number))
+        pool.close()
+
+        for key in range(7):
+            numbers = [number for item_key, number in handled if item_key == key]
+            assert numbers == sorted(numbers)
+        assert pool.stats()['processed'] == 200
+
+    def test_slow_key_does_not_block_other_workers(self):
+        release = threading.Event()
+        handled = []
+
+        def handler(item):
+            if item == 'slow':
+                release.wait()
+            handled.append(item)
+
+        pool = ShardedWorkerPool(handler, workers=2)
+        pool.start()
+        pool.submit(0, 'slow')
+        pool.submit(1, 'fast')
+
+        deadline = time.monotonic() + 2
+        while 'fast' not in handled and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert handled == ['fast']
+
+        release.set()
+        pool.close()
+
+    def test_full_queue_rejects_after_timeout_and_reports_depth(self):
+        release = threading.Event()
+        pool = ShardedWorkerPool(lambda item: release.wait(), workers=1, queue_size=2)
+        pool.start()
+        pool.submit(0, 'busy')
+        time.sleep(0.05)
+
+        assert pool.submit(0, 1) and pool.submit(0, 2)
+        assert not pool.submit(0, 3, timeout=0.01)
+        assert pool.depths() == [2]
+        assert pool.stats()['rejected'] == 1
+
+        release.set()
+        pool.close()
+
+    def test_handler_error_does_not_stop_worker(self):
+        handled = []
+
+        def handler(item):
+            if item is None:
+                raise ValueError('bad packet')
+            handled.append(item)
+
+        pool = ShardedWorkerPool(handler, workers=1)
+        pool.start()
+        for item in (1, None, 2):
+            pool.submit(0, item)
+        pool.close()
+
+        assert handled == [1, 2]
+        assert pool.stats()['errors'] == 1
+
+    def test_async_pool_keeps_order_per_key(self):
+        handled = []
+
+        async def run():
+            pool = AsyncShardedWorkerPool(handled.append, workers=3, queue_size=4)
+            pool.start()
+            for number in range(60):
+                await pool.submit(number % 5, (number % 5, number))
+            while any(pool.depths()):
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.01)
+            pool.close()
+            return pool.stats()
+
+        stats = asyncio.run(run())
+        for key in range(5):
+            numbers = [number for item_key, number in handled if item_key == key]
+            assert numbers == sorted(numbers) and len(numbers) == 12
+        assert stats['processed'] == 60
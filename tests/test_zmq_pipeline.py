@@ -0,0 +1,84 @@
+import time
+import asyncio
+import threading
+
+import zmq
+
+from src.codec import ERAPMessage, GOSSIP, HEARTBEAT
+from src.zmq_pipeline import ZmqPipelineNode
+
+
+class TestReceiveLoop:
+
+    def test_malformed_gossip_is_dropped_and_receiver_keeps_running(self):
+        context = zmq.Context()
+        pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.5.1', neighbors=[], workers=0, context=context,
+                                   endpoint_of=lambda address: f'inproc://malformed-{address}')
+        pipeline.bind()
+        receiver = threading.Thread(target=pipeline.handle_received_packet, args=(None,), daemon=True)
+        receiver.start()
+        sender = context.socket(zmq.PUSH)
+        try:
+            sender.connect('inproc://malformed-10.20.5.1')
+            codec = pipeline.codec
+            sender.send_multipart(codec.pack(ERAPMessage(source=17, sender_neighbour=17, addressee=5,
+                                                         msg_type=GOSSIP, payload=b'not json')))
+            sender.send_multipart(codec.pack(ERAPMessage(source=17, sender_neighbour=0, addressee=0,
+                                                         msg_type=HEARTBEAT)))
+
+            deadline = time.monotonic() + 2
+            while pipeline.received < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert pipeline.received == 2
+            assert pipeline.malformed == 1
+            assert receiver.is_alive()
+        finally:
+            pipeline.stop()
+            receiver.join(timeout=2)
+            sender.close(linger=0)
+            context.destroy(linger=0)
+        assert not receiver.is_alive()
+
+
+class TestAsyncReceiveLoop:
+
+    @staticmethod
+    def run_until_shutdown(shutdown) -> ZmqPipelineNode:
+        """Запускает асинхронный цикл приёма, вызывает shutdown(pipeline, context) и ждёт завершения цикла.
+        shutdown может вернуть поток, который нужно дождаться до уничтожения контекста
+        """
+
+        context = zmq.Context()
+        pipeline = ZmqPipelineNode(zmq_port=5555, host_ip='10.20.5.1', neighbors=[], workers=0, context=context,
+                                   endpoint_of=lambda address: f'inproc://receive-{address}')
+
+        async def run():
+            receiver = asyncio.ensure_future(pipeline.handle_received_packet_async(None))
+            await asyncio.sleep(0.05)
+            thread = shutdown(pipeline, context)
+            try:
+                await asyncio.wait_for(receiver, timeout=2)
+            finally:
+                if thread is not None:
+                    thread.join(timeout=2)
+                    assert not thread.is_alive()
+
+        try:
+            asyncio.run(run())
+        finally:
+            context.destroy(linger=0)
+        return pipeline
+
+    def test_stop_ends_loop_and_closes_socket(self):
+        pipeline = self.run_until_shutdown(lambda pipeline, context: pipeline.stop())
+        assert pipeline.consumer_receiver_socket.closed
+
+    def test_terminated_context_ends_loop_instead_of_spinning(self):
+        def terminate(pipeline, context):
+            # term ждёт закрытия сокетов, которое делает сам цикл приёма при выходе
+            terminating = threading.Thread(target=context.term, daemon=True)
+            terminating.start()
+            return terminating
+
+        pipeline = self.run_until_shutdown(terminate)
+        assert pipeline.consumer_receiver_socket.closed